@@ -0,0 +1,787 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+from collections import defaultdict
+from xml.sax.saxutils import escape
+
+import pandas as pd
+from pagexml.parser import parse_pagexml_file
+from pagexml.helper.pagexml_helper import get_custom_tags
+
+import main
+from main import (
+    PREFIX,
+    CUSTOM_TAGS,
+    METADATA_CONCEPTS,
+    tagtype2resource,
+    get_selectors,
+    parse_page,
+    list_pages,
+    make_entity_annotation,
+    merge_annotations,
+    LinkingIndex,
+    add_entity_identifier,
+    generate_metadata,
+    generate_concept_metadata,
+    get_diaryname2fileprefix,
+    normalize_text,
+    JSONArrayWriter,
+)
+
+# Shape of the current corpus (1x): eight diaries with 587 pages, 993 regions,
+# 5410 lines of 43 characters on average and 3057 custom tags
+DIARIES = 8
+PAGES_PER_DIARY = 73
+ENTRIES_PER_PAGE = 1.4
+LINES_PER_REGION = (3, 10)
+CHARACTERS_PER_LINE = 43
+TAGS_PER_LINE = 0.5
+
+# Entities that continue on the next line, and are merged
+CONTINUATIONS = 0.05
+
+REGION_TYPES = {
+    "paragraph": 389,
+    "heading": 232,
+    "visual": 167,
+    "page-number": 111,
+    "caption": 68,
+}
+
+TAG_TYPES = {
+    "person": 1096,
+    "place": 505,
+    "atm_food": 483,
+    "date": 337,
+    "organization": 120,
+    "unclear": 97,
+    "abbrev": 67,
+    "blackening": 36,
+    "speech": 35,
+    "add": 23,
+    "sic": 20,
+}
+
+# Regions without text
+EMPTY_REGION_TYPES = ("visual",)
+
+PAGE_WIDTH = 2479
+PAGE_HEIGHT = 3508
+
+WORDS = (
+    "de het een en van in op dat met voor niet naar ook maar nog wel "
+    "vandaag gisteren morgen avond ochtend thuis brief boek straat huis "
+    "gegeten gelezen geschreven gewandeld geslapen gehoord gezien"
+).split()
+
+SYLLABLES = "ber di ka lo ma ni ro sa te vo el an ver hof dam burg".split()
+
+PAGEXML = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<PcGts xmlns="http://schema.primaresearch.org/PAGE/gts/pagecontent/2013-07-15">
+    <Metadata>
+        <Creator>benchmark.py</Creator>
+    </Metadata>
+    <Page imageFilename="{image}" imageWidth="{width}" imageHeight="{height}">
+{regions}
+    </Page>
+</PcGts>
+"""
+
+TEXTREGION = """        <TextRegion id="{id}" custom="readingOrder {{index:{index};}} structure {{type:{type};}}">
+            <Coords points="{points}"/>
+{lines}
+            <TextEquiv>
+                <Unicode></Unicode>
+            </TextEquiv>
+        </TextRegion>"""
+
+TEXTLINE = """            <TextLine id="{id}" custom="readingOrder {{index:{index};}}{tags}">
+                <Coords points="{points}"/>
+                <TextEquiv>
+                    <Unicode>{text}</Unicode>
+                </TextEquiv>
+            </TextLine>"""
+
+DIARY_COLUMNS = [
+    "identifier",
+    "author",
+    "author_URI",
+    "about",
+    "about_URI",
+    "name",
+    "description",
+    "dateCreated",
+    "temporalCoverage",
+    "archive_URL",
+    "archive_name",
+    "archive_collection_URL",
+    "archive_collection_name",
+    "Viewer_URI",
+    "Book_URI",
+    "folder_name",
+    "file_prefix",
+]
+
+
+def get_polygon(rnd, x, y, w, h, n_points=11):
+
+    # A wavy line on the top and bottom, as in the transcriptions
+    xs = [x + round(w * i / (n_points - 1)) for i in range(n_points)]
+    bottom = [(px, y + h - rnd.randint(0, 6)) for px in xs]
+    top = [(px, y + rnd.randint(0, 6)) for px in reversed(xs)]
+
+    return " ".join(f"{px},{py}" for px, py in bottom + top)
+
+
+def get_entity(rnd, tag_type):
+
+    if tag_type == "date":
+        return f"{rnd.randint(1, 28)} {rnd.choice(['mei', 'juni', 'juli'])} 194{rnd.randint(0, 5)}"
+
+    n_words = rnd.choice((1, 1, 2, 2, 3))
+    return " ".join(
+        "".join(rnd.choice(SYLLABLES) for _ in range(rnd.randint(2, 3))).capitalize()
+        for _ in range(n_words)
+    )
+
+
+def get_words(rnd, n_characters):
+
+    words = []
+    while sum(len(w) + 1 for w in words) < n_characters:
+        words.append(rnd.choice(WORDS))
+
+    return words
+
+
+def generate_region(rnd, region_id, n_lines, continuation_tags):
+    """
+    Lines of a region, as (line_id, text, tags) with every tag as
+    (type, offset, length). Entities at the end of a line can continue at the
+    start of the next line.
+    """
+
+    lines = []
+    carry = None
+    for n_line in range(n_lines):
+        parts = []
+        tags = []
+
+        if carry:
+            tag_type, value = carry
+            tags.append((tag_type, 0, len(value)))
+            parts.append(value)
+            carry = None
+
+        words = get_words(rnd, rnd.randint(20, 2 * CHARACTERS_PER_LINE - 20))
+        n_tags = sum(rnd.random() < TAGS_PER_LINE / 2 for _ in range(2))
+        positions = sorted(rnd.sample(range(len(words)), min(n_tags, len(words))))
+        for i, word in enumerate(words):
+            if i in positions:
+                tag_type = rnd.choices(list(TAG_TYPES), list(TAG_TYPES.values()))[0]
+                value = get_entity(rnd, tag_type)
+                offset = len(" ".join(parts + [""])) if parts else 0
+                tags.append((tag_type, offset, len(value)))
+                parts.append(value)
+            parts.append(word)
+
+        if n_line < n_lines - 1 and rnd.random() < CONTINUATIONS:
+            tag_type = rnd.choice(("person", "place", "organization"))
+            first, second = get_entity(rnd, "person"), get_entity(rnd, "person")
+            offset = len(" ".join(parts)) + 1
+            tags.append((tag_type, offset, len(first)))
+            parts.append(first)
+            carry = tag_type, second
+            continuation_tags.add((region_id, n_line))
+
+        lines.append((f"{region_id}_l_{n_line}", " ".join(parts), tags))
+
+    return lines
+
+
+def generate_page(rnd, filename):
+    """
+    PAGE XML of one page, and the entities on it as (line_id, type, text),
+    with entities that continue on the next line as one.
+    """
+
+    regions = []
+    entities = []
+
+    n_regions = rnd.choice((1, 1, 1, 2, 2, 3))
+    region_height = (PAGE_HEIGHT - 400) // n_regions
+
+    for n_region in range(n_regions):
+        region_id = f"r_{n_region}"
+        region_type = rnd.choices(list(REGION_TYPES), list(REGION_TYPES.values()))[0]
+        x, y = 200, 200 + n_region * region_height
+        w, h = PAGE_WIDTH - 400, region_height - 40
+
+        if region_type in EMPTY_REGION_TYPES:
+            region_lines = []
+        else:
+            n_lines = rnd.randint(*LINES_PER_REGION)
+            region_lines = generate_region(rnd, region_id, n_lines, set())
+
+        lines = []
+        line_height = h // max(1, len(region_lines))
+        previous = None
+        for n_line, (line_id, text, tags) in enumerate(region_lines):
+            custom = "".join(
+                f" {tag_type} {{offset:{offset}; length:{length};}}"
+                for tag_type, offset, length in tags
+            )
+            lines.append(
+                TEXTLINE.format(
+                    id=line_id,
+                    index=n_line,
+                    tags=custom,
+                    points=get_polygon(rnd, x, y + n_line * line_height, w, 50),
+                    text=escape(text),
+                )
+            )
+
+            for n_tag, (tag_type, offset, length) in enumerate(tags):
+                value = text[offset : offset + length]
+
+                # The continuation of the last entity on the previous line
+                if (
+                    n_tag == 0
+                    and offset == 0
+                    and previous
+                    and previous[1] == tag_type
+                    and previous[3]
+                ):
+                    previous_line_id, _, previous_value, _ = previous
+                    entities[-1] = (
+                        previous_line_id,
+                        tag_type,
+                        f"{previous_value} {value}",
+                    )
+                else:
+                    entities.append((line_id, tag_type, value))
+
+            # Does the last entity end at the end of the line?
+            if tags:
+                tag_type, offset, length = tags[-1]
+                previous = (
+                    entities[-1][0],
+                    tag_type,
+                    entities[-1][2],
+                    offset + length == len(text),
+                )
+            else:
+                previous = None
+
+        regions.append(
+            TEXTREGION.format(
+                id=region_id,
+                index=n_region,
+                type=region_type,
+                points=f"{x},{y} {x + w},{y} {x + w},{y + h} {x},{y + h}",
+                lines="\n".join(lines),
+            )
+        )
+
+    pagexml = PAGEXML.format(
+        image=filename.replace(".xml", ".jpg"),
+        width=PAGE_WIDTH,
+        height=PAGE_HEIGHT,
+        regions="\n".join(regions),
+    )
+
+    region_ids = [f"r_{n}" for n in range(n_regions)]
+
+    return pagexml, entities, region_ids
+
+
+def generate_corpus(folder, scale=1, seed=0):
+    """
+    A synthetic corpus of `scale` times the current one: PAGE XML in
+    `folder`/diaries/, with the metadata and linking tables next to it.
+    """
+
+    rnd = random.Random(seed)
+
+    diaries = []
+    entries = []
+    persons = []
+    linking = []
+
+    for n_diary in range(1, DIARIES * scale + 1):
+        name = f"Dagboek Synthetic {n_diary}"
+        folder_name = name.replace(" ", "_")
+        file_prefix = f"synthetic-{n_diary:04d}_"
+        author_uri = f"http://www.wikidata.org/entity/Q9{n_diary:07d}"
+
+        diaries.append(
+            {
+                "identifier": n_diary,
+                "author": f"Author {n_diary}",
+                "author_URI": author_uri,
+                "about": f"Author {n_diary}",
+                "about_URI": author_uri,
+                "name": name,
+                "description": f"Synthetic diary {n_diary}",
+                "dateCreated": "1942",
+                "temporalCoverage": "1942/1945",
+                "archive_URL": "https://example.org/archive",
+                "archive_name": "Archive",
+                "archive_collection_URL": f"https://example.org/archive/{n_diary}",
+                "archive_collection_name": f"Collection {n_diary}",
+                "Viewer_URI": f"https://example.org/viewer/{n_diary}",
+                "Book_URI": f"https://example.org/book/{n_diary}",
+                "folder_name": folder_name,
+                "file_prefix": file_prefix,
+            }
+        )
+
+        persons.append(
+            {
+                "uri": author_uri,
+                "name": f"Author {n_diary}",
+                "birthDate": "1920-01-01",
+                "description": f"Author of synthetic diary {n_diary}",
+            }
+        )
+
+        page_folder = os.path.join(folder, "diaries", folder_name, "page")
+        os.makedirs(page_folder, exist_ok=True)
+
+        entry_regions = []
+        for n_page in range(1, PAGES_PER_DIARY + 1):
+            filename = f"{n_page:04d}_{file_prefix}p{n_page:04d}.xml"
+            pagexml, page_entities, region_ids = generate_page(rnd, filename)
+
+            with open(os.path.join(page_folder, filename), "w") as outfile:
+                outfile.write(pagexml)
+
+            page = filename.replace(".xml", "")
+            for line_id, tag_type, value in page_entities:
+                row = {
+                    "annotation": f"{PREFIX}annotations/synthetic-{len(linking) + 1}",
+                    "diary": name,
+                    "tag": tag_type,
+                    "source": f"{PREFIX}annotations/regions/{page}/{line_id}",
+                    "text": normalize_text(value),
+                }
+                if tag_type in ("person", "place", "organization"):
+                    row["uri"] = (
+                        f"http://www.wikidata.org/entity/Q{rnd.randint(1, 10**6)}"
+                    )
+                    row["label"] = value
+                elif tag_type == "date":
+                    row["date"] = f"194{rnd.randint(0, 5)}-05-{rnd.randint(10, 28)}"
+                linking.append(row)
+
+            # Every entry is a few regions, on one or two pages
+            entry_regions += [f"{filename} {region_id}" for region_id in region_ids]
+            if rnd.random() < 1 / ENTRIES_PER_PAGE or n_page == PAGES_PER_DIARY:
+                entries.append(
+                    {
+                        "identifier": len(entries) + 1,
+                        "identifier_diary": n_diary,
+                        "name": f"Entry {len(entries) + 1}",
+                        "date": f"194{rnd.randint(0, 5)}-0{rnd.randint(1, 9)}-1{rnd.randint(0, 9)}",
+                        "regions": "\n".join(entry_regions),
+                    }
+                )
+                entry_regions = []
+
+    pd.DataFrame(diaries, columns=DIARY_COLUMNS).to_csv(
+        os.path.join(folder, "metadata_diaries.csv"), index=False
+    )
+    pd.DataFrame(entries).to_csv(
+        os.path.join(folder, "metadata_entries.csv"), index=False
+    )
+    pd.DataFrame(
+        persons,
+        columns=[
+            "uri",
+            "name",
+            "birthDate",
+            "birthPlace_uri",
+            "birthPlace_name",
+            "deathDate",
+            "deathPlace_uri",
+            "deathPlace_name",
+            "description",
+            "image",
+            "image_other",
+        ],
+    ).to_csv(os.path.join(folder, "metadata_persons.csv"), index=False)
+
+    df_linking = pd.DataFrame(
+        linking,
+        columns=[
+            "annotation",
+            "diary",
+            "tag",
+            "source",
+            "text",
+            "uri",
+            "date",
+            "label",
+            "description",
+            "latitude",
+            "longitude",
+            "checken",
+        ],
+    )
+    df_linking.insert(0, "index", range(1, len(df_linking) + 1))
+    df_linking.to_csv(os.path.join(folder, "annotations_linking.csv"), index=False)
+
+    shutil.copy(METADATA_CONCEPTS, os.path.join(folder, "metadata_concepts.csv"))
+
+
+class Timings:
+    def __init__(self):
+
+        self.seconds = defaultdict(float)
+        self.items = defaultdict(int)
+
+    def add(self, name, start, items=1):
+
+        self.seconds[name] += time.perf_counter() - start
+        self.items[name] += items
+
+    def report(self):
+
+        return {
+            name: {
+                "seconds": round(seconds, 4),
+                "items": self.items[name],
+                "items_per_second": (
+                    round(self.items[name] / seconds, 1) if seconds else None
+                ),
+            }
+            for name, seconds in self.seconds.items()
+        }
+
+
+def run_benchmarks(folder, sample_pages=2000):
+    """
+    Time the build steps of main.py on the corpus in `folder`. The selectors
+    and the custom tag extraction are timed on at most `sample_pages` pages.
+    """
+
+    timings = Timings()
+
+    csv_diaries = os.path.join(folder, "metadata_diaries.csv")
+    csv_entries = os.path.join(folder, "metadata_entries.csv")
+    csv_persons = os.path.join(folder, "metadata_persons.csv")
+    csv_linking = os.path.join(folder, "annotations_linking.csv")
+
+    for c in generate_concept_metadata(os.path.join(folder, "metadata_concepts.csv")):
+        tagtype2resource[c["notation"]] = c
+
+    pages = list_pages(os.path.join(folder, "diaries"))
+
+    # generate_metadata() reads the lines of the regions from main.py
+    main.region2line_annotation.clear()
+    region2textualbody = defaultdict(list)
+    diary2scan = defaultdict(list)
+    body2length = dict()
+
+    entity_annotations = []
+    n_tags = 0
+
+    # Text and tags of every page, written as in main()
+    with open(os.path.join(folder, "textual_annotations.jsonld"), "w") as outfile:
+        with JSONArrayWriter(outfile) as writer:
+            for diary, filepath in pages:
+                start = time.perf_counter()
+                (
+                    annotations,
+                    tags,
+                    page_region2textualbody,
+                    page_region2line_annotation,
+                    page_diary2scan,
+                    page_body2length,
+                    _,
+                ) = parse_page(diary, filepath)
+                timings.add("parse_pagexml", start)
+
+                start = time.perf_counter()
+                for annotation in annotations:
+                    writer.write(annotation)
+                timings.add("write_json", start, len(annotations))
+
+                start = time.perf_counter()
+                for tag in tags:
+                    entity_annotations.append(
+                        make_entity_annotation(
+                            tag,
+                            prefix=PREFIX + "annotations/",
+                            filename=filepath,
+                            tagtype2resource=tagtype2resource,
+                        )
+                    )
+                timings.add("make_entity_annotation", start, len(tags))
+                n_tags += len(tags)
+
+                for region_id, body_ids in page_region2textualbody.items():
+                    region2textualbody[region_id] += body_ids
+                for region_id, line_ids in page_region2line_annotation.items():
+                    main.region2line_annotation[region_id] += line_ids
+                for scan_diary, scan_uris in page_diary2scan.items():
+                    diary2scan[scan_diary] += scan_uris
+                body2length.update(page_body2length)
+
+    # Selectors and the custom tags, on the parsed PAGE XML
+    step = max(1, len(pages) // sample_pages)
+    for _, filepath in pages[::step]:
+        page = parse_pagexml_file(filepath, custom_tags=CUSTOM_TAGS)
+
+        coords = [region.coords for region in page.text_regions]
+        coords += [line.coords for region in page.text_regions for line in region.lines]
+
+        start = time.perf_counter()
+        get_selectors(coords, page.coords.w, page.coords.h)
+        timings.add("get_selectors", start, len(coords))
+
+        start = time.perf_counter()
+        get_custom_tags(page)
+        timings.add("get_custom_tags", start)
+
+    start = time.perf_counter()
+    merged_annotations = list(
+        merge_annotations(entity_annotations, body2length, region2textualbody)
+    )
+    timings.add("merge_annotations", start, len(entity_annotations))
+
+    start = time.perf_counter()
+    linking_index = LinkingIndex(
+        pd.read_csv(csv_linking), get_diaryname2fileprefix(csv_diaries)
+    )
+    for annotation in merged_annotations:
+        add_entity_identifier(annotation, linking_index)
+    timings.add("add_entity_identifier", start, len(merged_annotations))
+
+    start = time.perf_counter()
+    n_resources = sum(
+        1 for _ in generate_metadata(csv_diaries, csv_entries, csv_persons, diary2scan)
+    )
+    timings.add("generate_metadata", start, n_resources)
+
+    main.region2line_annotation.clear()
+
+    return {
+        "corpus": {
+            "diaries": len({diary for diary, _ in pages}),
+            "pages": len(pages),
+            "lines": len(body2length),
+            "custom_tags": n_tags,
+            "entity_annotations": len(merged_annotations),
+            "unmatched_annotations": len(linking_index.new_rows),
+        },
+        "benchmarks": timings.report(),
+    }
+
+
+def generate_metadata_tables(folder, n_diaries, n_entries, seed=0):
+    """
+    Only the metadata tables, for many more diaries than the corpus can
+    have: `n_entries` entries spread over `n_diaries` diaries, in random
+    order. Returns the region -> line annotations index of their regions.
+    """
+
+    rnd = random.Random(seed)
+    os.makedirs(folder, exist_ok=True)
+
+    diaries = []
+    for n_diary in range(1, n_diaries + 1):
+        name = f"Dagboek Synthetic {n_diary}"
+        diaries.append(
+            {
+                "identifier": n_diary,
+                "author": f"Author {n_diary}",
+                "author_URI": f"http://www.wikidata.org/entity/Q9{n_diary:07d}",
+                "name": name,
+                "description": f"Synthetic diary {n_diary}",
+                "dateCreated": "1942",
+                "temporalCoverage": "1942/1945",
+                "archive_URL": "https://example.org/archive",
+                "archive_name": "Archive",
+                "archive_collection_URL": f"https://example.org/archive/{n_diary}",
+                "archive_collection_name": f"Collection {n_diary}",
+                "Viewer_URI": f"https://example.org/viewer/{n_diary}",
+                "folder_name": name.replace(" ", "_"),
+                "file_prefix": f"synthetic-{n_diary:05d}_",
+            }
+        )
+    df_diaries = pd.DataFrame(diaries, columns=DIARY_COLUMNS)
+    df_diaries["about"] = df_diaries["author"]
+    df_diaries["about_URI"] = df_diaries["author_URI"]
+    df_diaries.to_csv(os.path.join(folder, "metadata_diaries.csv"), index=False)
+
+    # Two regions per entry, one of them with lines
+    identifiers = pd.Series(range(1, n_entries + 1)).astype(str)
+    pages = identifiers.str.zfill(7) + "_synthetic.xml"
+    region2line_annotation = defaultdict(list)
+    lines = [f"{PREFIX}annotations/lines/synthetic-{n}" for n in range(5)]
+    for page in pages:
+        region2line_annotation[
+            f"{PREFIX}annotations/regions/{page.replace('.xml', '')}/r_1"
+        ] = lines
+
+    pd.DataFrame(
+        {
+            "identifier": identifiers,
+            "identifier_diary": [rnd.randint(1, n_diaries) for _ in range(n_entries)],
+            "name": "Entry " + identifiers,
+            "date": "1943-05-17",
+            "regions": pages + " r_1\n" + pages + " r_2",
+        }
+    ).to_csv(os.path.join(folder, "metadata_entries.csv"), index=False)
+
+    pd.DataFrame(
+        {"uri": df_diaries["author_URI"], "name": df_diaries["author"]},
+        columns=["uri", "name", "birthDate", "birthPlace_uri", "birthPlace_name"]
+        + ["deathDate", "deathPlace_uri", "deathPlace_name", "description"]
+        + ["image", "image_other"],
+    ).to_csv(os.path.join(folder, "metadata_persons.csv"), index=False)
+
+    return region2line_annotation
+
+
+def run_metadata_benchmark(n_diaries, n_entries, seed=0):
+    """
+    Time `generate_metadata()` for `n_diaries` diaries with `n_entries`
+    entries, without PAGE XML.
+    """
+
+    folder = tempfile.mkdtemp(prefix="diaries-metadata-benchmark-")
+
+    start = time.perf_counter()
+    region2line_annotation = generate_metadata_tables(
+        folder, n_diaries, n_entries, seed
+    )
+    print(
+        f"Generated {n_diaries} diaries with {n_entries} entries in "
+        f"{time.perf_counter() - start:.1f}s",
+        file=sys.stderr,
+    )
+
+    timings = Timings()
+    start = time.perf_counter()
+    n_resources = sum(
+        1
+        for _ in generate_metadata(
+            os.path.join(folder, "metadata_diaries.csv"),
+            os.path.join(folder, "metadata_entries.csv"),
+            os.path.join(folder, "metadata_persons.csv"),
+            defaultdict(list),
+            region2line_annotation,
+        )
+    )
+    timings.add("generate_metadata", start, n_resources)
+
+    shutil.rmtree(folder)
+
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "corpus": {"diaries": n_diaries, "entries": n_entries},
+        "benchmarks": timings.report(),
+    }
+
+
+def run_suite(scales, repeat=1, corpus_folder=None, seed=0):
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "results": [],
+    }
+
+    for scale in scales:
+        folder = os.path.join(
+            corpus_folder or tempfile.mkdtemp(prefix="diaries-benchmark-"),
+            f"scale-{scale}",
+        )
+
+        if not os.path.exists(os.path.join(folder, "annotations_linking.csv")):
+            start = time.perf_counter()
+            generate_corpus(folder, scale, seed)
+            print(
+                f"Generated {scale}x corpus in {time.perf_counter() - start:.1f}s",
+                file=sys.stderr,
+            )
+
+        # The fastest of every benchmark
+        runs = [run_benchmarks(folder) for _ in range(repeat)]
+        benchmarks = {
+            name: min(
+                (run["benchmarks"][name] for run in runs), key=lambda b: b["seconds"]
+            )
+            for name in runs[0]["benchmarks"]
+        }
+
+        report["results"].append(
+            {"scale": scale, "corpus": runs[0]["corpus"], "benchmarks": benchmarks}
+        )
+
+        if corpus_folder is None:
+            shutil.rmtree(os.path.dirname(folder))
+
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the build steps of main.py on a synthetic corpus."
+    )
+    parser.add_argument(
+        "--scales",
+        type=int,
+        nargs="+",
+        default=[1, 10],
+        help="Sizes of the synthetic corpus, relative to the current one (default: 1 10, 100 takes a while)",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=1,
+        help="Number of runs, the fastest is reported (default: 1)",
+    )
+    parser.add_argument(
+        "--corpus",
+        help="Folder to keep the generated corpora in, and reuse them from (default: a temporary folder)",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="Seed of the corpus generator (default: 0)",
+    )
+    parser.add_argument(
+        "--output",
+        help="Also write the report to this JSON file",
+    )
+    parser.add_argument(
+        "--metadata",
+        type=int,
+        nargs=2,
+        metavar=("DIARIES", "ENTRIES"),
+        help="Only time the metadata of this many diaries and entries, e.g. 10000 1000000",
+    )
+    args = parser.parse_args()
+
+    if args.metadata:
+        report = run_metadata_benchmark(*args.metadata, args.seed)
+    else:
+        report = run_suite(args.scales, args.repeat, args.corpus, args.seed)
+
+    if args.output:
+        with open(args.output, "w") as outfile:
+            json.dump(report, outfile, indent=4)
+
+    print(json.dumps(report, indent=4))
@@ -0,0 +1,207 @@
+import os
+import re
+import json
+from collections import defaultdict
+
+from nquads import NQuadsWriter
+
+# Blank nodes in the subject or object of a triple written by NQuadsWriter
+BLANK_SUBJECT = re.compile(r"^_:(b\d+) ")
+BLANK_OBJECT = re.compile(r" _:(b\d+) \.$")
+
+
+class TripleList(list):
+    def write(self, quad):
+        self.append(quad.rstrip("\n"))
+
+    def flush(self):
+        pass
+
+
+def index_resources(resources):
+    """
+    Resources by their `id` or `@id`, as sorted lists of canonical JSON. A
+    few annotations share an identifier, so there can be more than one.
+    """
+
+    index = defaultdict(list)
+    for resource in resources:
+        data = json.dumps(resource, sort_keys=True, ensure_ascii=False)
+        key = resource.get("id", resource.get("@id", data))
+        index[key].append(data)
+
+    return {key: sorted(items) for key, items in index.items()}
+
+
+def is_ground(triple):
+    return "_:" not in triple
+
+
+def to_quad(triple, graph):
+
+    if graph:
+        return f"{triple[:-2]} <{graph}> ."
+
+    return triple
+
+
+def to_pattern(triple):
+
+    triple = BLANK_SUBJECT.sub(r"?\1 ", triple)
+    return BLANK_OBJECT.sub(r" ?\1 .", triple)
+
+
+def sparql_block(triples, graph):
+
+    lines = "\n".join(f"    {t}" for t in triples)
+    if graph:
+        return f"GRAPH <{graph}> {{\n{lines}\n}}"
+
+    return lines
+
+
+class Delta:
+    """
+    The difference between two builds, per resource.
+
+    Resources that are new or changed are inserted, resources that are gone
+    or changed are deleted. Triples that are still in the new build are never
+    deleted: the same scan or tag is described in many resources. Triples
+    without blank nodes are deleted once with `DELETE DATA`, and only the
+    blank nodes of a resource are matched with a `DELETE WHERE`.
+
+    A store cannot match the blank nodes of an N-Quads file, so triples with
+    blank nodes are left out of `deleted.nq` and only removed by `update.rq`.
+    With `skolem` (see NQuadsWriter) there are no blank nodes, and both forms
+    of the patch are complete, if the build was loaded with the same `skolem`.
+    """
+
+    def __init__(self, skolem=None):
+
+        self.inserts = TripleList()
+        self.deletes = TripleList()
+        self.insert_writer = NQuadsWriter(self.inserts, skolem=skolem)
+        self.delete_writer = NQuadsWriter(self.deletes, skolem=skolem)
+
+        self.current = set()
+        self.current_writer = NQuadsWriter(TripleList(), skolem=skolem)
+
+        self.inserted = defaultdict(list)
+        self.deleted = []
+        self.summary = dict()
+
+    def triples(self, writer, items):
+
+        start = len(writer.outfile)
+        for data in items:
+            writer.write(json.loads(data))
+
+        triples = writer.outfile[start:]
+        del writer.outfile[start:]
+
+        return triples
+
+    def compare(self, name, previous, current, graph=None):
+
+        graph = graph or (lambda resource: None)
+
+        # Everything that is still in the new build
+        for items in current.values():
+            resource_graph = graph(json.loads(items[0]))
+            for triple in self.triples(self.current_writer, items):
+                if is_ground(triple):
+                    self.current.add((triple, resource_graph))
+
+        added = [key for key in current if key not in previous]
+        removed = [key for key in previous if key not in current]
+        changed = [
+            key for key in current if key in previous and previous[key] != current[key]
+        ]
+
+        for key in removed + changed:
+            resource_graph = graph(json.loads(previous[key][0]))
+            self.deleted.append(
+                (self.triples(self.delete_writer, previous[key]), resource_graph)
+            )
+
+        for key in added + changed:
+            resource_graph = graph(json.loads(current[key][0]))
+            self.inserted[resource_graph] += self.triples(
+                self.insert_writer, current[key]
+            )
+
+        self.summary[name] = {
+            "added": len(added),
+            "removed": len(removed),
+            "changed": len(changed),
+        }
+
+    def write(self, folder):
+
+        os.makedirs(folder, exist_ok=True)
+
+        deleted = [
+            (
+                [t for t in triples if (t, graph) not in self.current],
+                graph,
+            )
+            for triples, graph in self.deleted
+        ]
+
+        # A triple without blank nodes can be in several of the resources,
+        # but a pattern only matches as long as all its triples are there
+        ground = defaultdict(dict)
+        blank = []
+        for triples, graph in deleted:
+            for triple in triples:
+                if is_ground(triple):
+                    ground[graph][triple] = None
+
+            triples = [t for t in triples if not is_ground(t)]
+            if triples:
+                blank.append((triples, graph))
+
+        with open(os.path.join(folder, "deleted.nq"), "w") as outfile:
+            for graph, triples in ground.items():
+                for triple in triples:
+                    outfile.write(to_quad(triple, graph) + "\n")
+
+        with open(os.path.join(folder, "inserted.nq"), "w") as outfile:
+            for graph, triples in self.inserted.items():
+                for triple in triples:
+                    outfile.write(to_quad(triple, graph) + "\n")
+
+        operations = [
+            "DELETE DATA {\n" + sparql_block(triples, graph) + "\n}"
+            for graph, triples in ground.items()
+        ]
+
+        # One DELETE WHERE per resource, with its blank nodes as variables
+        operations += [
+            "DELETE WHERE {\n"
+            + sparql_block([to_pattern(t) for t in triples], graph)
+            + "\n}"
+            for triples, graph in blank
+        ]
+        operations += [
+            "INSERT DATA {\n" + sparql_block(triples, graph) + "\n}"
+            for graph, triples in self.inserted.items()
+            if triples
+        ]
+
+        update_file = os.path.join(folder, "update.rq")
+        with open(update_file, "w") as outfile:
+            outfile.write(" ;\n".join(operations) + ("\n" if operations else ""))
+
+        summary = {
+            "resources": self.summary,
+            "deleted_quads": sum(len(triples) for triples in ground.values())
+            + sum(len(triples) for triples, _ in blank),
+            "inserted_quads": sum(len(t) for t in self.inserted.values()),
+            "update_bytes": os.path.getsize(update_file),
+        }
+
+        with open(os.path.join(folder, "summary.json"), "w") as outfile:
+            json.dump(summary, outfile, indent=4)
+
+        return summary
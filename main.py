@@ -1,15 +1,23 @@
 import os
 import json
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
 from collections import defaultdict
+from dataclasses import dataclass, asdict
+from concurrent.futures import ProcessPoolExecutor
 import uuid
-from lxml import etree
-
-from pagexml.parser import parse_pagexml_file
-from pagexml.helper.pagexml_helper import get_custom_tags
-from pagexml.model.physical_document_model import PageXMLTextLine, Coords
 
+import numpy as np
 import pandas as pd
 
+from nquads import NQuadsWriter, check_contexts
+from delta import Delta, index_resources
+from profiling import Profiler
+from publish import publish, EXPIRE_DAYS
+
 # FOLDER = "data/"
 PREFIX = "https://id.amsterdamtimemachine.nl/ark:/81741/amsterdam-diaries/"
 IIIF_PREFIX = "https://images.diaries.amsterdamtimemachine.nl/iiif/"
@@ -21,12 +29,89 @@ METADATA_CONCEPTS = "data/metadata_concepts.csv"
 
 ANNOTATION_IDENTIFIERS = "data/annotations_linking.csv"
 
+CSV_FILES = (
+    METADATA_DIARIES,
+    METADATA_ENTRIES,
+    METADATA_PERSONS,
+    METADATA_CONCEPTS,
+    ANNOTATION_IDENTIFIERS,
+)
+
+# Namespace for the identifiers of new annotations (uuid5)
+ANNOTATION_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, PREFIX + "annotations/")
+
+# Incremental builds
+BUILD_FOLDER = "build/"
+BUILD_MANIFEST = BUILD_FOLDER + "manifest.json"
+MANIFEST_VERSION = 1
+
+# Stages of the build, and what they hand over to the next ones
+STAGES = ("text", "metadata", "concepts", "entities", "link", "external")
+TEXT_STATE = BUILD_FOLDER + "text.json"
+ENTITY_STATE = BUILD_FOLDER + "entities.json"
+
+# N-Quads export, with a named graph per diary
+NQUADS = "rdf/diaries.nq"
+
+# IRIs for the blank nodes in the N-Quads, so that --delta can delete them
+SKOLEM_PREFIX = (
+    "https://id.amsterdamtimemachine.nl/.well-known/genid/amsterdam-diaries/"
+)
+
+# Patch against the previous build (--delta)
+DELTA_FOLDER = BUILD_FOLDER + "delta/"
+DELTA_FILES = (
+    "rdf/textual_annotations.jsonld",
+    "rdf/metadata.jsonld",
+    "rdf/concepts.jsonld",
+    "rdf/entity_annotations.jsonld",
+    "rdf/external_resources.jsonld",
+)
+
+# Per diary and per scan output, with an index (--shards)
+SHARD_FOLDER = "rdf/shards/"
+SHARD_INDEX = SHARD_FOLDER + "index.json"
+
+# Content-addressed and precompressed copies of the output (--publish)
+PUBLISH_FOLDER = BUILD_FOLDER + "dist/"
+PUBLISH_MANIFEST = PUBLISH_FOLDER + "manifest.json"
+PUBLISH_FILES = ("rdf/info.jsonld",) + DELTA_FILES
+
+# Run report with the time and memory per stage (--profile)
+PROFILE_FILE = BUILD_FOLDER + "profile.json"
+PROFILE_FOLDER = BUILD_FOLDER + "profile/"
+
+CUSTOM_TAGS = (
+    # "structure",
+    "date",
+    "person",
+    "place",
+    "organization",
+    "add",
+    "unclear",
+    "blackening",
+    "speech",
+    "abbrev",
+    "gap",
+    "sic",
+    "atm_food",
+)
+
+# Context of the region and line annotations
+TEXT_CONTEXT = [
+    "http://www.w3.org/ns/anno.jsonld",
+    "http://iiif.io/api/extension/text-granularity/context.json",
+]
+
 body2length = dict()
 
 region2line_annotation = defaultdict(list)
 region2textualbody = defaultdict(list)
 diary2scan = defaultdict(list)
 
+# Vertices and bytes saved by simplifying the polygons (--simplify)
+simplification = defaultdict(int)
+
 tagtype2resource = {
     "structure": {
         "id": PREFIX + "tags/entities/" + "structure",
@@ -191,48 +276,138 @@ regiontype2resource = {
 }
 
 
-def getSVG(coordinates):
+SVG = '<svg xmlns="http://www.w3.org/2000/svg"><polygon points="{}"/></svg>'
 
-    points = [f"{int(x)},{int(y)}" for x, y in coordinates + [coordinates[0]]]
 
-    svg = etree.Element("svg", xmlns="http://www.w3.org/2000/svg")
-    _ = etree.SubElement(
-        svg,
-        "polygon",
-        points=" ".join(points),
+def simplify_polygons(coords, tolerance, boxes):
+    """
+    Point strings of a list of Coords, simplified with Douglas-Peucker and
+    clipped to their (x, y, w, h) box, so that a polygon never gets outside
+    its FragmentSelector. Polygons that would collapse are only clipped.
+    """
+
+    import shapely
+
+    rings = [c.points + c.points[:1] for c in coords]
+    lines = shapely.linestrings(
+        [point for ring in rings for point in ring],
+        indices=[i for i, ring in enumerate(rings) for _ in ring],
+    )
+
+    points, index = shapely.get_coordinates(
+        shapely.simplify(lines, tolerance, preserve_topology=False),
+        return_index=True,
     )
+    ends = np.cumsum(np.bincount(index, minlength=len(coords))).tolist()
+
+    point_strings = []
+    for c, start, end, (x, y, w, h) in zip(coords, [0] + ends[:-1], ends, boxes):
+
+        # A closed ring of at least three points, without the closing point
+        if 4 <= end - start <= len(c.points):
+            polygon = points[start : end - 1]
+        else:
+            polygon = np.array(c.points)
+
+        polygon = np.clip(polygon, (x, y), (x + w, y + h)).astype(np.int64)
+        point_strings.append(" ".join(f"{px},{py}" for px, py in polygon.tolist()))
+
+    return point_strings
+
+
+def get_selectors(
+    coords, page_width, page_height, tolerance=None, simplification=simplification
+):
+    """
+    The xywh and SVG selector values of a list of Coords, with the boxes
+    clipped to the page in one go for all regions and lines of a page.
+    With a `tolerance` (in pixels), the SVG polygons are simplified.
+    """
 
-    return etree.tostring(svg, encoding=str)
+    if not coords:
+        return []
 
+    boxes = np.array([(c.x, c.y, c.w, c.h) for c in coords], dtype=np.int64)
 
-def generate_metadata(csv_diaries, csv_entries, csv_persons, diary2scan=diary2scan):
+    x = np.maximum(0, boxes[:, 0])
+    y = np.maximum(0, boxes[:, 1])
+    w = np.minimum(page_width - x, boxes[:, 2])
+    h = np.minimum(page_height - y, boxes[:, 3])
+    boxes = list(zip(x.tolist(), y.tolist(), w.tolist(), h.tolist()))
+
+    # The points are parsed as integers, so the point string is the polygon
+    point_strings = [c.point_string for c in coords]
+
+    if tolerance:
+        simplified = simplify_polygons(coords, tolerance, boxes)
+
+        simplification["vertices"] += sum(len(c.points) for c in coords)
+        simplification["vertices_saved"] += sum(
+            len(c.points) - p.count(" ") - 1 for c, p in zip(coords, simplified)
+        )
+        simplification["bytes_saved"] += sum(
+            len(p) - len(q) for p, q in zip(point_strings, simplified)
+        )
+
+        point_strings = simplified
+
+    return [
+        (
+            "xywh={},{},{},{}".format(*box),
+            SVG.format(f"{points} {points.split(' ', 1)[0]}"),
+        )
+        for points, box in zip(point_strings, boxes)
+    ]
+
+
+def get_diaryname2fileprefix(csv_diaries):
+
+    df_diaries = pd.read_csv(csv_diaries)
+
+    return dict(zip(df_diaries["name"], df_diaries["file_prefix"]))
+
+
+def generate_metadata(
+    csv_diaries,
+    csv_entries,
+    csv_persons,
+    diary2scan=diary2scan,
+    region2line_annotation=region2line_annotation,
+):
 
     df_diaries = pd.read_csv(csv_diaries)
     df_entries = pd.read_csv(csv_entries)
     df_persons = pd.read_csv(csv_persons)
 
-    resources = []
-
-    diaryname2fileprefix = dict()
+    # Region annotations of every entry, and its entries per diary, so that
+    # the entries are not searched again for every diary
+    entry_regions = (
+        PREFIX
+        + "annotations/regions/"
+        + df_entries["regions"]
+        .str.replace(".xml ", "/", regex=False)  # the space after .xml is important
+        .str.replace("\n", "\n" + PREFIX + "annotations/regions/", regex=False)
+    ).str.split("\n")
+    entry_rows = list(zip(df_entries.itertuples(index=False), entry_regions))
+    diary2entries = df_entries.groupby("identifier_diary", sort=False).indices
 
     # books
-    for _, r in df_diaries.iterrows():
+    for r in df_diaries.itertuples(index=False):
 
         entries = []
-        diaryname2fileprefix[r["name"]] = r["file_prefix"]
 
         # Organization
         archive = {
-            "@id": r["archive_URL"],
+            "@id": r.archive_URL,
             "@type": "ArchiveOrganization",
-            "name": r["archive_name"],
+            "name": r.archive_name,
         }
 
         # Collection
         collection = {
-            "@id": r["archive_collection_URL"],
+            "@id": r.archive_collection_URL,
             "@type": ["Collection", "ArchiveComponent"],
-            "name": r["archive_collection_name"],
+            "name": r.archive_collection_name,
             "holdingArchive": archive,
         }
 
@@ -258,40 +433,36 @@ def generate_metadata(csv_diaries, csv_entries, csv_persons, diary2scan=diary2sc
             "author": {
                 "@id": r.author_URI,
                 "@type": "Person",
-                "name": r["author"],
+                "name": r.author,
             },
             "about": {
                 "@id": r.about_URI,
                 "@type": "Person",
-                "name": r["about"],
+                "name": r.about,
             },
-            "name": r["name"],
+            "name": r.name,
             "isPartOf": collection,
             "hasPart": [],
             # "keywords": r["keywords"].replace(";", ","),
             "description": r.description if not pd.isna(r.description) else [],
-            "temporalCoverage": r["temporalCoverage"],
-            "dateCreated": r["dateCreated"],
-            "identifier": r["identifier"],
-            "url": r["Viewer_URI"],
-            "image": diary2scan[r["folder_name"]],
+            "temporalCoverage": r.temporalCoverage,
+            "dateCreated": r.dateCreated,
+            "identifier": r.identifier,
+            "url": r.Viewer_URI,
+            "image": diary2scan[r.folder_name],
         }
 
-        if not pd.isna(r["Book_URI"]):
-            book["sameAs"] = r["Book_URI"]
+        if not pd.isna(r.Book_URI):
+            book["sameAs"] = r.Book_URI
 
         # entries
-        for _, e in df_entries[
-            df_entries["identifier_diary"] == r.identifier
-        ].iterrows():
+        for i in diary2entries.get(r.identifier, ()):
+            e, region_annotations = entry_rows[i]
 
             # Regions
-            region_annotations = []
             line_annotations = []
-            for region in e["regions"].split("\n"):
-                region = f"{PREFIX}annotations/regions/{region.replace('.xml ', '/')}"  # the space after .xml is important
-                region_annotations.append(region)
-                line_annotations += region2line_annotation[region]
+            for region in region_annotations:
+                line_annotations += region2line_annotation.get(region, [])
 
             # Entry
             entry = {
@@ -316,10 +487,10 @@ def generate_metadata(csv_diaries, csv_entries, csv_persons, diary2scan=diary2sc
 
             entries.append({"@id": entry["@id"], "@type": entry["@type"]})
 
-            if not pd.isna(e["name"]):
-                entry["name"] = e["name"]
+            if not pd.isna(e.name):
+                entry["name"] = e.name
 
-            if not pd.isna(e["date"]):
+            if not pd.isna(e.date):
                 # if e["date"].count("-") == 1:
                 #     entry["dateCreated"] = {
                 #         "@type": "xsd:gYearMonth",
@@ -338,7 +509,7 @@ def generate_metadata(csv_diaries, csv_entries, csv_persons, diary2scan=diary2sc
 
                 entry["dateCreated"] = {
                     "@type": "http://www.w3.org/2001/XMLSchema#date",
-                    "@value": e["date"],
+                    "@value": e.date,
                 }
 
             # Entry annotation
@@ -361,13 +532,13 @@ def generate_metadata(csv_diaries, csv_entries, csv_persons, diary2scan=diary2sc
                 "target": region_annotations,
             }
 
-            resources.append(entry_annotation)
+            yield entry_annotation
 
         book["hasPart"] = entries
-        resources.append(book)
+        yield book
 
     # persons
-    for _, r in df_persons.iterrows():
+    for r in df_persons.itertuples(index=False):
 
         # uri	name	birthDate	birthPlace_uri	birthPlace_name	deathDate	deathPlace_uri	deathPlace_name	description	image	image_other
 
@@ -375,45 +546,450 @@ def generate_metadata(csv_diaries, csv_entries, csv_persons, diary2scan=diary2sc
             "@context": {"@vocab": "https://schema.org/"},
             "@id": r.uri,
             "@type": "Person",
-            "name": r["name"],
+            "name": r.name,
         }
-        if not pd.isna(r["birthDate"]):
-            person["birthDate"] = r["birthDate"]
+        if not pd.isna(r.birthDate):
+            person["birthDate"] = r.birthDate
 
-        if not pd.isna(r["birthPlace_uri"]):
+        if not pd.isna(r.birthPlace_uri):
             person["birthPlace"] = {
-                "@id": r["birthPlace_uri"],
+                "@id": r.birthPlace_uri,
                 "@type": "Place",
-                "name": r["birthPlace_name"],
+                "name": r.birthPlace_name,
             }
 
-        if not pd.isna(r["deathDate"]):
-            person["deathDate"] = r["deathDate"]
+        if not pd.isna(r.deathDate):
+            person["deathDate"] = r.deathDate
 
-        if not pd.isna(r["deathPlace_uri"]):
+        if not pd.isna(r.deathPlace_uri):
             person["deathPlace"] = {
-                "@id": r["deathPlace_uri"],
+                "@id": r.deathPlace_uri,
                 "@type": "Place",
-                "name": r["deathPlace_name"],
+                "name": r.deathPlace_name,
             }
 
-        if not pd.isna(r["image"]):
+        if not pd.isna(r.image):
             person["image"] = {
-                "@id": r["image"],
+                "@id": r.image,
                 "type": "ImageObject",
-                "contentUrl": r["image"] + "/full/max/0/default.jpg",
-                "thumbnailUrl": r["image"] + "/full/96,/0/default.jpg",
+                "contentUrl": r.image + "/full/max/0/default.jpg",
+                "thumbnailUrl": r.image + "/full/96,/0/default.jpg",
             }
 
-        if not pd.isna(r["description"]):
-            person["description"] = r["description"]
+        if not pd.isna(r.description):
+            person["description"] = r.description
 
         # if not pd.isna(r["image_other"]):
         #     person["image_other"] = r["image_other"]
 
-        resources.append(person)
+        yield person
+
+
+class JSONArrayWriter:
+    """
+    Write a JSON array one item at a time, so that the full array never has
+    to be in memory. The output is the same as `json.dump(items, indent=4)`,
+    or `json.dump(items, separators=(",", ":"))` when compact.
+    """
+
+    def __init__(self, outfile, compact=False):
+
+        self.outfile = outfile
+        self.compact = compact
+        self.count = 0
+
+        self.newline = "\n    "
+
+    def header(self):
+        return "["
+
+    def footer(self):
+        return "]"
+
+    def serialize(self, item):
+
+        if self.compact:
+            return json.dumps(item, separators=(",", ":"))
+
+        return json.dumps(item, indent=4).replace("\n", self.newline)
+
+    def write(self, item):
+        self.write_data(self.serialize(item))
+
+    def write_data(self, data):
+
+        # An item as returned by serialize()
+        if self.compact:
+            self.outfile.write(("," if self.count else self.header()) + data)
+        else:
+            self.outfile.write(
+                ("," if self.count else self.header()) + self.newline + data
+            )
+
+        self.count += 1
+
+    def close(self):
+
+        if not self.count:
+            self.outfile.write(self.header() + self.footer())
+        elif self.compact:
+            self.outfile.write(self.footer())
+        else:
+            self.outfile.write(self.newline[:-4] + self.footer())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class JSONLDGraphWriter(JSONArrayWriter):
+    """
+    Write resources as a single JSON-LD document with a top-level `@context`
+    and `@graph`, the same as `json.dump({"@context": ..., "@graph": items})`.
+
+    The context of the resources is declared once for the document. Nodes in
+    the `source` of a `body` or `target` (the ImageObject of a scan, the tag
+    of an annotation) are written once and referenced by their identifier
+    afterwards.
+
+    The resources are also written as a plain array to a temporary file. That
+    array replaces the document when the resources do not all have the same
+    context, or when the document is not smaller (e.g. a single resource).
+    """
+
+    def __init__(self, outfile, compact=False):
+
+        super().__init__(outfile, compact)
+
+        self.newline = "\n        "
+        self.context = None
+        self.nodes = dict()
+
+        self.mixed = False
+        self.array_file = tempfile.TemporaryFile("w+")
+        self.array = JSONArrayWriter(self.array_file, compact)
+
+    def header(self):
+
+        if self.compact:
+            context = json.dumps(self.context, separators=(",", ":"))
+            return '{"@context":' + context + ',"@graph":['
+        else:
+            context = json.dumps(self.context, indent=4).replace("\n", "\n    ")
+            return '{\n    "@context": ' + context + ',\n    "@graph": ['
+
+    def footer(self):
+        return "]}" if self.compact else "]\n}"
+
+    def write(self, item):
+
+        self.array.write(item)
+
+        if not self.count:
+            self.context = item.get("@context")
+
+        resource = dict(item)
+        context = resource.pop("@context", None)
+        if self.mixed or context != self.context:
+            # Only the array is written from here on
+            self.mixed = True
+            return
+
+        nodes = []
+        for key in ("body", "target"):
+            value = resource.get(key)
+            if isinstance(value, dict):
+                resource[key] = self.share(value, nodes)
+            elif isinstance(value, list):
+                resource[key] = [self.share(v, nodes) for v in value]
+
+        for node in nodes + [resource]:
+            super().write(node)
+
+    def close(self):
+
+        super().close()
+        self.array.close()
+
+        if self.mixed or self.array_file.tell() < self.outfile.tell():
+            self.outfile.seek(0)
+            self.outfile.truncate()
+            self.array_file.seek(0)
+            shutil.copyfileobj(self.array_file, self.outfile)
+
+        self.array_file.close()
+
+    def share(self, part, nodes):
+
+        source = part.get("source") if isinstance(part, dict) else None
+        if not isinstance(source, dict):
+            return part
+
+        node_id = source.get("@id", source.get("id"))
+        if node_id is None:
+            return part
+        elif node_id not in self.nodes:
+            self.nodes[node_id] = source
+            nodes.append(source)
+        elif self.nodes[node_id] != source:
+            # Not the same description, keep it where it is
+            return part
+
+        return dict(part, source=node_id)
+
+
+def open_writer(outfile, compact=False, graph_document=False):
+
+    if graph_document:
+        return JSONLDGraphWriter(outfile, compact)
+
+    return JSONArrayWriter(outfile, compact)
+
+
+class ShardWriter:
+    """
+    Write resources to many small files (shards) in `folder`, each in the
+    same format as the full output. The resources of a shard have to come
+    one after the other, so that only one file is open at a time.
+    """
+
+    def __init__(self, folder, compact=False, graph_document=False):
+
+        self.folder = folder
+        self.compact = compact
+        self.graph_document = graph_document
+
+        self.paths = []
+        self.path = None
+        self.outfile = None
+        self.writer = None
+
+    def write(self, item, path):
+
+        if path != self.path:
+            self.close()
+
+            if path in self.paths:
+                raise ValueError(f"Resources of shard {path} are not together")
+
+            filepath = os.path.join(self.folder, path)
+            os.makedirs(os.path.dirname(filepath), exist_ok=True)
+
+            self.outfile = open(filepath, "w")
+            self.writer = open_writer(self.outfile, self.compact, self.graph_document)
+            self.path = path
+            self.paths.append(path)
+
+        self.writer.write(item)
+
+    def close(self):
+
+        if self.writer is not None:
+            self.writer.close()
+            self.outfile.close()
+
+        self.path = None
+        self.outfile = None
+        self.writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def dump_json(
+    items,
+    filepath,
+    compact=False,
+    nquads_writer=None,
+    graph=None,
+    graph_document=False,
+    shard_writer=None,
+    shard=None,
+):
+
+    with open(filepath, "w") as outfile, open_writer(
+        outfile, compact, graph_document
+    ) as writer:
+        for item in items:
+            writer.write(item)
+
+            if nquads_writer:
+                nquads_writer.write(item, graph(item) if graph else None)
+
+            if shard_writer:
+                path = shard(item)
+                if path is not None:
+                    shard_writer.write(item, path)
+
+    if shard_writer:
+        shard_writer.close()
+
+    return writer.count
+
+
+def read_resources(filepath):
+    """
+    Read the resources back from a JSON-LD file written by main.py, as they
+    were before writing. Documents with a `@graph` (--graph) get their
+    `@context` and shared source nodes back.
+    """
+
+    if not os.path.exists(filepath):
+        return
+
+    with open(filepath) as infile:
+        data = json.load(infile)
+
+    if isinstance(data, list):
+        yield from data
+        return
+    elif "@graph" not in data:
+        yield data
+        return
+
+    context = data.get("@context")
+    items = data["@graph"]
+
+    # Shared nodes are referenced by their identifier in a body or target
+    references = set()
+    for item in items:
+        for key in ("body", "target"):
+            parts = item.get(key, [])
+            for part in parts if isinstance(parts, list) else [parts]:
+                if isinstance(part, dict) and isinstance(part.get("source"), str):
+                    references.add(part["source"])
+
+    nodes = dict()
+    for item in items:
+        node_id = item.get("@id", item.get("id"))
+        if node_id in references:
+            nodes.setdefault(node_id, item)
+
+    def inline(part):
+        source = part.get("source") if isinstance(part, dict) else None
+        if isinstance(source, str) and source in nodes:
+            return dict(part, source=nodes[source])
+        return part
+
+    for item in items:
+        node_id = item.get("@id", item.get("id"))
+        if nodes.get(node_id) is item:
+            continue
+
+        resource = dict({"@context": context}, **item)
+        for key in ("body", "target"):
+            if isinstance(resource.get(key), list):
+                resource[key] = [inline(part) for part in resource[key]]
+            elif key in resource:
+                resource[key] = inline(resource[key])
+
+        yield resource
+
+
+def get_diary2identifier(csv_diaries):
+
+    df_diaries = pd.read_csv(csv_diaries)
+
+    # A diary is known by its folder, its name and its IRI
+    diary2identifier = dict()
+    for identifier, name, folder_name in zip(
+        df_diaries["identifier"], df_diaries["name"], df_diaries["folder_name"]
+    ):
+        diary2identifier[folder_name] = identifier
+        diary2identifier[name] = identifier
+        diary2identifier[f"{PREFIX}diaries/{identifier}"] = identifier
+
+    return diary2identifier
+
+
+def get_folder_names(csv_diaries):
+    return set(pd.read_csv(csv_diaries)["folder_name"].dropna())
+
+
+def get_diary2graph(csv_diaries):
+
+    return {
+        diary: f"{PREFIX}graphs/diaries/{identifier}"
+        for diary, identifier in get_diary2identifier(csv_diaries).items()
+    }
+
 
-    return resources, diaryname2fileprefix
+def get_metadata_graph(resource, diary2graph):
+
+    if resource.get("@type") == "Book":
+        return diary2graph.get(resource["@id"])
+    elif resource.get("type") == "Annotation":
+        return diary2graph.get(resource["body"][0]["isPartOf"]["@id"])
+
+    # Persons are shared between diaries
+    return None
+
+
+def get_scan_name(page):
+
+    # 0011_berdi_4245_pdf_p011(.xml) -> berdi_4245_pdf_p011
+    return os.path.basename(page).split("_", 1)[1].replace(".xml", "")
+
+
+def get_scan_shard(diary_identifier, page, filename):
+    return f"diaries/{diary_identifier}/scans/{get_scan_name(page)}/{filename}"
+
+
+def get_metadata_shard(resource, diary2identifier):
+
+    if resource.get("@type") == "Book":
+        diary = resource["@id"]
+    elif resource.get("type") == "Annotation":
+        diary = resource["body"][0]["isPartOf"]["@id"]
+    else:
+        # Persons are shared between diaries
+        return "persons.jsonld"
+
+    return f"diaries/{diary2identifier[diary]}/metadata.jsonld"
+
+
+def get_shard_index(shard_paths, entry2pages):
+    """
+    Index of the shards: the metadata and scans of every diary, the scans
+    of every entry and the annotation shards of every scan, by IRI.
+    """
+
+    index = {"diaries": dict(), "entries": dict(), "scans": dict()}
+
+    for path in shard_paths:
+        if path == "persons.jsonld":
+            index["persons"] = path
+            continue
+
+        parts = path.split("/")
+        diary = f"{PREFIX}diaries/{parts[1]}"
+        diary_index = index["diaries"].setdefault(diary, {"scans": []})
+
+        if parts[2] == "metadata.jsonld":
+            diary_index["metadata"] = path
+            continue
+
+        # diaries/<identifier>/scans/<scan>/<annotations>.jsonld
+        scan_uri = f"{IIIF_PREFIX}{parts[3]}.jpg"
+        if scan_uri not in index["scans"]:
+            index["scans"][scan_uri] = {"diary": diary}
+            diary_index["scans"].append(scan_uri)
+
+        index["scans"][scan_uri][parts[4].replace(".jsonld", "")] = path
+
+    for entry, (diary, pages) in entry2pages.items():
+        index["entries"][entry] = {
+            "diary": diary,
+            "metadata": index["diaries"].get(diary, {}).get("metadata"),
+            "scans": [f"{IIIF_PREFIX}{get_scan_name(page)}.jpg" for page in pages],
+        }
+
+    return index
 
 
 def parse_pagexml(
@@ -423,11 +999,20 @@ def parse_pagexml(
     region2line_annotation=region2line_annotation,
     diary2scan=diary2scan,
     body2length=body2length,
+    custom_tags=CUSTOM_TAGS,
+    simplify=None,
+    simplification=simplification,
 ):
 
+    # Only the text stage needs pagexml, which is slow to import
+    from pagexml.parser import parse_pagexml_file
+    from pagexml.helper.pagexml_helper import get_custom_tags
+    from pagexml.model.physical_document_model import PageXMLTextLine, Coords
+
     annotations = []
 
-    page = parse_pagexml_file(pagexml_file_path)
+    # Parse once, with the custom tags, for both the text and the entities
+    page = parse_pagexml_file(pagexml_file_path, custom_tags=custom_tags)
 
     filename = os.path.basename(pagexml_file_path).split("_", 1)[1]
     scan_name = filename.replace(".xml", ".jpg")
@@ -435,10 +1020,48 @@ def parse_pagexml(
 
     diary2scan[diary].append(scan_uri)
 
+    # Shared by every region and line on the page
+    scan = {
+        "@id": scan_uri,
+        "type": "ImageObject",
+        "name": scan_name,
+        "contentUrl": scan_uri + "/full/max/0/default.jpg",
+        "thumbnailUrl": scan_uri + "/full/,250/0/default.jpg",
+    }
+
     # TODO: these are not unique
     base_filename = os.path.basename(pagexml_file_path)
 
-    for region in page.text_regions:
+    # Trick to fool the query: have at least one line
+    region_lines = [
+        (
+            region,
+            region.lines
+            or [
+                PageXMLTextLine(
+                    doc_id="empty", coords=Coords(points="0,0 0,0 0,0 0,0"), text=""
+                )
+            ],
+        )
+        for region in page.text_regions
+    ]
+
+    # Selectors of every region, followed by those of its lines
+    selectors = iter(
+        get_selectors(
+            [
+                coords
+                for region, lines in region_lines
+                for coords in [region.coords] + [line.coords for line in lines]
+            ],
+            page.coords.w,
+            page.coords.h,
+            simplify,
+            simplification,
+        )
+    )
+
+    for region, lines in region_lines:
 
         region_id = f"{PREFIX}annotations/regions/{base_filename.replace('.xml', '/')}{region.id}"
         target_id = f"{region_id}-target"
@@ -455,11 +1078,10 @@ def parse_pagexml(
 
         # region2text[region.id] = {"coords": region.coords, "lines": []}
 
+        xywh, svg = next(selectors)
+
         region_annotation = {
-            "@context": [
-                "http://www.w3.org/ns/anno.jsonld",
-                "http://iiif.io/api/extension/text-granularity/context.json",
-            ],
+            "@context": TEXT_CONTEXT,
             "id": region_id,
             "type": "Annotation",
             "textGranularity": "block",
@@ -474,36 +1096,27 @@ def parse_pagexml(
             "target": {
                 "id": target_id,
                 "type": "SpecificResource",
-                "source": {
-                    "@id": scan_uri,
-                    "type": "ImageObject",
-                    "name": scan_name,
-                    "contentUrl": scan_uri + "/full/max/0/default.jpg",
-                    "thumbnailUrl": scan_uri + "/full/,250/0/default.jpg",
-                },
+                "source": scan,
                 "selector": [
                     {
                         "type": "FragmentSelector",
-                        "value": f"xywh={max(0, region.coords.x)},{max(0, region.coords.y)},{min(page.coords.w - max(0, region.coords.x), region.coords.w)},{min(page.coords.h - max(0, region.coords.y), region.coords.h)}",
+                        "value": xywh,
                         "conformsTo": "http://www.w3.org/TR/media-frags/",
                     },
                     {
                         "type": "SvgSelector",
-                        "value": getSVG(region.coords.points),
+                        "value": svg,
                         "conformsTo": "http://www.w3.org/TR/SVG/",
                     },
                 ],
             },
         }
 
-        # Trick to fool the query: have at least one line
-        for line in region.lines or [
-            PageXMLTextLine(
-                doc_id="empty", coords=Coords(points="0,0 0,0 0,0 0,0"), text=""
-            )
-        ]:
+        for line in lines:
             # region2text[region.id]["lines"].append()
 
+            xywh, svg = next(selectors)
+
             line_id = f"{region_id}-{line.id}"
             body_id = f"{line_id}-body"
 
@@ -518,10 +1131,7 @@ def parse_pagexml(
                 region2textualbody[region_id].append(body_id)
 
             line_annotation = {
-                "@context": [
-                    "http://www.w3.org/ns/anno.jsonld",
-                    "http://iiif.io/api/extension/text-granularity/context.json",
-                ],
+                "@context": TEXT_CONTEXT,
                 "id": line_id,
                 "type": "Annotation",
                 "textGranularity": "line",
@@ -535,22 +1145,16 @@ def parse_pagexml(
                 ],
                 "target": {
                     "type": "SpecificResource",
-                    "source": {
-                        "@id": scan_uri,
-                        "type": "ImageObject",
-                        "name": scan_name,
-                        "contentUrl": scan_uri + "/full/max/0/default.jpg",
-                        "thumbnailUrl": scan_uri + "/full/,250/0/default.jpg",
-                    },
+                    "source": scan,
                     "selector": [
                         {
                             "type": "FragmentSelector",
-                            "value": f"xywh={max(0, line.coords.x)},{max(0, line.coords.y)},{min(page.coords.w - line.coords.x, line.coords.w)},{min(page.coords.h - line.coords.y, line.coords.h)}",
+                            "value": xywh,
                             "conformsTo": "http://www.w3.org/TR/media-frags/",
                         },
                         {
                             "type": "SvgSelector",
-                            "value": getSVG(line.coords.points),
+                            "value": svg,
                             "conformsTo": "http://www.w3.org/TR/SVG/",
                         },
                     ],
@@ -561,170 +1165,526 @@ def parse_pagexml(
 
         annotations.append(region_annotation)
 
-    return annotations
+    tags = get_custom_tags(page)
 
+    return annotations, tags
 
-def make_entity_annotation(
-    tag, identifier="", prefix="", filename="", tagtype2resource=tagtype2resource
-):
 
-    if not identifier:
-        identifier = uuid.uuid4()
+def parse_page(diary, pagexml_file_path, simplify=None):
 
-        if prefix:
-            identifier = f"{prefix}{identifier}"
+    # Fresh indexes per page, so that a worker process can hand them back
+    page_region2textualbody = defaultdict(list)
+    page_region2line_annotation = defaultdict(list)
+    page_diary2scan = defaultdict(list)
+    page_body2length = dict()
+    page_simplification = defaultdict(int)
 
-    # TODO: these are not unique
-    base_filename = os.path.basename(filename)
+    annotations, tags = parse_pagexml(
+        diary,
+        pagexml_file_path,
+        page_region2textualbody,
+        page_region2line_annotation,
+        page_diary2scan,
+        page_body2length,
+        simplify=simplify,
+        simplification=page_simplification,
+    )
 
-    source = f"{PREFIX}annotations/regions/{base_filename.replace('.xml', '/')}{tag['region_id']}-{tag['line_id']}-body"
+    return (
+        annotations,
+        tags,
+        page_region2textualbody,
+        page_region2line_annotation,
+        page_diary2scan,
+        page_body2length,
+        page_simplification,
+    )
 
-    annotation = {
-        "@context": "http://www.w3.org/ns/anno.jsonld",
-        "id": identifier,
-        "type": "Annotation",
-        "body": [
-            {
-                "type": "SpecificResource",
-                "source": {  # shallow link
-                    "id": tagtype2resource[tag["type"]]["id"],
-                    "type": tagtype2resource[tag["type"]]["type"],
-                    "label": tagtype2resource[tag["type"]]["label"],
-                },
-                "purpose": "classifying",
-            }
-        ],
-        "target": [
-            {
-                "type": "SpecificResource",
-                "source": source,
-                "selector": [
-                    {
-                        "type": "TextQuoteSelector",
-                        "exact": tag["value"],
-                    },
-                    {
-                        "type": "TextPositionSelector",
-                        "start": tag["offset"],
-                        "end": tag["offset"] + tag["length"],
-                    },
-                ],
-            }
-        ],
+
+def list_pages(folder="data/diaries/"):
+
+    pages = []
+    for diary in os.listdir(folder):
+        page_xml_path = os.path.join(folder, diary, "page")
+        for file in sorted(os.listdir(page_xml_path)):
+            if file.endswith(".xml") and file not in ("metadata.xml", "mets.xml"):
+                pages.append((diary, os.path.join(page_xml_path, file)))
+
+    return pages
+
+
+def parse_pages(pages, jobs=1, simplify=None):
+
+    diaries = [diary for diary, _ in pages]
+    filepaths = [filepath for _, filepath in pages]
+    simplify = [simplify] * len(pages)
+
+    if jobs > 1:
+        # map() keeps the input order, so the output matches a serial run
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            yield from executor.map(
+                parse_page, diaries, filepaths, simplify, chunksize=8
+            )
+    else:
+        yield from map(parse_page, diaries, filepaths, simplify)
+
+
+def file_hash(filepath):
+
+    sha256 = hashlib.sha256()
+    with open(filepath, "rb") as infile:
+        for chunk in iter(lambda: infile.read(1 << 20), b""):
+            sha256.update(chunk)
+
+    return sha256.hexdigest()
+
+
+def load_manifest(manifest_file=BUILD_MANIFEST, simplify=None):
+
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "code": file_hash(__file__),
+        "simplify": simplify,
+        "inputs": dict(),
+        "pages": dict(),
     }
 
-    return annotation
+    if not os.path.exists(manifest_file):
+        return manifest
+
+    with open(manifest_file) as infile:
+        previous = json.load(infile)
+
+    # Results of another version of this script cannot be reused
+    if previous.get("version") != manifest["version"]:
+        return manifest
+    elif previous.get("code") != manifest["code"]:
+        return manifest
+    elif previous.get("simplify") != manifest["simplify"]:
+        return manifest
 
+    return previous
 
-def add_entity_identifier(
-    annotation, identifier_df, diaryname2fileprefix, skip_tags=()
+
+def write_manifest(manifest, manifest_file=BUILD_MANIFEST):
+
+    os.makedirs(os.path.dirname(manifest_file), exist_ok=True)
+    with open(manifest_file, "w") as outfile:
+        json.dump(manifest, outfile, indent=4)
+
+
+def page_result_path(pagexml_file_path, build_folder=BUILD_FOLDER):
+    return os.path.join(build_folder, pagexml_file_path + ".json")
+
+
+def save_page_result(result, pagexml_file_path, build_folder=BUILD_FOLDER):
+
+    result_file = page_result_path(pagexml_file_path, build_folder)
+    os.makedirs(os.path.dirname(result_file), exist_ok=True)
+    with open(result_file, "w") as outfile:
+        json.dump(result, outfile)
+
+    return result_file
+
+
+def load_page_result(result_file):
+
+    with open(result_file) as infile:
+        return json.load(infile)
+
+
+def save_text_state(
+    page_tags,
+    region2textualbody,
+    region2line_annotation,
+    diary2scan,
+    body2length,
+    state_file=TEXT_STATE,
 ):
 
-    annotation_id = annotation["id"]
-    source = annotation["target"][0]["source"]
-    tag = (
-        annotation["body"][0]["source"]["id"]
-        .replace(PREFIX + "tags/entities/", "")
-        .replace(PREFIX + "tags/concepts/", "")
+    os.makedirs(os.path.dirname(state_file), exist_ok=True)
+    with open(state_file, "w") as outfile:
+        json.dump(
+            {
+                "page_tags": page_tags,
+                "region2textualbody": region2textualbody,
+                "region2line_annotation": region2line_annotation,
+                "diary2scan": diary2scan,
+                "body2length": body2length,
+            },
+            outfile,
+        )
+
+
+def load_text_state(state_file=TEXT_STATE):
+
+    if not os.path.exists(state_file):
+        raise FileNotFoundError(f"{state_file} not found, run the text stage first")
+
+    with open(state_file) as infile:
+        state = json.load(infile)
+
+    return (
+        state["page_tags"],
+        defaultdict(list, state["region2textualbody"]),
+        defaultdict(list, state["region2line_annotation"]),
+        defaultdict(list, state["diary2scan"]),
+        state["body2length"],
     )
-    text = " ".join([t["selector"][0]["exact"] for t in annotation["target"]]).strip()
-    text = text.replace("- ", "").replace("¬ ", "")
 
-    if tag in skip_tags:
-        return annotation, identifier_df
 
-    for diary, fileprefix in diaryname2fileprefix.items():
-        if fileprefix in source:
-            break
+def save_entity_state(entity_annotations, state_file=ENTITY_STATE):
+    """
+    Pass the annotations on while writing them to the state file. The file
+    is only replaced once all of them have been written.
+    """
 
-    # identifying
-    identifier, identifier_type, identifier_label, annotation_id, identifier_df = (
-        get_annotation_identifier(
-            diary, source, tag, text, annotation_id, identifier_df
-        )
+    os.makedirs(os.path.dirname(state_file), exist_ok=True)
+    with open(state_file + ".tmp", "w") as outfile, JSONArrayWriter(
+        outfile, compact=True
+    ) as writer:
+        for a in entity_annotations:
+            writer.write(asdict(a))
+            yield a
+
+    os.replace(state_file + ".tmp", state_file)
+
+
+def load_entity_state(state_file=ENTITY_STATE, tagtype2resource=tagtype2resource):
+
+    if not os.path.exists(state_file):
+        raise FileNotFoundError(f"{state_file} not found, run the entities stage first")
+
+    # Share the current tag resources again, with any fixed concepts
+    resources = {resource["id"]: resource for resource in tagtype2resource.values()}
+
+    with open(state_file) as infile:
+        return [
+            EntityAnnotation(
+                **dict(
+                    a,
+                    resource=resources.get(a["resource"]["id"], a["resource"]),
+                    spans=[EntitySpan(**span) for span in a["spans"]],
+                )
+            )
+            for a in json.load(infile)
+        ]
+
+
+def get_annotation_uuid(source, tag):
+
+    # The same annotation on the same text gets the same identifier in
+    # every build, so that unchanged annotations keep their id
+    name = json.dumps(
+        [source, tag["type"], tag["offset"], tag["length"], tag["value"]],
+        ensure_ascii=False,
     )
 
-    if annotation_id:
-        annotation["id"] = annotation_id
+    return uuid.uuid5(ANNOTATION_NAMESPACE, name)
+
+
+@dataclass(slots=True)
+class EntitySpan:
+    """
+    The text of an entity on one line: the body of the line, and the
+    quote and position in its text.
+    """
+
+    source: str
+    exact: str
+    start: int
+    end: int
+
+    def to_jsonld(self):
+        return {
+            "type": "SpecificResource",
+            "source": self.source,
+            "selector": [
+                {
+                    "type": "TextQuoteSelector",
+                    "exact": self.exact,
+                },
+                {
+                    "type": "TextPositionSelector",
+                    "start": self.start,
+                    "end": self.end,
+                },
+            ],
+        }
 
-    if identifier:
-        if tag == "date":
-            annotation["body"].append(
+
+@dataclass(slots=True)
+class EntityAnnotation:
+    """
+    An entity annotation during the build, with its tag resource shared by
+    reference and a span per line. It is turned into JSON-LD when written.
+    """
+
+    id: str
+    resource: dict
+    spans: list
+    identifier: str = None
+    identifier_type: str = None
+    identifier_label: str = None
+
+    @property
+    def tag(self):
+        return (
+            self.resource["id"]
+            .replace(PREFIX + "tags/entities/", "")
+            .replace(PREFIX + "tags/concepts/", "")
+        )
+
+    @property
+    def text(self):
+        return normalize_text(" ".join(span.exact for span in self.spans).strip())
+
+    def to_jsonld(self):
+
+        body = [
+            {
+                "type": "SpecificResource",
+                "source": {  # shallow link
+                    "id": self.resource["id"],
+                    "type": self.resource["type"],
+                    "label": self.resource["label"],
+                },
+                "purpose": "classifying",
+            }
+        ]
+
+        if not self.identifier:
+            pass
+        elif self.tag == "date":
+            body.append(
                 {
                     "type": "TextualBody",
                     "value": {
                         "@type": "http://www.w3.org/2001/XMLSchema#date",
-                        "@value": identifier,
+                        "@value": self.identifier,
                     },
                     "purpose": "identifying",
                 }
             )
-        elif tag == "abbrev":
-            annotation["body"].append(
+        elif self.tag == "abbrev":
+            body.append(
                 {
                     "type": "TextualBody",
-                    "value": identifier,
+                    "value": self.identifier,
                     "purpose": "identifying",
                 }
             )
         else:
-            annotation["body"].append(
+            body.append(
                 {
                     "type": "SpecificResource",
                     "source": {
-                        "id": identifier,
-                        "type": identifier_type,
-                        "label": identifier_label,
+                        "id": self.identifier,
+                        "type": self.identifier_type,
+                        "label": self.identifier_label,
                     },
                     "purpose": "identifying",
                 }
             )
 
-    return annotation, identifier_df
+        return {
+            "@context": "http://www.w3.org/ns/anno.jsonld",
+            "id": self.id,
+            "type": "Annotation",
+            "body": body,
+            "target": [span.to_jsonld() for span in self.spans],
+        }
 
 
-def merge_annotations(annotations):
+def make_entity_annotation(
+    tag, identifier="", prefix="", filename="", tagtype2resource=tagtype2resource
+):
 
-    for a2, a1 in zip(reversed(annotations[1:]), reversed(annotations[:-1])):
+    # TODO: these are not unique
+    base_filename = os.path.basename(filename)
 
-        # Are the annotations of the same type?
-        if not a1["body"][0]["source"] == a2["body"][0]["source"]:
-            continue
+    source = f"{PREFIX}annotations/regions/{base_filename.replace('.xml', '/')}{tag['region_id']}-{tag['line_id']}-body"
 
-        text_length = body2length[a1["target"][0]["source"]]
+    if not identifier:
+        identifier = get_annotation_uuid(source, tag)
 
-        # Is the annotation at the end of the text?
-        if not a1["target"][0]["selector"][1]["end"] == text_length:
-            continue
+        if prefix:
+            identifier = f"{prefix}{identifier}"
+
+    return EntityAnnotation(
+        id=identifier,
+        resource=tagtype2resource[tag["type"]],
+        spans=[
+            EntitySpan(
+                source=source,
+                exact=tag["value"],
+                start=tag["offset"],
+                end=tag["offset"] + tag["length"],
+            )
+        ],
+    )
 
-        # Is the next annotation in the next line?
-        body_id_a1 = a1["target"][0]["source"]
-        body_id_a2 = a2["target"][0]["source"]
 
-        region_id_a1 = body_id_a1.rsplit("-", 2)[0]
-        region_id_a2 = body_id_a2.rsplit("-", 2)[0]
+def normalize_text(text):
+    return text.replace("- ", "").replace("¬ ", "")
 
-        index_a1 = region2textualbody[region_id_a1].index(body_id_a1)
-        index_a2 = region2textualbody[region_id_a2].index(body_id_a2)
 
-        if not index_a2 - index_a1 == 1:
-            continue
+class LinkingIndex:
+    """
+    Lookup table for annotations_linking.csv on (source, tag, text).
 
-        # Is the next annotation at the start of the text?
-        if not a2["target"][0]["selector"][1]["start"] == 0:
-            continue
+    The index is built once from the DataFrame. Rows for annotations that
+    are not in the table yet are collected and only added to the table
+    when calling `to_frame()`.
+    """
+
+    def __init__(self, df, diaryname2fileprefix=None):
+
+        self.df = df
+        self.columns = list(df.columns)
+        self.new_rows = []
+
+        self.rows = dict()
+        for row in df.to_dict("records"):
+            key = (row["source"], row["tag"], row["text"])
+
+            # First match wins, as with df.query(...).iloc[0]
+            self.rows.setdefault(key, row)
+
+        self.diaryname2fileprefix = diaryname2fileprefix or dict()
+        self.page2diary = dict()
+
+    def __len__(self):
+        return self.df.shape[0] + len(self.new_rows)
+
+    def get(self, source, tag, text):
+        return self.rows.get((source, tag, text))
+
+    def add(self, row):
+
+        row = {column: row.get(column) for column in self.columns}
+        self.new_rows.append(row)
+        self.rows.setdefault((row["source"], row["tag"], row["text"]), row)
+
+        return row
+
+    def diary(self, source):
+
+        page = source.rsplit("/", 1)[0]
+
+        if page not in self.page2diary:
+            for diary, fileprefix in self.diaryname2fileprefix.items():
+                if fileprefix in page:
+                    break
+            else:
+                # Not in metadata_diaries.csv
+                diary = None
+            self.page2diary[page] = diary
+
+        return self.page2diary[page]
+
+    def to_frame(self):
 
-        # annotations.remove(a1)
-        annotations.remove(a2)
+        if not self.new_rows:
+            return self.df
 
-        # Merge targets
-        a1["target"] += a2["target"]
-        # annotations.append(a1)
+        df_add = pd.DataFrame(self.new_rows, columns=self.columns)
+        return pd.concat([self.df, df_add], ignore_index=True)
 
-    return annotations
 
+def add_entity_identifier(annotation, linking_index, skip_tags=()):
 
-def get_annotation_identifier(diary, source_body, tag, text, annotation_id, df):
+    tag = annotation.tag
+
+    if tag in skip_tags:
+        return annotation
+
+    source = annotation.spans[0].source
+    diary = linking_index.diary(source)
+
+    # identifying
+    identifier, identifier_type, identifier_label, annotation_id = (
+        get_annotation_identifier(
+            diary, source, tag, annotation.text, annotation.id, linking_index
+        )
+    )
+
+    if annotation_id:
+        annotation.id = annotation_id
+
+    annotation.identifier = identifier
+    annotation.identifier_type = identifier_type
+    annotation.identifier_label = identifier_label
+
+    return annotation
+
+
+def continues(a1, a2, body2length, body2position):
+
+    span_a1 = a1.spans[0]
+    span_a2 = a2.spans[0]
+
+    # Are the annotations of the same type?
+    if not a1.resource == a2.resource:
+        return False
+
+    # Is the annotation at the end of the text?
+    if not span_a1.end == body2length[span_a1.source]:
+        return False
+
+    # Is the next annotation in the next line?
+    position_a1 = body2position.get(span_a1.source)
+    position_a2 = body2position.get(span_a2.source)
+
+    if position_a1 is None or position_a2 is None:
+        return False
+
+    # Only the ordinals are compared: an entity can continue on the next
+    # line of a text block that is split over two regions
+    _, index_a1 = position_a1
+    _, index_a2 = position_a2
+
+    if not index_a2 - index_a1 == 1:
+        return False
+
+    # Is the next annotation at the start of the text?
+    if not span_a2.start == 0:
+        return False
+
+    return True
+
+
+def merge_annotations(
+    annotations, body2length=body2length, region2textualbody=region2textualbody
+):
+
+    # Position of every line in its region: body id -> (region id, ordinal)
+    body2position = dict()
+    for region_id, body_ids in region2textualbody.items():
+        for index, body_id in enumerate(body_ids):
+            body2position.setdefault(body_id, (region_id, index))
+
+    # An annotation is only complete when the next one does not continue it
+    merged_annotation = None
+    a1 = None
+    for a2 in annotations:
+        if a1 is not None and continues(a1, a2, body2length, body2position):
+            # Merge targets (into the first annotation of the chain)
+            merged_annotation.spans += a2.spans
+        else:
+            if merged_annotation is not None:
+                yield merged_annotation
+            merged_annotation = a2
+
+        a1 = a2
+
+    if merged_annotation is not None:
+        yield merged_annotation
+
+
+def get_annotation_identifier(
+    diary, source_body, tag, text, annotation_id, linking_index
+):
 
     # temp fix
     source = source_body.replace("-body", "")
@@ -733,45 +1693,35 @@ def get_annotation_identifier(diary, source_body, tag, text, annotation_id, df):
 
     source = f"{source_prefix}/{source_line}"
 
-    results = df.query("source == @source & tag == @tag & text == @text")
+    result = linking_index.get(source, tag, text)
 
-    if results.empty:
+    if result is None:
         print(f"No identifier found for: {source}, {tag}, {text}")
 
         # add to df
         # index,annotation,tag,source,text,uri,label,date,checken
-        df_add = pd.DataFrame(
+        linking_index.add(
             {
-                "index": [df.shape[0] + 1],
-                "annotation": [annotation_id],
-                "diary": [diary],
-                "tag": [tag],
-                "source": [source],
-                "text": [text],
-                "uri": [None],
-                "date": [None],
-                "label": [None],
-                "description": [None],
-                "latitude": [None],
-                "longitude": [None],
-                "checken": [None],
+                "index": len(linking_index) + 1,
+                "annotation": annotation_id,
+                "diary": diary,
+                "tag": tag,
+                "source": source,
+                "text": text,
             }
         )
-        df = pd.concat([df, df_add], ignore_index=True)
 
-        return None, None, None, df
+        return None, None, None, None
     else:
-        annotation_id = results.iloc[0]["annotation"]
+        annotation_id = result["annotation"]
 
-        identifier_label = results.iloc[0]["label"]
+        identifier_label = result["label"]
 
-        identifier = (
-            results.iloc[0]["uri"] if not pd.isna(results.iloc[0]["uri"]) else None
-        )
+        identifier = result["uri"] if not pd.isna(result["uri"]) else None
 
         # If no uri, use date
         identifier = identifier or (
-            results.iloc[0]["date"] if not pd.isna(results.iloc[0]["date"]) else None
+            result["date"] if not pd.isna(result["date"]) else None
         )
 
         if tag == "person":
@@ -783,12 +1733,11 @@ def get_annotation_identifier(diary, source_body, tag, text, annotation_id, df):
         else:
             identifier_type = None
 
-    return identifier, identifier_type, identifier_label, annotation_id, df
+    return identifier, identifier_type, identifier_label, annotation_id
 
 
 def generate_external_data(df):
 
-    resources = []
     cache = set()
 
     for _, r in df.iterrows():
@@ -837,116 +1786,982 @@ def generate_external_data(df):
             }
 
         cache.add(r["uri"])
-        resources.append(resource)
+        yield resource
 
-    return resources
 
+class Watcher:
+    """
+    Watch mode: the parsed pages stay in memory, and the output is rebuilt
+    when a PAGE XML file or a CSV changes. Only the changed pages are
+    parsed again, the annotations of the other pages are reused as they
+    were serialized, and only the outputs that depend on a change are
+    written again.
 
-def main():
+    The entity annotations are kept per segment of pages (see `link`). Only
+    the segments that a changed page can affect are merged and linked
+    again. New or removed pages, and changes to the concepts or the linking
+    table, merge and link all pages.
+    """
 
-    # Text (from pagexml)
-    textual_annotations = []
-    for diary in os.listdir("data/diaries/"):
-        print(diary)
-        page_xml_path = os.path.join("data/diaries/", diary, "page")
-        for file in sorted(os.listdir(page_xml_path)):
-            if file.endswith(".xml") and file not in ("metadata.xml", "mets.xml"):
-                filepath = os.path.join(page_xml_path, file)
+    def __init__(self, folder="data/diaries/", compact=False, simplify=None, jobs=1):
 
-                textual_annotations += parse_pagexml(
-                    diary,
-                    filepath,
-                    region2textualbody,
-                    region2line_annotation,
-                    diary2scan,
-                    body2length,
+        self.folder = folder
+        self.compact = compact
+        self.simplify = simplify
+        self.jobs = jobs
+
+        self.serializer = JSONArrayWriter(None, compact)
+
+        self.pages = []
+        self.stats = dict()
+        self.results = dict()
+        self.textual = dict()
+        self.segments = None
+
+        self.linking_index = None
+        self.linking_rows = 0
+
+    def stat(self, filepath):
+
+        stat = os.stat(filepath)
+        return stat.st_mtime_ns, stat.st_size
+
+    def scan(self):
+
+        # Files can disappear while they are replaced, try again next time
+        try:
+            pages = list_pages(self.folder)
+            stats = {filepath: self.stat(filepath) for _, filepath in pages}
+            stats.update({csv_file: self.stat(csv_file) for csv_file in CSV_FILES})
+        except OSError as e:
+            print(f"Could not read the input: {e}")
+            return None
+
+        changed = {f for f, stat in stats.items() if self.stats.get(f) != stat}
+        removed = set(self.stats) - set(stats)
+
+        return pages, stats, changed, removed
+
+    def write(self, filepath, serialized):
+
+        # Replace the file at once, so that it is never read half written
+        with open(filepath + ".tmp", "w") as outfile:
+            writer = JSONArrayWriter(outfile, self.compact)
+            for data in serialized:
+                writer.write_data(data)
+            writer.close()
+
+        os.replace(filepath + ".tmp", filepath)
+
+    def parse(self, changed_pages, results, textual):
+
+        lines_changed = False
+
+        parsed_pages = zip(
+            changed_pages, parse_pages(changed_pages, self.jobs, self.simplify)
+        )
+        for (_, filepath), result in parsed_pages:
+            previous = results.get(filepath)
+            if previous is None or previous[3] != result[3]:
+                lines_changed = True
+
+            results[filepath] = result
+            textual[filepath] = [self.serializer.serialize(a) for a in result[0]]
+
+        return lines_changed
+
+    def get_indexes(self, pages, results):
+
+        region2textualbody = defaultdict(list)
+        region2line_annotation = defaultdict(list)
+        diary2scan = defaultdict(list)
+        body2length = dict()
+
+        for _, filepath in pages:
+            (
+                _,
+                _,
+                page_region2textualbody,
+                page_region2line_annotation,
+                page_diary2scan,
+                page_body2length,
+                _,
+            ) = results[filepath]
+
+            for region_id, body_ids in page_region2textualbody.items():
+                region2textualbody[region_id] += body_ids
+            for region_id, line_ids in page_region2line_annotation.items():
+                region2line_annotation[region_id] += line_ids
+            for scan_diary, scan_uris in page_diary2scan.items():
+                diary2scan[scan_diary] += scan_uris
+            body2length.update(page_body2length)
+
+        return region2textualbody, region2line_annotation, diary2scan, body2length
+
+    def get_runs(self, pages, changed_pages, segments):
+        """
+        The runs of segments whose entity annotations have to be merged and
+        linked again: the segments with a changed page, and the segments
+        before and after them, whose last and first annotations a changed
+        page can continue. All pages when pages were added or removed.
+        """
+
+        filepaths = [f for _, f in pages]
+        if filepaths != [f for segment, _ in segments for f in segment]:
+            return [(0, len(segments), filepaths)]
+
+        page2segment = {
+            f: i for i, (segment, _) in enumerate(segments) for f in segment
+        }
+
+        affected = set()
+        for _, filepath in changed_pages:
+            i = page2segment[filepath]
+            affected.update(range(max(i - 1, 0), min(i + 2, len(segments))))
+
+        # Contiguous segments are merged together
+        runs = []
+        for i in sorted(affected):
+            if runs and runs[-1][1] == i:
+                runs[-1][1] = i + 1
+            else:
+                runs.append([i, i + 1])
+
+        return [
+            (start, end, [f for segment, _ in segments[start:end] for f in segment])
+            for start, end in runs
+        ]
+
+    def link(
+        self, filepaths, results, linking_index, cache, region2textualbody, body2length
+    ):
+        """
+        Merge and link the entity annotations of these pages, and split them
+        into segments: a segment starts at a page whose first annotation does
+        not continue one of an earlier page, so that no merge crosses it.
+        """
+
+        page_annotations = [
+            (
+                filepath,
+                [
+                    make_entity_annotation(
+                        tag,
+                        prefix=PREFIX + "annotations/",
+                        filename=filepath,
+                        tagtype2resource=tagtype2resource,
+                    )
+                    for tag in results[filepath][1]
+                ],
+            )
+            for filepath in filepaths
+        ]
+
+        annotation2page = {
+            id(a): filepath
+            for filepath, annotations in page_annotations
+            for a in annotations
+        }
+        entity_annotations = list(
+            merge_annotations(
+                (a for _, annotations in page_annotations for a in annotations),
+                body2length,
+                region2textualbody,
+            )
+        )
+        heads = {id(a) for a in entity_annotations}
+
+        segments = []
+        page2segment = dict()
+        for filepath, annotations in page_annotations:
+            if not segments or (annotations and id(annotations[0]) in heads):
+                segments.append(([], []))
+            segments[-1][0].append(filepath)
+            page2segment[filepath] = segments[-1][1]
+
+        # Annotations that did not change keep their serialization
+        for annotation in entity_annotations:
+            filepath = annotation2page[id(annotation)]
+            add_entity_identifier(annotation, linking_index)
+
+            key = (
+                annotation.id,
+                annotation.resource["id"],
+                tuple(
+                    (span.source, span.exact, span.start, span.end)
+                    for span in annotation.spans
+                ),
+                annotation.identifier,
+                annotation.identifier_type,
+                annotation.identifier_label,
+            )
+            page2segment[filepath].append(
+                (
+                    key,
+                    cache.get(key) or self.serializer.serialize(annotation.to_jsonld()),
                 )
+            )
 
-    with open("rdf/textual_annotations.jsonld", "w") as outfile:
-        json.dump(textual_annotations, outfile, indent=4)
+        return segments
 
-    # Metadata
-    resources, diaryname2fileprefix = generate_metadata(
-        METADATA_DIARIES, METADATA_ENTRIES, METADATA_PERSONS, diary2scan
+    def rebuild(self, pages, stats, changed, removed):
+        """
+        Rebuild the outputs that depend on the changed files. The changes
+        only count as seen when everything was written, so that a file that
+        could not be read (e.g. while it was being saved) is tried again.
+        """
+
+        start = time.perf_counter()
+
+        try:
+            outputs = self.build(pages, stats, changed, removed)
+        except Exception as e:
+            print(f"Could not rebuild, trying again on the next check: {e}")
+            return
+
+        print(
+            f"Rebuilt the {', '.join(outputs) or 'nothing'} for {len(changed | removed)} "
+            f"changed files in {time.perf_counter() - start:.2f} s"
+        )
+
+    def build(self, pages, stats, changed, removed):
+
+        outputs = []
+
+        page_list_changed = [f for _, f in pages] != [f for _, f in self.pages]
+        changed_pages = [(diary, f) for diary, f in pages if f in changed]
+
+        # Kept aside until everything is written
+        results = {f: r for f, r in self.results.items() if f not in removed}
+        textual = {f: t for f, t in self.textual.items() if f not in removed}
+        segments = self.segments
+        linking_index = self.linking_index
+
+        lines_changed = self.parse(changed_pages, results, textual)
+
+        region2textualbody, region2line_annotation, diary2scan, body2length = (
+            self.get_indexes(pages, results)
+        )
+
+        if changed_pages or page_list_changed:
+            self.write(
+                "rdf/textual_annotations.jsonld",
+                (data for _, f in pages for data in textual[f]),
+            )
+            outputs.append("textual annotations")
+
+        if (
+            page_list_changed
+            or lines_changed
+            or changed & {METADATA_DIARIES, METADATA_ENTRIES, METADATA_PERSONS}
+        ):
+            self.write(
+                "rdf/metadata.jsonld",
+                (
+                    self.serializer.serialize(resource)
+                    for resource in generate_metadata(
+                        METADATA_DIARIES,
+                        METADATA_ENTRIES,
+                        METADATA_PERSONS,
+                        diary2scan,
+                        region2line_annotation,
+                    )
+                ),
+            )
+            outputs.append("metadata")
+
+        if METADATA_CONCEPTS in changed:
+            concepts = generate_concept_metadata(METADATA_CONCEPTS)
+            for c in concepts:
+                tagtype2resource[c["notation"]] = c
+
+            # The annotations embed their concept
+            segments = None
+
+            self.write(
+                "rdf/concepts.jsonld",
+                (self.serializer.serialize(c) for c in concepts),
+            )
+            outputs.append("concepts")
+
+        if changed & {ANNOTATION_IDENTIFIERS, METADATA_DIARIES}:
+            linking_index = LinkingIndex(
+                pd.read_csv(ANNOTATION_IDENTIFIERS),
+                get_diaryname2fileprefix(METADATA_DIARIES),
+            )
+            linking_rows = len(linking_index)
+        else:
+            linking_rows = self.linking_rows
+
+        if (
+            changed_pages
+            or page_list_changed
+            or changed & {METADATA_DIARIES, METADATA_CONCEPTS, ANNOTATION_IDENTIFIERS}
+        ):
+            # Every annotation is looked up again in a new linking table, and
+            # without segments (the concepts changed) nothing is reused
+            if segments is None or changed & {METADATA_DIARIES, ANNOTATION_IDENTIFIERS}:
+                runs = [(0, len(segments or []), [f for _, f in pages])]
+            else:
+                runs = self.get_runs(pages, changed_pages, segments)
+
+            # From the last run, so that the segments before it keep their place
+            segments = segments or []
+            for start, end, filepaths in reversed(runs):
+                cache = dict(
+                    data
+                    for _, annotations in segments[start:end]
+                    for data in annotations
+                )
+                segments = (
+                    segments[:start]
+                    + self.link(
+                        filepaths,
+                        results,
+                        linking_index,
+                        cache,
+                        region2textualbody,
+                        body2length,
+                    )
+                    + segments[end:]
+                )
+
+            entities = dict(data for _, annotations in segments for data in annotations)
+            self.write("rdf/entity_annotations.jsonld", entities.values())
+            outputs.append("entity annotations")
+
+        # New annotations are added to the linking table, without
+        # rebuilding everything for this change of our own
+        if len(linking_index) != linking_rows or ANNOTATION_IDENTIFIERS in changed:
+            df_annotation_identifiers = linking_index.to_frame()
+
+            if len(linking_index) != linking_rows:
+                df_annotation_identifiers.to_csv(ANNOTATION_IDENTIFIERS, index=False)
+                stats[ANNOTATION_IDENTIFIERS] = self.stat(ANNOTATION_IDENTIFIERS)
+                linking_rows = len(linking_index)
+
+            self.write(
+                "rdf/external_resources.jsonld",
+                (
+                    self.serializer.serialize(resource)
+                    for resource in generate_external_data(df_annotation_identifiers)
+                ),
+            )
+            outputs.append("external resources")
+
+        self.pages = pages
+        self.stats = stats
+        self.results = results
+        self.textual = textual
+        self.segments = segments
+        self.linking_index = linking_index
+        self.linking_rows = linking_rows
+
+        return outputs
+
+    def run(self, interval=1.0):
+
+        print(f"Watching {self.folder} and the CSV files, stop with Ctrl-C")
+
+        try:
+            while True:
+                scan = self.scan()
+                if scan is not None and (scan[2] or scan[3]):
+                    self.rebuild(*scan)
+
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            pass
+
+
+def main(
+    jobs=1,
+    incremental=False,
+    compact=False,
+    nquads=False,
+    graph_document=False,
+    delta=False,
+    profile=None,
+    cprofile=None,
+    simplify=None,
+    shards=False,
+    publish_output=False,
+    stages=STAGES,
+    diary=None,
+):
+
+    profiler = Profiler(
+        enabled=profile is not None or cprofile is not None, cprofile_folder=cprofile
     )
 
-    with open("rdf/metadata.jsonld", "w") as outfile:
-        json.dump(resources, outfile, indent=4)
+    pages = list_pages("data/diaries/")
+
+    if diary is not None and diary not in get_folder_names(METADATA_DIARIES):
+        raise ValueError(f"Unknown diary: {diary}")
+
+    # Only parse the pages that changed since the last (incremental) build
+    if incremental:
+        manifest = load_manifest(BUILD_MANIFEST, simplify)
+        inputs = {filepath: file_hash(filepath) for _, filepath in pages}
+        inputs.update({csv_file: file_hash(csv_file) for csv_file in CSV_FILES})
+
+        # The same output as last time, unless it was asked for in another form
+        outputs = {
+            "compact": compact,
+            "nquads": nquads,
+            "graph": graph_document,
+            "shards": shards,
+            "publish": publish_output,
+        }
+
+        # A delta and a run report are about this run, so they are always written
+        if (
+            inputs == manifest["inputs"]
+            and outputs == manifest.get("outputs")
+            and not delta
+            and not profiler.enabled
+        ):
+            print("Nothing changed since the last build")
+            return
+
+        changed_pages = [
+            (diary, filepath)
+            for diary, filepath in pages
+            if manifest["inputs"].get(filepath) != inputs[filepath]
+            or filepath not in manifest["pages"]
+        ]
+
+        # Forget pages that are no longer there
+        for filepath in set(manifest["pages"]) - set(inputs):
+            result_file = manifest["pages"].pop(filepath)
+            if os.path.exists(result_file):
+                os.remove(result_file)
+
+        print(f"Parsing {len(changed_pages)} of {len(pages)} pages")
+    elif diary is not None:
+        # The other diaries come from the last build, unless they changed since
+        manifest = load_manifest(BUILD_MANIFEST, simplify)
+        inputs = {filepath: file_hash(filepath) for _, filepath in pages}
+        changed_pages = [
+            (page_diary, filepath)
+            for page_diary, filepath in pages
+            if page_diary == diary
+            or manifest["inputs"].get(filepath) != inputs[filepath]
+            or filepath not in manifest["pages"]
+        ]
+
+        print(f"Parsing {len(changed_pages)} of {len(pages)} pages")
+    else:
+        changed_pages = pages
+
+    # The previous build, before it is overwritten
+    if delta:
+        with profiler.stage("read_previous_build"):
+            previous_build = {
+                filepath: index_resources(read_resources(filepath))
+                for filepath in DELTA_FILES
+            }
+
+    if nquads or delta:
+        diary2graph = get_diary2graph(METADATA_DIARIES)
+
+    if shards:
+        # Shards of pages that are gone should not stay behind
+        if os.path.exists(SHARD_FOLDER):
+            shutil.rmtree(SHARD_FOLDER)
+
+        diary2identifier = get_diary2identifier(METADATA_DIARIES)
+        shard_writer = ShardWriter(SHARD_FOLDER, compact, graph_document)
+        entry2pages = dict()
+    else:
+        shard_writer = None
+
+    if nquads:
+        nquads_file = open(NQUADS, "w")
+        nquads_writer = NQuadsWriter(nquads_file, skolem=SKOLEM_PREFIX)
+    else:
+        nquads_writer = None
+
+    page_tags = []
+    region2textualbody = defaultdict(list)
+    region2line_annotation = defaultdict(list)
+    diary2scan = defaultdict(list)
+    body2length = dict()
+
+    # Text (from pagexml) and custom tags, in one pass
+    if "text" in stages:
+        parsed_pages = parse_pages(changed_pages, jobs, simplify)
+        profiled_pages = profiler.iterate("parse_pagexml", parsed_pages)
+        changed_filepaths = {filepath for _, filepath in changed_pages}
+        previous_diary = None
+        with profiler.stage("write_json"), open(
+            "rdf/textual_annotations.jsonld", "w"
+        ) as outfile, open_writer(outfile, compact, graph_document) as writer:
+            for page_diary, filepath in pages:
+                if page_diary != previous_diary:
+                    print(page_diary)
+                    previous_diary = page_diary
+
+                    if shard_writer and page_diary not in diary2identifier:
+                        print(
+                            f"{page_diary} is not in {METADATA_DIARIES}, "
+                            "its pages are left out of the shards"
+                        )
+
+                if filepath in changed_filepaths:
+                    result = next(profiled_pages)
+
+                    if incremental or diary is not None:
+                        manifest["pages"][filepath] = save_page_result(result, filepath)
+                else:
+                    with profiler.stage("load_page_result"):
+                        result = load_page_result(manifest["pages"][filepath])
+
+                (
+                    annotations,
+                    tags,
+                    page_region2textualbody,
+                    page_region2line_annotation,
+                    page_diary2scan,
+                    page_body2length,
+                    page_simplification,
+                ) = result
+
+                for region_id, body_ids in page_region2textualbody.items():
+                    region2textualbody[region_id] += body_ids
+                for region_id, line_ids in page_region2line_annotation.items():
+                    region2line_annotation[region_id] += line_ids
+                for scan_diary, scan_uris in page_diary2scan.items():
+                    diary2scan[scan_diary] += scan_uris
+                body2length.update(page_body2length)
+                for key, n in page_simplification.items():
+                    simplification[key] += n
+
+                profiler.count("pages")
+                # Regions without lines have a placeholder line, which is not counted
+                profiler.count(
+                    "regions",
+                    sum(1 for a in annotations if a["textGranularity"] == "block"),
+                )
+                profiler.count(
+                    "lines", sum(map(len, page_region2line_annotation.values()))
+                )
+                profiler.count("tags", len(tags))
+
+                shard = None
+                if shard_writer and page_diary in diary2identifier:
+                    shard = get_scan_shard(
+                        diary2identifier[page_diary],
+                        filepath,
+                        "textual_annotations.jsonld",
+                    )
+
+                for annotation in annotations:
+                    writer.write(annotation)
+
+                    if nquads_writer:
+                        nquads_writer.write(annotation, diary2graph.get(page_diary))
+
+                    if shard:
+                        shard_writer.write(annotation, shard)
+                page_tags.append((filepath, tags))
+
+        if shard_writer:
+            shard_writer.close()
+
+        parsed_pages.close()
+
+        if simplify:
+            print(
+                f"Simplified the polygons: {simplification['vertices_saved']} of "
+                f"{simplification['vertices']} vertices and "
+                f"{simplification['bytes_saved']} bytes saved"
+            )
+            for key, n in simplification.items():
+                profiler.count(f"simplify_{key}", n)
+
+        # For the stages that run on their own
+        save_text_state(
+            page_tags,
+            region2textualbody,
+            region2line_annotation,
+            diary2scan,
+            body2length,
+        )
+
+        if diary is not None:
+            manifest["inputs"].update(
+                {filepath: inputs[filepath] for _, filepath in changed_pages}
+            )
+            write_manifest(manifest, BUILD_MANIFEST)
+
+    elif "metadata" in stages or "entities" in stages:
+        (
+            page_tags,
+            region2textualbody,
+            region2line_annotation,
+            diary2scan,
+            body2length,
+        ) = load_text_state()
+
+    def metadata_shard(resource):
+
+        # The pages of every entry, for the index
+        if resource.get("type") == "Annotation":
+            entry = resource["body"][0]
+            entry2pages[entry["@id"]] = (
+                entry["isPartOf"]["@id"],
+                list(dict.fromkeys(r.rsplit("/", 2)[1] for r in resource["target"])),
+            )
+
+        return get_metadata_shard(resource, diary2identifier)
+
+    # Metadata
+    if "metadata" in stages:
+        with profiler.stage("write_json"):
+            dump_json(
+                profiler.iterate(
+                    "generate_metadata",
+                    generate_metadata(
+                        METADATA_DIARIES,
+                        METADATA_ENTRIES,
+                        METADATA_PERSONS,
+                        diary2scan,
+                        region2line_annotation,
+                    ),
+                ),
+                "rdf/metadata.jsonld",
+                compact,
+                nquads_writer,
+                lambda resource: get_metadata_graph(resource, diary2graph),
+                graph_document,
+                shard_writer,
+                metadata_shard,
+            )
 
     # Concepts
-    concepts = generate_concept_metadata(METADATA_CONCEPTS)
+    with profiler.stage("generate_concepts"):
+        concepts = generate_concept_metadata(METADATA_CONCEPTS)
 
     # Add to tagtype2resource
     for c in concepts:
         tagtype2resource[c["notation"]] = c
 
-    with open("rdf/concepts.jsonld", "w") as outfile:
-        json.dump(concepts, outfile, indent=4)
-
-    # Annotations
-    entity_annotations = []
-    df_annotation_identifiers = pd.read_csv(ANNOTATION_IDENTIFIERS)
-    for diary in os.listdir("data/diaries/"):
-        page_xml_path = os.path.join("data/diaries/", diary, "page")
-        for file in sorted(os.listdir(page_xml_path)):
-            if file.endswith(".xml") and file not in ("metadata.xml", "mets.xml"):
-                filepath = os.path.join(page_xml_path, file)
+    if "concepts" in stages:
+        with profiler.stage("write_json"):
+            dump_json(
+                concepts,
+                "rdf/concepts.jsonld",
+                compact,
+                nquads_writer,
+                graph_document=graph_document,
+            )
 
-                page = parse_pagexml_file(
-                    filepath,
-                    custom_tags=(
-                        # "structure",
-                        "date",
-                        "person",
-                        "place",
-                        "organization",
-                        "add",
-                        "unclear",
-                        "blackening",
-                        "speech",
-                        "abbrev",
-                        "gap",
-                        "sic",
-                        "atm_food",
-                    ),
+    # Annotations (needs the concepts in tagtype2resource)
+    if "entities" in stages:
+        entity_annotations = profiler.iterate(
+            "make_entity_annotation",
+            (
+                make_entity_annotation(
+                    tag,
+                    prefix=PREFIX + "annotations/",
+                    filename=filepath,
+                    tagtype2resource=tagtype2resource,
                 )
+                for filepath, tags in page_tags
+                for tag in tags
+            ),
+        )
 
-                tags = get_custom_tags(page)
+        # Merge annotations
+        entity_annotations = profiler.iterate(
+            "merge_annotations",
+            merge_annotations(entity_annotations, body2length, region2textualbody),
+        )
 
-                for tag in tags:
-                    entity_annotations.append(
-                        make_entity_annotation(
-                            tag,
-                            prefix=PREFIX + "annotations/",
-                            filename=filepath,
-                            tagtype2resource=tagtype2resource,
-                        )
-                    )
+        # For the stages that run on their own
+        entity_annotations = save_entity_state(entity_annotations)
+
+        if "link" not in stages:
+            for _ in entity_annotations:
+                pass
 
-    # Merge annotations
-    entity_annotations = merge_annotations(entity_annotations)
+    elif "link" in stages:
+        entity_annotations = load_entity_state()
 
     # Add identifiers
-    new_entity_annotations = []
-    for a in entity_annotations:
-        a, df_annotation_identifiers = add_entity_identifier(
-            a,
-            df_annotation_identifiers,
-            diaryname2fileprefix,
-            # skip_tags=("add", "unclear", "blackening", "speech", "gap", "sic"),
+    if "link" in stages:
+        with profiler.stage("link_identifiers"):
+            df_annotation_identifiers = pd.read_csv(ANNOTATION_IDENTIFIERS)
+            linking_index = LinkingIndex(
+                df_annotation_identifiers, get_diaryname2fileprefix(METADATA_DIARIES)
+            )
+        entity_annotations = profiler.iterate(
+            "link_identifiers",
+            (
+                add_entity_identifier(
+                    a,
+                    linking_index,
+                    # skip_tags=("add", "unclear", "blackening", "speech", "gap", "sic"),
+                )
+                for a in entity_annotations
+            ),
+        )
+
+        def entity_graph(annotation):
+            return diary2graph.get(
+                linking_index.diary(annotation["target"][0]["source"])
+            )
+
+        def entity_shard(annotation):
+
+            # .../regions/<page>/<region>-<line>-body
+            source = annotation["target"][0]["source"]
+            diary = linking_index.diary(source)
+            if diary is None:
+                return None
+
+            return get_scan_shard(
+                diary2identifier[diary],
+                source.rsplit("/", 2)[1],
+                "entity_annotations.jsonld",
+            )
+
+        with profiler.stage("write_json"):
+            dump_json(
+                (annotation.to_jsonld() for annotation in entity_annotations),
+                "rdf/entity_annotations.jsonld",
+                compact,
+                nquads_writer,
+                entity_graph,
+                graph_document,
+                shard_writer,
+                entity_shard,
+            )
+
+        profiler.count(
+            "link_hits",
+            profiler.items("link_identifiers") - len(linking_index.new_rows),
+        )
+        profiler.count("link_misses", len(linking_index.new_rows))
+
+        # Write the unmatched annotations back in one go
+        with profiler.stage("write_linking_table"):
+            df_annotation_identifiers = linking_index.to_frame()
+            df_annotation_identifiers.to_csv(ANNOTATION_IDENTIFIERS, index=False)
+
+    elif "external" in stages:
+        df_annotation_identifiers = pd.read_csv(ANNOTATION_IDENTIFIERS)
+
+    # Once the merged annotations have been consumed
+    if "entities" in stages:
+        profiler.count(
+            "merges",
+            profiler.items("make_entity_annotation")
+            - profiler.items("merge_annotations"),
         )
-        new_entity_annotations.append(a)
 
-    df_annotation_identifiers.to_csv(ANNOTATION_IDENTIFIERS, index=False)
+    if "external" in stages:
+        with profiler.stage("write_json"):
+            dump_json(
+                profiler.iterate(
+                    "generate_external_data",
+                    generate_external_data(df_annotation_identifiers),
+                ),
+                "rdf/external_resources.jsonld",
+                compact,
+                nquads_writer,
+                graph_document=graph_document,
+            )
+
+    if shards:
+        with open(SHARD_INDEX, "w") as outfile:
+            json.dump(
+                get_shard_index(shard_writer.paths, entry2pages), outfile, indent=4
+            )
+        print(f"Wrote {len(shard_writer.paths)} shards to {SHARD_FOLDER}")
+
+    if nquads:
+        nquads_file.close()
+        print(f"Wrote {nquads_writer.count} quads to {NQUADS}")
+
+    if delta:
+        graphs = {
+            "rdf/textual_annotations.jsonld": lambda annotation: diary2graph.get(
+                linking_index.diary(annotation["id"])
+            ),
+            "rdf/metadata.jsonld": lambda resource: get_metadata_graph(
+                resource, diary2graph
+            ),
+            "rdf/entity_annotations.jsonld": entity_graph,
+        }
+
+        with profiler.stage("delta"):
+            build_delta = Delta(SKOLEM_PREFIX)
+            for filepath in DELTA_FILES:
+                build_delta.compare(
+                    filepath,
+                    previous_build[filepath],
+                    index_resources(read_resources(filepath)),
+                    graphs.get(filepath),
+                )
+
+            summary = build_delta.write(DELTA_FOLDER)
+        print(json.dumps(summary, indent=4))
 
-    with open("rdf/entity_annotations.jsonld", "w") as outfile:
-        json.dump(new_entity_annotations, outfile, indent=4)
+    if publish_output:
+        with profiler.stage("publish"):
+            publish_files = list(PUBLISH_FILES)
+            if nquads:
+                publish_files.append(NQUADS)
+            if shards:
+                publish_files += [SHARD_FOLDER + path for path in shard_writer.paths]
+                publish_files.append(SHARD_INDEX)
+
+            published, written = publish(
+                publish_files, PUBLISH_FOLDER, PUBLISH_MANIFEST, jobs=jobs
+            )
+        print(
+            f"Published {len(published)} files to {PUBLISH_FOLDER}, {written} changed"
+        )
 
-    external_resources = generate_external_data(df_annotation_identifiers)
+    if incremental:
+        # The linking table is written by this script as well
+        inputs.update({csv_file: file_hash(csv_file) for csv_file in CSV_FILES})
+        manifest["inputs"] = inputs
+        manifest["outputs"] = outputs
+        write_manifest(manifest, BUILD_MANIFEST)
 
-    with open("rdf/external_resources.jsonld", "w") as outfile:
-        json.dump(external_resources, outfile, indent=4)
+    if profiler.enabled:
+        profiler.write(profile or PROFILE_FILE)
+        print(f"Wrote the run report to {profile or PROFILE_FILE}")
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(
+        description="Generate the JSON-LD for the Amsterdam Diaries."
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=1,
+        help="Number of worker processes for parsing the PAGE XML and compressing the published files (default: 1)",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help=f"Only reparse the pages that changed since the last build (manifest in {BUILD_FOLDER})",
+    )
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="Write the JSON-LD without indentation",
+    )
+    parser.add_argument(
+        "--nquads",
+        action="store_true",
+        help=f"Also write all resources as N-Quads, with a named graph per diary ({NQUADS})",
+    )
+    parser.add_argument(
+        "--graph",
+        action="store_true",
+        help="Write each file whose resources share one @context as a JSON-LD document with that @context and a @graph, with every scan and tag described once, unless that makes it larger",
+    )
+    parser.add_argument(
+        "--delta",
+        action="store_true",
+        help=f"Compare with the previous build and write the changes as N-Quads and a SPARQL Update, with a named graph per diary ({DELTA_FOLDER})",
+    )
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const=PROFILE_FILE,
+        metavar="FILE",
+        help=f"Write the time, CPU time and peak memory per stage, and counts of pages, lines, tags, merges and links, to a JSON run report (default: {PROFILE_FILE})",
+    )
+    parser.add_argument(
+        "--cprofile",
+        nargs="?",
+        const=PROFILE_FOLDER,
+        metavar="FOLDER",
+        help=f"Also write a cProfile dump per stage (default: {PROFILE_FOLDER})",
+    )
+    parser.add_argument(
+        "--simplify",
+        type=float,
+        metavar="TOLERANCE",
+        help="Simplify the SVG polygons (Douglas-Peucker) with this tolerance in pixels, keeping them within their box",
+    )
+    parser.add_argument(
+        "--shards",
+        action="store_true",
+        help=f"Also write the annotations and metadata per diary and per scan, with an index ({SHARD_INDEX})",
+    )
+    parser.add_argument(
+        "--publish",
+        action="store_true",
+        help=f"Also write the output (and the shards) with its content hash in the name, precompressed with gzip and brotli (if installed), and a manifest ({PUBLISH_MANIFEST}). Files of the previous manifest are kept for {EXPIRE_DAYS} days",
+    )
+    parser.add_argument(
+        "--stages",
+        nargs="+",
+        choices=STAGES,
+        default=list(STAGES),
+        help="Only run these stages, the others are loaded from the last build (default: all)",
+    )
+    parser.add_argument(
+        "--diary",
+        metavar="FOLDER_NAME",
+        help="Only parse the pages of this diary (folder_name in metadata_diaries.csv), the other pages are taken from the last build unless they changed since",
+    )
+    parser.add_argument(
+        "--watch",
+        nargs="?",
+        type=float,
+        const=1.0,
+        metavar="SECONDS",
+        help="Keep running, and rebuild the output when a page or a CSV file changes, checking every SECONDS (default: 1)",
+    )
+    args = parser.parse_args()
+
+    if set(args.stages) != set(STAGES):
+        for flag in ("incremental", "nquads", "delta", "shards", "publish"):
+            if getattr(args, flag):
+                parser.error(f"--{flag} needs all stages")
+    if args.nquads or args.delta:
+        try:
+            check_contexts()
+        except (OSError, ValueError) as e:
+            parser.error(str(e))
+    if args.incremental and args.diary:
+        parser.error("--incremental cannot be combined with --diary")
+    if args.diary and args.diary not in get_folder_names(METADATA_DIARIES):
+        parser.error(
+            f"--diary: unknown diary {args.diary!r} (folder_name in {METADATA_DIARIES})"
+        )
+    if args.watch is not None:
+        for flag in ("incremental", "nquads", "graph", "delta", "shards", "diary"):
+            if getattr(args, flag):
+                parser.error(f"--{flag} cannot be combined with --watch")
+        if args.publish or set(args.stages) != set(STAGES):
+            parser.error("--watch always builds all stages, without --publish")
+
+        watcher = Watcher(compact=args.compact, simplify=args.simplify, jobs=args.jobs)
+        watcher.run(args.watch)
+    else:
+        main(
+            jobs=args.jobs,
+            incremental=args.incremental,
+            compact=args.compact,
+            nquads=args.nquads,
+            graph_document=args.graph,
+            delta=args.delta,
+            profile=args.profile,
+            cprofile=args.cprofile,
+            simplify=args.simplify,
+            shards=args.shards,
+            publish_output=args.publish,
+            stages=args.stages,
+            diary=args.diary,
+        )
@@ -0,0 +1,492 @@
+import os
+import re
+import json
+import math
+import hashlib
+import argparse
+from datetime import date
+from numbers import Integral
+from urllib.parse import urljoin
+from urllib.request import Request, urlopen
+
+# Local copies of the remote contexts used in the output, fetched with
+# `python nquads.py --fetch-contexts`
+CONTEXT_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "contexts")
+CONTEXT_SOURCES = "sources.json"
+
+CONTEXTS = {
+    "http://www.w3.org/ns/anno.jsonld": "anno.jsonld",
+    "http://iiif.io/api/extension/text-granularity/context.json": "text-granularity.json",
+}
+
+RDF = "http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+XSD = "http://www.w3.org/2001/XMLSchema#"
+
+RDF_TYPE = f"<{RDF}type>"
+RDF_FIRST = f"<{RDF}first>"
+RDF_REST = f"<{RDF}rest>"
+RDF_NIL = f"<{RDF}nil>"
+
+# Characters that are not allowed in an IRIREF in N-Quads
+IRI_ESCAPE = {c: f"%{c:02X}" for c in b' <>"{}|^`\\'} | {
+    c: f"%{c:02X}" for c in range(0x21)
+}
+
+LITERAL_ESCAPE = {
+    ord("\\"): "\\\\",
+    ord('"'): '\\"',
+    ord("\n"): "\\n",
+    ord("\r"): "\\r",
+}
+
+
+def read_sources(context_folder=CONTEXT_FOLDER):
+
+    filepath = os.path.join(context_folder, CONTEXT_SOURCES)
+    if not os.path.exists(filepath):
+        return dict()
+
+    with open(filepath) as infile:
+        return json.load(infile)
+
+
+def load_context(url, context_folder=CONTEXT_FOLDER):
+
+    if url not in CONTEXTS:
+        raise ValueError(f"No local copy of context: {url}")
+
+    filepath = os.path.join(context_folder, CONTEXTS[url])
+    if not os.path.exists(filepath):
+        raise FileNotFoundError(
+            f"{filepath} not found, run `python nquads.py --fetch-contexts` first"
+        )
+
+    with open(filepath, "rb") as infile:
+        data = infile.read()
+
+    # Only the copy as it was fetched
+    source = read_sources(context_folder).get(CONTEXTS[url], {})
+    if source.get("sha256") != hashlib.sha256(data).hexdigest():
+        raise ValueError(
+            f"{filepath} is not the copy fetched from {url}, "
+            "run `python nquads.py --fetch-contexts` again"
+        )
+
+    return json.loads(data)["@context"]
+
+
+def check_contexts(context_folder=CONTEXT_FOLDER):
+
+    for url in CONTEXTS:
+        load_context(url, context_folder)
+
+
+def fetch_contexts(context_folder=CONTEXT_FOLDER):
+    """
+    Download the contexts as they are published, and write their URL,
+    retrieval date and SHA-256 to `sources.json` next to them.
+    """
+
+    os.makedirs(context_folder, exist_ok=True)
+
+    sources = read_sources(context_folder)
+    for url, filename in CONTEXTS.items():
+        request = Request(url, headers={"Accept": "application/ld+json"})
+        with urlopen(request, timeout=60) as response:
+            data = response.read()
+
+        # Not an error page
+        json.loads(data)["@context"]
+
+        with open(os.path.join(context_folder, filename), "wb") as outfile:
+            outfile.write(data)
+
+        sources[filename] = {
+            "url": url,
+            "retrieved": date.today().isoformat(),
+            "sha256": hashlib.sha256(data).hexdigest(),
+        }
+        print(f"{url} -> {filename} ({len(data)} bytes)")
+
+    with open(os.path.join(context_folder, CONTEXT_SOURCES), "w") as outfile:
+        json.dump(sources, outfile, indent=4)
+
+
+def is_absolute(iri):
+    return iri is not None and ":" in iri and not iri.startswith("@")
+
+
+def canonical_double(value):
+    return re.sub(r"(\d)0*E\+?0*(\d)", r"\1E\2", "%1.15E" % value)
+
+
+class NQuadsWriter:
+    """
+    Write JSON-LD resources as N-Quads, one resource at a time.
+
+    This is not a full JSON-LD processor: it covers what main.py writes
+    (term definitions, prefixes, @vocab, type coercion, @list containers,
+    embedded contexts and value objects). Remote contexts are read from the
+    local copies in `contexts/`, and every context is processed only once.
+
+    Relative IRIs (e.g. terms that are not in the context) are resolved
+    against `base`, or dropped without one.
+
+    With `skolem`, blank nodes are replaced by IRIs that start with it and
+    are derived from the content of their resource, so that the same
+    resource always gives the same triples and a store can delete them.
+    """
+
+    def __init__(self, outfile, base=None, context_folder=CONTEXT_FOLDER, skolem=None):
+
+        self.outfile = outfile
+        self.base = base
+        self.context_folder = context_folder
+        self.skolem = skolem
+        self.count = 0
+
+        self.blank_nodes = 0
+        self.resource = None
+        self.resource_hash = None
+        self.resource_blank_nodes = 0
+        self.documents = dict()
+        self.contexts = dict()
+        self.root = {"key": "", "terms": dict(), "@vocab": None}
+
+    def write(self, resource, graph=None):
+
+        graph = f" <{self.escape_iri(graph)}>" if graph else ""
+
+        self.resource = resource
+        self.resource_hash = None
+        self.resource_blank_nodes = 0
+
+        self.node(resource, self.root, graph)
+
+    def close(self):
+        self.outfile.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # Contexts
+
+    def document(self, url):
+
+        if url not in self.documents:
+            self.documents[url] = load_context(url, self.context_folder)
+
+        return self.documents[url]
+
+    def process_context(self, active, local):
+
+        key = (active["key"], json.dumps(local, sort_keys=True))
+        if key not in self.contexts:
+            context = active
+            for c in local if isinstance(local, list) else [local]:
+                if c is None:
+                    context = self.root
+                elif isinstance(c, str):
+                    context = self.process_context(context, self.document(c))
+                else:
+                    context = self.process_local_context(context, c)
+
+            self.contexts[key] = dict(context, key=json.dumps(key))
+
+        return self.contexts[key]
+
+    def process_local_context(self, active, local):
+
+        context = {
+            "key": active["key"],
+            "terms": dict(active["terms"]),
+            "@vocab": active["@vocab"],
+        }
+
+        if "@vocab" in local:
+            vocab = local["@vocab"]
+            context["@vocab"] = (
+                self.expand_iri(context, vocab, vocab=True) if vocab else None
+            )
+
+        defined = dict()
+        for term in local:
+            if term in ("@vocab", "@version", "@base", "@language"):
+                continue
+            self.define_term(context, local, term, defined)
+
+        return context
+
+    def define_term(self, context, local, term, defined):
+
+        if defined.get(term) is not None:
+            return
+        defined[term] = False
+
+        value = local[term]
+        if value is None:
+            context["terms"][term] = None
+            defined[term] = True
+            return
+        elif isinstance(value, str):
+            value = {"@id": value}
+
+        definition = dict()
+
+        if "@id" in value:
+            iri = value["@id"]
+            if not iri.startswith("@"):
+                iri = self.expand_iri(context, iri, True, local, defined)
+            definition["@id"] = iri
+        elif ":" in term:
+            definition["@id"] = self.expand_iri(context, term, True, local, defined)
+        elif context["@vocab"]:
+            definition["@id"] = context["@vocab"] + term
+        else:
+            definition["@id"] = None
+
+        if "@type" in value:
+            datatype = value["@type"]
+            if datatype not in ("@id", "@vocab"):
+                datatype = self.expand_iri(context, datatype, True, local, defined)
+            definition["@type"] = datatype
+
+        if "@container" in value:
+            definition["@container"] = value["@container"]
+
+        context["terms"][term] = definition
+        defined[term] = True
+
+    def expand_iri(self, context, value, vocab=False, local=None, defined=None):
+
+        if value is None or value.startswith("@"):
+            return value
+
+        if local is not None and value in local:
+            self.define_term(context, local, value, defined)
+
+        if vocab and value in context["terms"]:
+            definition = context["terms"][value]
+            return definition["@id"] if definition else None
+
+        if ":" in value:
+            prefix, suffix = value.split(":", 1)
+            if prefix == "_" or suffix.startswith("//"):
+                return value
+
+            if local is not None and prefix in local:
+                self.define_term(context, local, prefix, defined)
+
+            definition = context["terms"].get(prefix)
+            if definition and definition["@id"]:
+                return definition["@id"] + suffix
+
+            return value
+
+        if vocab and context["@vocab"]:
+            return context["@vocab"] + value
+
+        # Relative IRI
+        if self.base:
+            return urljoin(self.base, value)
+
+        return value
+
+    # Terms
+
+    def escape_iri(self, iri):
+        return iri.translate(IRI_ESCAPE)
+
+    def iri(self, iri):
+
+        if not isinstance(iri, str):
+            return None
+        elif iri.startswith("_:"):
+            return iri
+        elif not is_absolute(iri):
+            return None
+
+        return f"<{self.escape_iri(iri)}>"
+
+    def blank_node(self):
+
+        if self.skolem:
+            # Only hashed for resources that have blank nodes
+            if self.resource_hash is None:
+                data = json.dumps(self.resource, sort_keys=True, ensure_ascii=False)
+                self.resource_hash = hashlib.sha256(data.encode()).hexdigest()[:32]
+
+            self.resource_blank_nodes += 1
+            return self.iri(
+                f"{self.skolem}{self.resource_hash}-{self.resource_blank_nodes}"
+            )
+
+        self.blank_nodes += 1
+        return f"_:b{self.blank_nodes}"
+
+    def literal(self, value, datatype=None, language=None):
+
+        value = value.translate(LITERAL_ESCAPE)
+
+        if language:
+            return f'"{value}"@{language}'
+        elif datatype and datatype != XSD + "string":
+            return f'"{value}"^^<{self.escape_iri(datatype)}>'
+
+        return f'"{value}"'
+
+    def quad(self, subject, predicate, obj, graph):
+
+        self.outfile.write(f"{subject} {predicate} {obj}{graph} .\n")
+        self.count += 1
+
+    # Nodes and values
+
+    def node(self, node, context, graph):
+
+        if "@context" in node:
+            context = self.process_context(context, node["@context"])
+
+        subject = None
+        for key, value in node.items():
+            if self.expand_iri(context, key, vocab=True) == "@id":
+                if isinstance(value, str):
+                    subject = self.iri(self.expand_iri(context, value))
+
+        if subject is None:
+            subject = self.blank_node()
+
+        for key, value in node.items():
+            if key == "@context":
+                continue
+
+            predicate = self.expand_iri(context, key, vocab=True)
+
+            if predicate == "@type":
+                for t in value if isinstance(value, list) else [value]:
+                    obj = self.iri(self.expand_iri(context, t, vocab=True))
+                    if obj:
+                        self.quad(subject, RDF_TYPE, obj, graph)
+                continue
+            elif not is_absolute(predicate):
+                continue
+
+            predicate = self.iri(predicate)
+            definition = context["terms"].get(key) or dict()
+
+            if definition.get("@container") == "@list" and not (
+                isinstance(value, dict) and "@list" in value
+            ):
+                items = value if isinstance(value, list) else [value]
+                objects = [self.list(items, definition, context, graph)]
+            else:
+                objects = [
+                    self.object(item, definition, context, graph)
+                    for item in (value if isinstance(value, list) else [value])
+                ]
+
+            for obj in objects:
+                if obj:
+                    self.quad(subject, predicate, obj, graph)
+
+        return subject
+
+    def list(self, items, definition, context, graph):
+
+        objects = [self.object(item, definition, context, graph) for item in items]
+        objects = [obj for obj in objects if obj]
+
+        head = RDF_NIL
+        for obj in reversed(objects):
+            node = self.blank_node()
+            self.quad(node, RDF_FIRST, obj, graph)
+            self.quad(node, RDF_REST, head, graph)
+            head = node
+
+        return head
+
+    def object(self, value, definition, context, graph):
+
+        coercion = definition.get("@type")
+
+        if value is None:
+            return None
+
+        elif isinstance(value, dict):
+            if "@list" in value:
+                return self.list(value["@list"], definition, context, graph)
+            elif "@value" in value:
+                datatype = value.get("@type")
+                if datatype:
+                    datatype = self.expand_iri(context, datatype, vocab=True)
+                return self.value(value["@value"], datatype, value.get("@language"))
+            else:
+                return self.node(value, context, graph)
+
+        elif isinstance(value, str):
+            if coercion == "@id":
+                return self.iri(self.expand_iri(context, value))
+            elif coercion == "@vocab":
+                return self.iri(self.expand_iri(context, value, vocab=True))
+
+            return self.value(value, coercion)
+
+        return self.value(
+            value, coercion if coercion not in ("@id", "@vocab") else None
+        )
+
+    def value(self, value, datatype=None, language=None):
+
+        if value is None:
+            return None
+        elif isinstance(value, bool):
+            return self.literal(str(value).lower(), datatype or XSD + "boolean")
+        elif isinstance(value, Integral):
+            return self.literal(str(int(value)), datatype or XSD + "integer")
+        elif isinstance(value, float):
+            # pandas' missing values end up as NaN
+            if math.isnan(value):
+                return None
+            elif (
+                value.is_integer() and datatype != XSD + "double" and abs(value) < 1e21
+            ):
+                return self.literal(f"{value:.0f}", datatype or XSD + "integer")
+            return self.literal(canonical_double(value), datatype or XSD + "double")
+
+        return self.literal(str(value), datatype, language)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="The contexts that the N-Quads export expands the output with."
+    )
+    parser.add_argument(
+        "--fetch-contexts",
+        action="store_true",
+        help=f"Download the contexts to {CONTEXT_FOLDER}, with their source in {CONTEXT_SOURCES}",
+    )
+    args = parser.parse_args()
+
+    if args.fetch_contexts:
+        fetch_contexts()
+    else:
+        try:
+            check_contexts()
+        except (OSError, ValueError) as e:
+            parser.error(str(e))
+
+        transcribed = [
+            filename
+            for filename, source in read_sources().items()
+            if "retrieved" not in source
+        ]
+        if transcribed:
+            print(
+                f"Not fetched, transcribed by hand: {', '.join(transcribed)}. "
+                "Run `python nquads.py --fetch-contexts` to replace them"
+            )
+        else:
+            print("The contexts are the copies that were fetched")
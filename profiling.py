@@ -0,0 +1,192 @@
+import os
+import sys
+import json
+import time
+import cProfile
+import platform
+import tracemalloc
+from contextlib import contextmanager
+from collections import defaultdict
+
+
+class Profiler:
+    """
+    Wall time, CPU time and peak memory per stage of the build, and counts.
+
+    Stages can be nested, and generators can be timed per item with
+    `iterate()`. The times of a stage exclude the stages that run inside it,
+    so the times of all stages add up to the time of the build. The peak
+    memory of a stage is the most memory traced while it (or a stage inside
+    it) was running.
+
+    A disabled profiler measures nothing, so the build is not slowed down.
+    """
+
+    def __init__(self, enabled=True, cprofile_folder=None):
+
+        self.enabled = enabled
+        self.cprofile_folder = cprofile_folder
+
+        self.stages = dict()
+        self.counts = defaultdict(int)
+        self.stack = []
+        self.profiles = dict()
+
+        self.start = time.perf_counter()
+        self.start_cpu = time.process_time()
+
+        if enabled and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def get_stage(self, name):
+
+        if name not in self.stages:
+            self.stages[name] = {
+                "wall_seconds": 0.0,
+                "cpu_seconds": 0.0,
+                "peak_memory_bytes": 0,
+                "calls": 0,
+                "items": 0,
+            }
+
+        return self.stages[name]
+
+    def get_profile(self, name):
+
+        if self.cprofile_folder is None:
+            return None
+
+        if name not in self.profiles:
+            self.profiles[name] = cProfile.Profile()
+
+        return self.profiles[name]
+
+    @contextmanager
+    def stage(self, name):
+
+        if not self.enabled:
+            yield
+            return
+
+        if self.stack:
+            parent = self.stack[-1]
+            parent["peak"] = max(parent["peak"], tracemalloc.get_traced_memory()[1])
+            if parent["profile"]:
+                parent["profile"].disable()
+        tracemalloc.reset_peak()
+
+        frame = {
+            "name": name,
+            "peak": 0,
+            "children_wall": 0.0,
+            "children_cpu": 0.0,
+            "profile": self.get_profile(name),
+        }
+        self.stack.append(frame)
+
+        if frame["profile"]:
+            frame["profile"].enable()
+        start, start_cpu = time.perf_counter(), time.process_time()
+
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start
+            cpu = time.process_time() - start_cpu
+
+            if frame["profile"]:
+                frame["profile"].disable()
+            self.stack.pop()
+
+            frame["peak"] = max(frame["peak"], tracemalloc.get_traced_memory()[1])
+
+            stage = self.get_stage(name)
+            stage["wall_seconds"] += wall - frame["children_wall"]
+            stage["cpu_seconds"] += cpu - frame["children_cpu"]
+            stage["peak_memory_bytes"] = max(stage["peak_memory_bytes"], frame["peak"])
+            stage["calls"] += 1
+
+            if self.stack:
+                parent = self.stack[-1]
+                parent["children_wall"] += wall
+                parent["children_cpu"] += cpu
+                parent["peak"] = max(parent["peak"], frame["peak"])
+                if parent["profile"]:
+                    parent["profile"].enable()
+
+    def iterate(self, name, iterable):
+        """
+        The items of `iterable`, with the time to produce each of them
+        counted in stage `name`.
+        """
+
+        if not self.enabled:
+            yield from iterable
+            return
+
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                self.get_stage(name)["items"] += 1
+
+            yield item
+
+    def count(self, name, n=1):
+
+        if self.enabled:
+            self.counts[name] += n
+
+    def items(self, name):
+        return self.stages.get(name, {}).get("items", 0)
+
+    def report(self):
+
+        return {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "argv": sys.argv,
+            "wall_seconds": round(time.perf_counter() - self.start, 4),
+            "cpu_seconds": round(time.process_time() - self.start_cpu, 4),
+            # The peak is reset for every stage
+            "peak_memory_bytes": max(
+                [tracemalloc.get_traced_memory()[1]]
+                + [stage["peak_memory_bytes"] for stage in self.stages.values()]
+            ),
+            "stages": {
+                name: {
+                    key: round(value, 4) if isinstance(value, float) else value
+                    for key, value in stage.items()
+                }
+                for name, stage in self.stages.items()
+            },
+            "counts": dict(self.counts),
+        }
+
+    def write(self, filepath):
+        """
+        Write the JSON report to `filepath`, and a cProfile dump per stage
+        (`<stage>.prof`) to the cProfile folder.
+        """
+
+        if not self.enabled:
+            return None
+
+        report = self.report()
+
+        folder = os.path.dirname(filepath)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+        with open(filepath, "w") as outfile:
+            json.dump(report, outfile, indent=4)
+
+        if self.cprofile_folder is not None:
+            os.makedirs(self.cprofile_folder, exist_ok=True)
+            for name, profile in self.profiles.items():
+                profile.dump_stats(os.path.join(self.cprofile_folder, f"{name}.prof"))
+
+        return report
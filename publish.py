@@ -0,0 +1,217 @@
+import os
+import json
+import time
+import gzip
+import hashlib
+import importlib.util
+from concurrent.futures import ProcessPoolExecutor
+
+# Characters of the SHA-256 in the file names
+HASH_LENGTH = 16
+
+# Files that are no longer in the manifest are kept for the previous
+# manifest, and for at least this many days, for caches that still have it
+EXPIRE_DAYS = 7
+
+# When every file that left the manifest was last in it
+RETIRED_FILE = "retired.json"
+
+# Brotli at its best quality takes minutes for the largest files, which
+# compress almost as well with a lower one
+BROTLI_QUALITY = 11
+BROTLI_LARGE_QUALITY = 9
+BROTLI_LARGE_BYTES = 1 << 20
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def get_hashed_name(filepath, digest, root="rdf/"):
+
+    # rdf/metadata.jsonld -> metadata.<hash>.jsonld
+    # rdf/shards/persons.jsonld -> shards/persons.<hash>.jsonld
+    stem, extension = os.path.splitext(os.path.relpath(filepath, root))
+    return f"{stem}.{digest[:HASH_LENGTH]}{extension}"
+
+
+def compress_gzip(data):
+
+    # Without a timestamp, the same file always gives the same bytes
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def compress_brotli(data):
+
+    import brotli
+
+    if len(data) < BROTLI_LARGE_BYTES:
+        quality = BROTLI_QUALITY
+    else:
+        quality = BROTLI_LARGE_QUALITY
+
+    return brotli.compress(data, mode=brotli.MODE_TEXT, quality=quality)
+
+
+def get_compressors():
+
+    compressors = {"gzip": (".gz", compress_gzip)}
+
+    if importlib.util.find_spec("brotli") is None:
+        print("brotli is not installed, only writing gzip")
+    else:
+        compressors["br"] = (".br", compress_brotli)
+
+    return compressors
+
+
+def compress_file(filepath, compressed_file, compress):
+
+    with open(filepath, "rb") as infile:
+        write_file(compressed_file, compress(infile.read()))
+
+
+def write_file(filepath, data):
+
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+
+    # Write next to it first, so a file is never served half written
+    with open(filepath + ".tmp", "wb") as outfile:
+        outfile.write(data)
+    os.replace(filepath + ".tmp", filepath)
+
+
+def read_json(filepath, default):
+
+    if not os.path.exists(filepath):
+        return default
+
+    with open(filepath) as infile:
+        return json.load(infile)
+
+
+def get_manifest_files(manifest):
+
+    files = set()
+    for entry in manifest.values():
+        files.add(entry["file"])
+        files.update(e["file"] for e in entry["encodings"].values())
+
+    return files
+
+
+def list_files(folder):
+
+    for dirpath, _, filenames in os.walk(folder):
+        for filename in filenames:
+            yield os.path.relpath(os.path.join(dirpath, filename), folder)
+
+
+def publish(filepaths, folder, manifest_file, root="rdf/", expire=EXPIRE_DAYS, jobs=1):
+    """
+    Copy files to `folder` with their content hash in the name, next to
+    precompressed variants, and write a manifest of their logical name to
+    the files. A file that did not change keeps its name and is not
+    compressed again. The path of a file under `root` is kept. The files
+    are compressed in `jobs` processes.
+
+    Files that are no longer in the manifest are removed when they are not
+    in the previous manifest either, and left it more than `expire` days
+    ago.
+    """
+
+    os.makedirs(folder, exist_ok=True)
+    compressors = get_compressors()
+
+    previous_manifest = read_json(manifest_file, dict())
+    previous = get_manifest_files(previous_manifest)
+    retired_file = os.path.join(folder, RETIRED_FILE)
+    retired = read_json(retired_file, dict())
+
+    # Published before, by content hash
+    published = {
+        (entry["file"], entry["sha256"]): entry for entry in previous_manifest.values()
+    }
+
+    manifest = dict()
+    written = 0
+    tasks = []
+
+    for filepath in filepaths:
+        with open(filepath, "rb") as infile:
+            data = infile.read()
+
+        digest = content_hash(data)
+        hashed_name = get_hashed_name(filepath, digest, root)
+
+        entry = published.get((hashed_name, digest))
+        if (
+            entry is not None
+            and set(entry["encodings"]) == set(compressors)
+            and all(
+                os.path.exists(os.path.join(folder, f))
+                for f in get_manifest_files({filepath: entry})
+            )
+        ):
+            manifest[filepath] = entry
+            continue
+
+        entry = {
+            "file": hashed_name,
+            "sha256": digest,
+            "bytes": len(data),
+            "encodings": dict(),
+        }
+
+        if not os.path.exists(os.path.join(folder, hashed_name)):
+            write_file(os.path.join(folder, hashed_name), data)
+            written += 1
+
+        for encoding, (suffix, compress) in compressors.items():
+            compressed_file = os.path.join(folder, hashed_name + suffix)
+
+            if not os.path.exists(compressed_file):
+                tasks.append((filepath, compressed_file, compress))
+
+            entry["encodings"][encoding] = {"file": hashed_name + suffix}
+
+        manifest[filepath] = entry
+
+    if jobs > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            list(executor.map(compress_file, *zip(*tasks)))
+    else:
+        for task in tasks:
+            compress_file(*task)
+
+    for entry in manifest.values():
+        for encoding in entry["encodings"].values():
+            encoding["bytes"] = os.path.getsize(os.path.join(folder, encoding["file"]))
+
+    current = get_manifest_files(manifest)
+    current.update({os.path.relpath(manifest_file, folder), RETIRED_FILE})
+
+    now = time.time()
+    for filename in list_files(folder):
+        if filename in current:
+            continue
+
+        retired.setdefault(filename, now)
+        if filename not in previous and now - retired[filename] > expire * 86400:
+            os.remove(os.path.join(folder, filename))
+            del retired[filename]
+
+    for dirpath, _, _ in list(os.walk(folder))[::-1]:
+        if dirpath != folder and not os.listdir(dirpath):
+            os.rmdir(dirpath)
+
+    # Files can come back when the output changes back
+    retired = {f: t for f, t in retired.items() if f not in current}
+
+    with open(retired_file, "w") as outfile:
+        json.dump(retired, outfile, indent=4)
+
+    with open(manifest_file, "w") as outfile:
+        json.dump(manifest, outfile, indent=4)
+
+    return manifest, written
@@ -0,0 +1,202 @@
+import io
+
+import pytest
+
+from delta import Delta, index_resources
+from nquads import NQuadsWriter
+
+rdflib = pytest.importorskip("rdflib")
+from rdflib.compare import isomorphic
+
+PREFIX = "https://id.amsterdamtimemachine.nl/ark:/81741/amsterdam-diaries/"
+IIIF_PREFIX = "https://images.diaries.amsterdamtimemachine.nl/iiif/"
+GRAPH = PREFIX + "diaries/1"
+SKOLEM = "https://id.amsterdamtimemachine.nl/.well-known/genid/amsterdam-diaries/"
+
+# The terms of the remote contexts that the annotations use, inline so that
+# the tests do not need the fetched copies
+CONTEXT = {
+    "oa": "http://www.w3.org/ns/oa#",
+    "rdf": "http://www.w3.org/1999/02/22-rdf-syntax-ns#",
+    "rdfs": "http://www.w3.org/2000/01/rdf-schema#",
+    "iiif_tg": "http://iiif.io/api/extension/text-granularity#",
+    "dcterms": "http://purl.org/dc/terms/",
+    "schema": "http://schema.org/",
+    "skos": "http://www.w3.org/2004/02/skos/core#",
+    "id": "@id",
+    "type": "@type",
+    "Annotation": "oa:Annotation",
+    "SpecificResource": "oa:SpecificResource",
+    "FragmentSelector": "oa:FragmentSelector",
+    "ImageObject": "schema:ImageObject",
+    "body": {"@id": "oa:hasBody", "@type": "@id", "@container": "@set"},
+    "target": {"@id": "oa:hasTarget", "@type": "@id", "@container": "@set"},
+    "source": {"@id": "oa:hasSource", "@type": "@id"},
+    "selector": {"@id": "oa:hasSelector", "@type": "@id"},
+    "purpose": {"@id": "oa:hasPurpose", "@type": "@vocab"},
+    "tagging": "oa:tagging",
+    "value": "rdf:value",
+    "conformsTo": {"@id": "dcterms:conformsTo", "@type": "@id"},
+    "label": "rdfs:label",
+    "name": "schema:name",
+    "textGranularity": {"@id": "iiif_tg:textGranularity", "@type": "@vocab"},
+    "block": "iiif_tg:block",
+}
+
+
+def region_annotation(scan, region, xywh="0,0,10,10"):
+
+    # The shape of a region in textual_annotations.jsonld
+    return {
+        "@context": CONTEXT,
+        "id": f"{PREFIX}annotations/regions/{scan}/{region}",
+        "type": "Annotation",
+        "textGranularity": "block",
+        "body": [
+            {
+                "type": "SpecificResource",
+                "source": {
+                    "id": f"{PREFIX}tags/regions/paragraph",
+                    "type": "skos:Concept",
+                    "label": "Paragraph",
+                },
+                "purpose": "tagging",
+            }
+        ],
+        "target": {
+            "id": f"{PREFIX}annotations/regions/{scan}/{region}-target",
+            "type": "SpecificResource",
+            "source": {
+                "@id": f"{IIIF_PREFIX}{scan}.jpg",
+                "type": "ImageObject",
+                "name": f"{scan}.jpg",
+            },
+            "selector": [
+                {
+                    "type": "FragmentSelector",
+                    "value": f"xywh={xywh}",
+                    "conformsTo": "http://www.w3.org/TR/media-frags/",
+                }
+            ],
+        },
+    }
+
+
+def to_nquads(resources, graph, skolem=SKOLEM):
+
+    outfile = io.StringIO()
+    writer = NQuadsWriter(outfile, skolem=skolem)
+    for resource in resources:
+        writer.write(resource, graph)
+
+    return outfile.getvalue()
+
+
+def to_quads(nquads):
+
+    dataset = rdflib.Dataset()
+    dataset.parse(data=nquads, format="nquads")
+
+    return set(dataset.quads())
+
+
+def to_dataset(resources, graph):
+
+    outfile = io.StringIO()
+    writer = NQuadsWriter(outfile)
+    for resource in resources:
+        writer.write(resource, graph)
+
+    if graph is None:
+        dataset = rdflib.Graph()
+        dataset.parse(data=outfile.getvalue(), format="nt")
+    else:
+        dataset = rdflib.Dataset()
+        dataset.parse(data=outfile.getvalue(), format="nquads")
+
+    return dataset
+
+
+def builds():
+
+    previous = [
+        # A scan that is removed, with regions that share its description
+        region_annotation("p009", "r_1"),
+        region_annotation("p009", "r_2"),
+        region_annotation("p009", "r_3"),
+        region_annotation("p010", "r_4"),
+        region_annotation("p010", "r_5"),
+    ]
+    current = [
+        region_annotation("p010", "r_4"),
+        region_annotation("p010", "r_5", xywh="5,5,10,10"),
+        region_annotation("p011", "r_6"),
+    ]
+
+    return previous, current
+
+
+@pytest.mark.parametrize("graph", [None, GRAPH])
+def test_update_gives_new_build(tmp_path, graph):
+
+    previous, current = builds()
+
+    delta = Delta()
+    delta.compare(
+        "regions",
+        index_resources(previous),
+        index_resources(current),
+        lambda resource: graph,
+    )
+    summary = delta.write(tmp_path)
+
+    assert summary["resources"]["regions"] == {
+        "added": 1,
+        "removed": 3,
+        "changed": 1,
+    }
+
+    # Every shared triple is deleted once
+    update = (tmp_path / "update.rq").read_text()
+    assert update.count('"p009.jpg"') == 1
+
+    dataset = to_dataset(previous, graph)
+    dataset.update(update)
+    expected = to_dataset(current, graph)
+
+    if graph is not None:
+        dataset, expected = dataset.graph(graph), expected.graph(graph)
+
+    assert len(dataset) == len(expected)
+    assert isomorphic(dataset, expected)
+
+
+@pytest.mark.parametrize("graph", [None, GRAPH])
+def test_nquads_give_new_build(tmp_path, graph):
+
+    previous, current = builds()
+
+    delta = Delta(SKOLEM)
+    delta.compare(
+        "regions",
+        index_resources(previous),
+        index_resources(current),
+        lambda resource: graph,
+    )
+    delta.write(tmp_path)
+
+    deleted = (tmp_path / "deleted.nq").read_text()
+    inserted = (tmp_path / "inserted.nq").read_text()
+
+    # As a store would load the patch
+    dataset = rdflib.Dataset()
+    for quad in to_quads(to_nquads(previous, graph)):
+        dataset.add(quad)
+    for quad in to_quads(deleted):
+        dataset.remove(quad)
+    for quad in to_quads(inserted):
+        dataset.add(quad)
+
+    # The selectors of the removed and changed regions are gone as well
+    assert "_:" not in deleted
+    assert set(dataset.quads()) == to_quads(to_nquads(current, graph))
@@ -0,0 +1,450 @@
+import io
+import os
+import json
+import uuid
+import shutil
+
+import pandas as pd
+import pytest
+
+pytest.importorskip("pagexml")
+
+import main
+
+DATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+
+# Two of the smaller diaries
+DIARY = "Dagboek_Celina_Veffer,_1944-1946"
+OTHER_DIARY = "Dagboek_Els_Polak,_deel_2"
+
+
+@pytest.fixture
+def build(tmp_path, monkeypatch):
+
+    os.makedirs(tmp_path / "data" / "diaries")
+    for filename in os.listdir(DATA):
+        if filename.endswith(".csv"):
+            shutil.copy(os.path.join(DATA, filename), tmp_path / "data")
+    for diary in (DIARY, OTHER_DIARY):
+        shutil.copytree(
+            os.path.join(DATA, "diaries", diary), tmp_path / "data" / "diaries" / diary
+        )
+    os.makedirs(tmp_path / "rdf")
+
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def two_pages(tmp_path, monkeypatch):
+
+    os.makedirs(tmp_path / "data" / "diaries")
+    for filename in os.listdir(DATA):
+        if filename.endswith(".csv"):
+            shutil.copy(os.path.join(DATA, filename), tmp_path / "data")
+
+    # Page 3 continues an entity of its line 5 on line 6
+    pages = (
+        "0002_EVDO01_VMA01_KBN007000014_2.xml",
+        "0003_EVDO01_VMA01_KBN007000014_3.xml",
+    )
+    shutil.copytree(
+        os.path.join(DATA, "diaries", DIARY),
+        tmp_path / "data" / "diaries" / DIARY,
+        ignore=lambda folder, names: [
+            name for name in names if name.startswith("00") and name not in pages
+        ],
+    )
+    os.makedirs(tmp_path / "rdf")
+
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def read_outputs():
+
+    outputs = dict()
+    for filename in sorted(os.listdir("rdf")):
+        with open(os.path.join("rdf", filename), "rb") as infile:
+            outputs[filename] = infile.read()
+
+    return outputs
+
+
+def test_jobs_give_the_same_output(two_pages):
+
+    main.main()
+    serial = read_outputs()
+
+    shutil.rmtree("rdf")
+    shutil.rmtree("build")
+    os.makedirs("rdf")
+    main.main(jobs=2)
+
+    assert read_outputs() == serial
+
+
+def test_incremental_build_is_a_full_rebuild(two_pages):
+
+    main.main(incremental=True)
+    before = read_outputs()
+
+    page = (
+        two_pages
+        / "data"
+        / "diaries"
+        / DIARY
+        / "page"
+        / "0003_EVDO01_VMA01_KBN007000014_3.xml"
+    )
+    page.write_text(
+        page.read_text().replace(
+            "readingOrder {index:6;} person {offset:0; length:14; continued:true;}",
+            "readingOrder {index:6;}",
+        )
+    )
+
+    main.main(incremental=True)
+    incremental = read_outputs()
+    assert (
+        incremental["entity_annotations.jsonld"] != before["entity_annotations.jsonld"]
+    )
+
+    main.main()
+    assert read_outputs() == incremental
+
+
+def merge_by_removal(annotations, body2length, region2textualbody):
+    """
+    merge_annotations before the forward pass, on JSON-LD annotations.
+    """
+
+    for a2, a1 in zip(reversed(annotations[1:]), reversed(annotations[:-1])):
+        if not a1["body"][0]["source"] == a2["body"][0]["source"]:
+            continue
+
+        if (
+            not a1["target"][0]["selector"][1]["end"]
+            == body2length[a1["target"][0]["source"]]
+        ):
+            continue
+
+        body_id_a1 = a1["target"][0]["source"]
+        body_id_a2 = a2["target"][0]["source"]
+        index_a1 = region2textualbody[body_id_a1.rsplit("-", 2)[0]].index(body_id_a1)
+        index_a2 = region2textualbody[body_id_a2.rsplit("-", 2)[0]].index(body_id_a2)
+        if not index_a2 - index_a1 == 1:
+            continue
+
+        if not a2["target"][0]["selector"][1]["start"] == 0:
+            continue
+
+        annotations.remove(a2)
+        a1["target"] += a2["target"]
+
+    return annotations
+
+
+def test_merge_annotations_as_before(two_pages):
+
+    tagtype2resource = dict(main.tagtype2resource)
+    for concept in main.generate_concept_metadata(main.METADATA_CONCEPTS):
+        tagtype2resource[concept["notation"]] = concept
+
+    annotations = []
+    region2textualbody = dict()
+    body2length = dict()
+    for diary, filepath in main.list_pages():
+        _, tags, page_region2textualbody, _, _, page_body2length, _ = main.parse_page(
+            diary, filepath
+        )
+        annotations += [
+            main.make_entity_annotation(
+                tag, filename=filepath, tagtype2resource=tagtype2resource
+            )
+            for tag in tags
+        ]
+        region2textualbody.update(page_region2textualbody)
+        body2length.update(page_body2length)
+
+    expected = merge_by_removal(
+        [a.to_jsonld() for a in annotations], body2length, region2textualbody
+    )
+    merged = [
+        a.to_jsonld()
+        for a in main.merge_annotations(annotations, body2length, region2textualbody)
+    ]
+
+    assert merged == expected
+    assert len(merged) < len(annotations)
+
+
+def test_new_identifiers_are_the_same_in_every_build(two_pages):
+
+    # Not in the table yet, so every annotation gets a new identifier
+    linking = pd.read_csv(main.ANNOTATION_IDENTIFIERS)
+    linking = linking[~linking["source"].str.contains("KBN007000014", na=False)]
+    linking.to_csv(main.ANNOTATION_IDENTIFIERS, index=False)
+    shutil.copy(main.ANNOTATION_IDENTIFIERS, "linking.csv")
+
+    main.main()
+    with open("rdf/entity_annotations.jsonld") as infile:
+        first = json.load(infile)
+
+    shutil.copy("linking.csv", main.ANNOTATION_IDENTIFIERS)
+    main.main()
+    with open("rdf/entity_annotations.jsonld") as infile:
+        second = json.load(infile)
+
+    assert first
+    assert [a["id"] for a in first] == [a["id"] for a in second]
+    assert all(uuid.UUID(a["id"].rsplit("/", 1)[1]).version == 5 for a in first)
+
+
+def test_diary_reparses_changed_pages_of_other_diaries(build):
+
+    main.main(stages=["text"], diary=DIARY)
+
+    # Edited after the last build
+    page = sorted((build / "data" / "diaries" / OTHER_DIARY / "page").glob("0001_*"))[0]
+    page.write_text(page.read_text().replace("Els Polak. ", "Els Polak, bewerkt. "))
+
+    main.main(stages=["text"], diary=DIARY)
+
+    with open("rdf/textual_annotations.jsonld") as infile:
+        assert "Els Polak, bewerkt." in infile.read()
+
+    with open(main.BUILD_MANIFEST) as infile:
+        manifest = json.load(infile)
+    filepath = os.path.join("data/diaries/", OTHER_DIARY, "page", page.name)
+    assert manifest["inputs"][filepath] == main.file_hash(filepath)
+
+
+def write_graph(resources):
+
+    outfile = io.StringIO()
+    with main.JSONLDGraphWriter(outfile) as writer:
+        for resource in resources:
+            writer.write(resource)
+
+    return json.loads(outfile.getvalue())
+
+
+def test_graph_writer_falls_back_to_the_array():
+
+    source = {"id": "https://example.org/scan.jpg", "type": "Image"}
+    annotations = [
+        {
+            "@context": "http://www.w3.org/ns/anno.jsonld",
+            "id": f"a{i}",
+            "target": [{"source": source}],
+        }
+        for i in range(3)
+    ]
+    book = {"@context": {"@vocab": "https://schema.org/"}, "@id": "b", "@type": "Book"}
+
+    document = write_graph(annotations)
+    assert document["@context"] == "http://www.w3.org/ns/anno.jsonld"
+    assert document["@graph"][0] == source
+
+    # Not smaller, or more than one context
+    assert write_graph(annotations[:1]) == annotations[:1]
+    assert write_graph(annotations + [book]) == annotations + [book]
+
+
+def test_read_resources_of_a_graph(tmp_path):
+
+    source = {"id": "https://example.org/scan.jpg", "type": "Image"}
+    annotations = [
+        {
+            "@context": "http://www.w3.org/ns/anno.jsonld",
+            "id": f"a{i}",
+            "target": [{"source": source}],
+        }
+        for i in range(3)
+    ]
+
+    filepath = str(tmp_path / "annotations.jsonld")
+    with open(filepath, "w") as outfile:
+        json.dump(write_graph(annotations), outfile)
+
+    assert list(main.read_resources(filepath)) == annotations
+
+
+def test_watcher_relinks_only_the_changed_segments(build, monkeypatch):
+
+    watcher = main.Watcher()
+    watcher.build(*watcher.scan())
+
+    # Breaks a multi-line entity in two
+    page = (
+        build
+        / "data"
+        / "diaries"
+        / DIARY
+        / "page"
+        / "0003_EVDO01_VMA01_KBN007000014_3.xml"
+    )
+    page.write_text(
+        page.read_text().replace(
+            "readingOrder {index:6;} person {offset:0; length:14; continued:true;}",
+            "readingOrder {index:6;}",
+        )
+    )
+
+    linked = []
+    link = watcher.link
+
+    def record_link(filepaths, *args):
+        linked.extend(filepaths)
+        return link(filepaths, *args)
+
+    monkeypatch.setattr(watcher, "link", record_link)
+    watcher.build(*watcher.scan())
+
+    with open("rdf/entity_annotations.jsonld") as infile:
+        entities = json.load(infile)
+
+    # The same as when everything is linked again
+    rebuilt = main.Watcher()
+    rebuilt.build(*rebuilt.scan())
+
+    with open("rdf/entity_annotations.jsonld") as infile:
+        assert entities == json.load(infile)
+    assert 0 < len(linked) < len(main.list_pages())
+
+
+def parse_points(point_string):
+    return [tuple(map(int, p.split(","))) for p in point_string.split(" ")]
+
+
+def test_simplified_polygons_stay_in_their_box():
+
+    from pagexml.model.physical_document_model import Coords
+
+    # A rectangle with points on its edges, partly left of the page
+    points = [(-20, 0), (30, 1), (80, 0), (120, 2), (120, 60), (60, 61), (-20, 60)]
+    selectors = main.get_selectors(
+        [Coords(points)], page_width=100, page_height=100, tolerance=5
+    )
+
+    xywh, svg = selectors[0]
+    assert xywh == "xywh=0,0,100,61"
+
+    polygon = parse_points(svg.split('points="')[1].split('"')[0])[:-1]
+    assert len(polygon) == 4
+    assert all(0 <= x <= 100 and 0 <= y <= 61 for x, y in polygon)
+
+
+def test_collapsed_polygons_keep_their_points():
+
+    from pagexml.model.physical_document_model import Coords
+
+    # A sliver that simplifies to a line
+    points = [(0, 0), (50, 2), (100, 0), (50, 1)]
+    coords = Coords(points)
+
+    (point_string,) = main.simplify_polygons(
+        [coords], 10, [(coords.x, coords.y, coords.w, coords.h)]
+    )
+    assert parse_points(point_string) == points
+
+
+def test_linking_index_first_match_and_misses():
+
+    source = "https://example.org/regions/0001_page/tr_1_tl_1"
+    row = {"diary": "D", "tag": "place", "source": source, "text": "Ommen"}
+    df = pd.DataFrame(
+        [
+            {"index": 1, "annotation": "a1", **row, "uri": "https://example.org/Q1"},
+            {"index": 2, "annotation": "a2", **row, "uri": "https://example.org/Q2"},
+        ],
+        columns=["index", "annotation", "diary", "tag", "source", "text", "uri"]
+        + ["date", "label"],
+    )
+    df["label"] = ["Ommen", "Ommen (2)"]
+    linking_index = main.LinkingIndex(df)
+
+    # The line of the region, without the -body
+    body = "https://example.org/regions/0001_page/tr_1-tr_1_tl_1-body"
+
+    # The first row wins
+    assert main.get_annotation_identifier(
+        "D", body, "place", "Ommen", "new", linking_index
+    ) == ("https://example.org/Q1", "https://schema.org/Place", "Ommen", "a1")
+
+    # A miss is added once, and found the next time as a row without
+    # identifier
+    assert main.get_annotation_identifier(
+        "D", body, "person", "Celina", "a3", linking_index
+    ) == (None, None, None, None)
+    assert main.get_annotation_identifier(
+        "D", body, "person", "Celina", "a4", linking_index
+    ) == (None, "https://schema.org/Person", None, "a3")
+
+    df = linking_index.to_frame()
+    assert len(linking_index) == len(df) == 3
+    row = df.iloc[2]
+    assert row[["index", "annotation", "tag", "source", "text"]].tolist() == [
+        3,
+        "a3",
+        "person",
+        source,
+        "Celina",
+    ]
+    assert pd.isna(row["uri"]) and pd.isna(row["label"])
+
+
+def read_shard(path):
+    return list(main.read_resources(os.path.join(main.SHARD_FOLDER, path)))
+
+
+def test_shard_index_points_to_the_shards(two_pages):
+
+    main.main(shards=True)
+
+    with open(main.SHARD_INDEX) as infile:
+        index = json.load(infile)
+
+    for diary, diary_index in index["diaries"].items():
+        assert diary in [r.get("@id") for r in read_shard(diary_index["metadata"])]
+        for scan in diary_index["scans"]:
+            assert index["scans"][scan]["diary"] == diary
+
+    assert len(index["scans"]) == 2
+    for scan, scan_index in index["scans"].items():
+        textual = read_shard(scan_index["textual_annotations"])
+        assert {a["target"]["source"]["@id"] for a in textual} == {scan}
+
+        # .../regions/<page>/<region>-<line>-body
+        pages = {
+            a["target"][0]["source"].rsplit("/", 2)[1]
+            for a in read_shard(scan_index["entity_annotations"])
+        }
+        assert [f"{main.IIIF_PREFIX}{main.get_scan_name(p)}.jpg" for p in pages] == [
+            scan
+        ]
+
+    for entry, entry_index in index["entries"].items():
+        metadata = read_shard(entry_index["metadata"])
+        assert entry in [
+            r["body"][0]["@id"] for r in metadata if r.get("type") == "Annotation"
+        ]
+        assert entry_index["metadata"] == (
+            index["diaries"][entry_index["diary"]]["metadata"]
+        )
+
+    # The entries list all their scans, also those without shards
+    assert any(set(e["scans"]) & set(index["scans"]) for e in index["entries"].values())
+
+
+def test_shard_resources_have_to_be_together(tmp_path):
+
+    with main.ShardWriter(str(tmp_path)) as shard_writer:
+        shard_writer.write({"id": "a1"}, "a.jsonld")
+        shard_writer.write({"id": "b1"}, "b.jsonld")
+
+        with pytest.raises(ValueError):
+            shard_writer.write({"id": "a2"}, "a.jsonld")
+
+    assert json.loads((tmp_path / "a.jsonld").read_text()) == [{"id": "a1"}]
@@ -0,0 +1,63 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+import nquads
+from nquads import check_contexts, fetch_contexts, load_context
+
+# Not the compact JSON that json.dumps would give, to check the copy is exact
+DOCUMENT = b'{\n  "@context": {\n    "oa": "http://www.w3.org/ns/oa#"\n  }\n}\n'
+
+
+class ContextHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/ld+json")
+        self.end_headers()
+        self.wfile.write(DOCUMENT)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def context_url(monkeypatch):
+
+    server = HTTPServer(("127.0.0.1", 0), ContextHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    url = f"http://127.0.0.1:{server.server_port}/context.jsonld"
+    monkeypatch.setattr(nquads, "CONTEXTS", {url: "context.jsonld"})
+
+    yield url
+
+    server.shutdown()
+    server.server_close()
+
+
+def test_fetch_contexts(context_url, tmp_path):
+
+    with pytest.raises(FileNotFoundError):
+        check_contexts(tmp_path)
+
+    fetch_contexts(tmp_path)
+
+    assert (tmp_path / "context.jsonld").read_bytes() == DOCUMENT
+    source = json.loads((tmp_path / "sources.json").read_text())["context.jsonld"]
+    assert source["url"] == context_url
+    assert load_context(context_url, tmp_path) == {"oa": "http://www.w3.org/ns/oa#"}
+
+    # An edited copy is refused
+    (tmp_path / "context.jsonld").write_bytes(DOCUMENT.replace(b"oa#", b"oa/"))
+    with pytest.raises(ValueError):
+        load_context(context_url, tmp_path)
+
+
+def test_committed_contexts():
+
+    # The export must work on a fresh checkout, without fetching
+    check_contexts()
@@ -0,0 +1,90 @@
+import os
+import json
+
+import publish as publish_module
+from publish import publish
+
+
+def write(filepath, text):
+
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    with open(filepath, "w") as outfile:
+        outfile.write(text)
+
+
+def run(tmp_path, texts, expire=7):
+
+    rdf = str(tmp_path / "rdf")
+    filepaths = []
+    for name, text in texts.items():
+        write(os.path.join(rdf, name), text)
+        filepaths.append(os.path.join(rdf, name))
+
+    folder = str(tmp_path / "dist")
+    manifest, _ = publish(
+        filepaths, folder, os.path.join(folder, "manifest.json"), rdf, expire
+    )
+
+    return {name: manifest[os.path.join(rdf, name)]["file"] for name in texts}
+
+
+def exists(tmp_path, filename):
+    return os.path.exists(tmp_path / "dist" / filename)
+
+
+def test_hashed_names_keep_the_path(tmp_path):
+
+    files = run(tmp_path, {"metadata.jsonld": "[]", "shards/persons.jsonld": "[1]"})
+
+    assert files["metadata.jsonld"].startswith("metadata.")
+    assert files["shards/persons.jsonld"].startswith("shards/persons.")
+    assert exists(tmp_path, files["shards/persons.jsonld"] + ".gz")
+
+
+def test_previous_files_are_kept(tmp_path):
+
+    first = run(tmp_path, {"metadata.jsonld": "[1]"})["metadata.jsonld"]
+    second = run(tmp_path, {"metadata.jsonld": "[2]"})["metadata.jsonld"]
+
+    # In the previous manifest
+    assert exists(tmp_path, first) and exists(tmp_path, second)
+
+    # Not in the previous manifest, but it has not expired
+    third = run(tmp_path, {"metadata.jsonld": "[3]"})["metadata.jsonld"]
+    assert exists(tmp_path, first)
+
+    with open(tmp_path / "dist" / "retired.json") as infile:
+        assert set(json.load(infile)) >= {first, second}
+
+    # Expired
+    run(tmp_path, {"metadata.jsonld": "[4]"}, expire=0)
+    assert not exists(tmp_path, first)
+    assert not exists(tmp_path, first + ".gz")
+    assert not exists(tmp_path, second)
+    assert exists(tmp_path, third)
+
+
+def test_removed_shards_leave_no_folders(tmp_path):
+
+    run(tmp_path, {"shards/diaries/1/metadata.jsonld": "[]"}, expire=0)
+    run(tmp_path, {"metadata.jsonld": "[]"}, expire=0)
+    run(tmp_path, {"metadata.jsonld": "[]"}, expire=0)
+
+    assert not exists(tmp_path, "shards")
+
+
+def test_published_files_are_not_compressed_again(tmp_path, monkeypatch):
+
+    run(tmp_path, {"metadata.jsonld": "[1]", "concepts.jsonld": "[2]"})
+
+    compressed = []
+    compress_file = publish_module.compress_file
+
+    def record_compress_file(filepath, *args):
+        compressed.append(filepath)
+        return compress_file(filepath, *args)
+
+    monkeypatch.setattr(publish_module, "compress_file", record_compress_file)
+    run(tmp_path, {"metadata.jsonld": "[1]", "concepts.jsonld": "[3]"})
+
+    assert [os.path.basename(f) for f in set(compressed)] == ["concepts.jsonld"]
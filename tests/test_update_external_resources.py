@@ -0,0 +1,407 @@
+import re
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.error import HTTPError
+from urllib.parse import parse_qs
+
+import pandas as pd
+import pytest
+
+import update_external_resources
+from update_external_resources import (
+    BACKOFF,
+    AdamlinkDump,
+    LookupCache,
+    WikidataDump,
+    get_retry_delay,
+    query,
+    resolve,
+)
+
+WIKIDATA = "http://www.wikidata.org/entity/"
+
+
+class FakeSPARQLWrapper:
+    """
+    Stands in for SPARQLWrapper: answers every query with a binding for
+    each URI in its VALUES clause that is not `missing`, after raising the
+    errors in `errors`.
+    """
+
+    queries = []
+    errors = []
+    missing = []
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+
+    def setQuery(self, q):
+        self.q = q
+
+    def setMethod(self, method):
+        self.method = method
+
+    def setReturnFormat(self, return_format):
+        pass
+
+    def query(self):
+
+        self.queries.append(self.q)
+        if self.errors:
+            raise self.errors.pop(0)
+
+        return self
+
+    def convert(self):
+
+        values = re.search(r"VALUES \?uri \{ (.*) \}", self.q).group(1)
+        uris = re.findall(r"<([^>]*)>", values)
+
+        return {
+            "results": {
+                "bindings": [
+                    {"uri": {"value": uri}, "uriLabel": {"value": f"Label {uri}"}}
+                    for uri in uris
+                    if uri not in self.missing
+                ]
+            }
+        }
+
+
+@pytest.fixture
+def sparql(monkeypatch):
+
+    FakeSPARQLWrapper.queries = []
+    FakeSPARQLWrapper.errors = []
+    FakeSPARQLWrapper.missing = []
+    monkeypatch.setattr(update_external_resources, "SPARQLWrapper", FakeSPARQLWrapper)
+
+    # No waiting for the limiter and the retries
+    sleeps = []
+    monkeypatch.setattr(update_external_resources.time, "sleep", sleeps.append)
+    FakeSPARQLWrapper.sleeps = sleeps
+
+    return FakeSPARQLWrapper
+
+
+class SPARQLHandler(BaseHTTPRequestHandler):
+    """
+    A SPARQL endpoint that gives the `responses` of its server in turn, as
+    (status, headers, body), and keeps the POSTed forms.
+    """
+
+    def do_POST(self):
+
+        length = int(self.headers["Content-Length"])
+        self.server.requests.append(parse_qs(self.rfile.read(length).decode()))
+
+        status, headers, body = self.server.responses.pop(0)
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def sparql_server(monkeypatch):
+
+    server = HTTPServer(("127.0.0.1", 0), SPARQLHandler)
+    server.requests = []
+    server.responses = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    sleeps = []
+    monkeypatch.setattr(update_external_resources.time, "sleep", sleeps.append)
+    server.sleeps = sleeps
+    server.endpoint = f"http://127.0.0.1:{server.server_port}/sparql"
+
+    yield server
+
+    server.shutdown()
+    server.server_close()
+
+
+def http_error(code, retry_after=None):
+
+    headers = {"Retry-After": retry_after} if retry_after else {}
+    return HTTPError("https://example.org/sparql", code, "Error", headers, None)
+
+
+def test_retry_delay():
+
+    assert get_retry_delay(http_error(429, "7"), 0) == 7.0
+    assert get_retry_delay(http_error(429), 1) == BACKOFF * 2
+    assert get_retry_delay(http_error(503), 2) == BACKOFF * 4
+    assert get_retry_delay(http_error(404), 0) is None
+    assert get_retry_delay(ValueError("not a network error"), 0) is None
+
+
+def test_query_retries(sparql):
+
+    sparql.errors = [http_error(429, "3"), http_error(503)]
+    q = f"SELECT * WHERE {{ VALUES ?uri {{ <{WIKIDATA}Q1> }} }}"
+
+    bindings = query(q, "https://example.org/sparql")
+
+    assert len(sparql.queries) == 3
+    assert sparql.sleeps == [3.0, BACKOFF * 2]
+    assert bindings[0]["uri"]["value"] == f"{WIKIDATA}Q1"
+
+
+def test_query_gives_up(sparql):
+
+    sparql.errors = [http_error(429)] * 3
+
+    with pytest.raises(HTTPError):
+        query("VALUES ?uri { }", "https://example.org/sparql", retries=2)
+
+    assert len(sparql.queries) == 3
+
+
+def test_resolve_batches_and_caches(sparql, tmp_path):
+
+    uris = [f"{WIKIDATA}Q{n}" for n in range(1, 6)]
+    cache = LookupCache(str(tmp_path / "cache.sqlite"))
+
+    results = resolve(uris, chunk_size=2, cache=cache, workers=1)
+
+    # Five URIs in chunks of two
+    assert len(sparql.queries) == 3
+    assert sorted(q.count(f"<{WIKIDATA}Q") for q in sparql.queries) == [1, 2, 2]
+    assert results[f"{WIKIDATA}Q3"][0] == f"Label {WIKIDATA}Q3"
+    assert cache.misses == 5
+
+    # The second time, everything comes from the cache
+    sparql.queries.clear()
+    assert resolve(uris, chunk_size=2, cache=cache, workers=1) == results
+    assert sparql.queries == []
+    assert cache.hits == 5
+
+    cache.close()
+
+
+def test_resolve_caches_misses(sparql, tmp_path):
+
+    uris = [f"{WIKIDATA}Q1", f"{WIKIDATA}Q2"]
+    sparql.missing = [f"{WIKIDATA}Q2"]
+    cache = LookupCache(str(tmp_path / "cache.sqlite"))
+
+    assert list(resolve(uris, cache=cache, workers=1)) == [f"{WIKIDATA}Q1"]
+    assert len(sparql.queries) == 1
+
+    # The miss is not queried again
+    sparql.queries.clear()
+    assert list(resolve(uris, cache=cache, workers=1)) == [f"{WIKIDATA}Q1"]
+    assert sparql.queries == []
+    assert cache.hits == 2
+
+    # Until it expires, with the same TTL as the results
+    cache.ttl = -1
+    sparql.missing = []
+    assert len(resolve(uris, cache=cache, workers=1)) == 2
+    assert sparql.queries[0].count(f"<{WIKIDATA}Q") == 2
+
+    cache.close()
+
+
+def test_query_server(sparql_server):
+
+    result = {
+        "head": {"vars": ["uri"]},
+        "results": {"bindings": [{"uri": {"type": "uri", "value": f"{WIKIDATA}Q1"}}]},
+    }
+    sparql_server.responses = [
+        (429, {"Retry-After": "3"}, "Too Many Requests"),
+        (500, {}, "Internal Server Error"),
+        (200, {"Content-Type": "application/sparql-results+json"}, json.dumps(result)),
+    ]
+    q = f"SELECT * WHERE {{ VALUES ?uri {{ <{WIKIDATA}Q1> }} }}"
+
+    bindings = query(q, sparql_server.endpoint)
+
+    # A 500 comes back from SPARQLWrapper as an EndPointInternalError
+    assert sparql_server.sleeps == [3.0, BACKOFF * 2]
+    assert bindings == result["results"]["bindings"]
+
+    # The query is in the form encoded POST body, every time
+    assert len(sparql_server.requests) == 3
+    assert all(form["query"] == [q] for form in sparql_server.requests)
+
+
+def test_wikidata_dump(tmp_path):
+
+    entities = [
+        {
+            "id": "Q727",
+            "labels": {"en": {"value": "Amsterdam"}, "nl": {"value": "Amsterdam"}},
+            "descriptions": {"nl": {"value": "hoofdstad van Nederland"}},
+            "claims": {
+                "P31": [{"rank": "normal"}],
+                "P625": [
+                    {
+                        "mainsnak": {
+                            "datavalue": {
+                                "value": {"latitude": 52.37, "longitude": 4.89}
+                            }
+                        }
+                    }
+                ],
+            },
+        },
+        # Without a type
+        {"id": "Q1", "labels": {"en": {"value": "Universe"}}, "claims": {}},
+        # Not wanted
+        {"id": "Q2", "labels": {}, "claims": {"P31": [{"rank": "normal"}]}},
+    ]
+    filepath = tmp_path / "wikidata.json"
+    filepath.write_text(
+        "[\n" + ",\n".join(json.dumps(entity) for entity in entities) + "\n]\n"
+    )
+
+    uris = [WIKIDATA + "Q727", WIKIDATA + "Q1"]
+    dump = WikidataDump(str(filepath), uris)
+
+    assert dump(uris) == {
+        WIKIDATA
+        + "Q727": (
+            "Amsterdam",
+            "hoofdstad van Nederland",
+            52.37,
+            4.89,
+            None,
+        )
+    }
+
+
+ADAMLINK = "https://adamlink.nl/geo/"
+
+ADAMLINK_DUMP = f"""\
+<{ADAMLINK}street/1> <http://www.w3.org/1999/02/22-rdf-syntax-ns#type> <{ADAMLINK}Street> .
+<{ADAMLINK}street/1> <http://www.w3.org/2000/01/rdf-schema#label> "Kalverstraat" .
+<{ADAMLINK}street/1> <http://www.opengis.net/ont/geosparql#hasGeometry> _:g1 .
+_:g1 <http://www.opengis.net/ont/geosparql#asWKT> "LINESTRING(4.0 52.0, 4.2 52.2)" .
+<{ADAMLINK}address/2> <http://www.w3.org/1999/02/22-rdf-syntax-ns#type> <{ADAMLINK}Address> .
+<{ADAMLINK}address/2> <http://www.w3.org/2000/01/rdf-schema#label> "Kalverstraat 1" .
+<{ADAMLINK}address/2> <https://schema.org/description> "Een adres" .
+<{ADAMLINK}address/2> <https://schema.org/geoContains> <{ADAMLINK}point/2> .
+<{ADAMLINK}point/2> <http://www.opengis.net/ont/geosparql#asWKT> "POINT(4.89 52.37)" .
+<{ADAMLINK}street/3> <http://www.w3.org/1999/02/22-rdf-syntax-ns#type> <{ADAMLINK}Street> .
+<{ADAMLINK}street/3> <http://www.w3.org/2000/01/rdf-schema#label> "Damrak" .
+<{ADAMLINK}street/3> <http://www.opengis.net/ont/geosparql#hasGeometry> _:g3 .
+_:g3 <http://www.opengis.net/ont/geosparql#asWKT> "POINT(1 2)" .
+"""
+
+
+@pytest.mark.parametrize("filename", ["adamlink.nt", "adamlink.ttl"])
+def test_adamlink_dump(tmp_path, filename):
+
+    # N-Triples is Turtle as well
+    filepath = tmp_path / filename
+    filepath.write_text(ADAMLINK_DUMP)
+
+    uris = [ADAMLINK + "street/1", ADAMLINK + "address/2"]
+    dump = AdamlinkDump(str(filepath), uris)
+
+    # Only the geometries of the wanted URIs are read
+    wkts = [
+        obj
+        for _, _, obj in dump.triples(
+            lambda subject, predicate: predicate.endswith("#asWKT")
+        )
+    ]
+    assert len(wkts) == 3
+
+    results = dump(uris)
+    assert results == {
+        ADAMLINK
+        + "street/1": (
+            "Kalverstraat",
+            None,
+            pytest.approx(52.1),
+            pytest.approx(4.1),
+            "LINESTRING(4.0 52.0, 4.2 52.2)",
+        ),
+        ADAMLINK
+        + "address/2": (
+            "Kalverstraat 1",
+            "Een adres",
+            pytest.approx(52.37),
+            pytest.approx(4.89),
+            None,
+        ),
+    }
+
+
+def test_main_joins_the_results(tmp_path, capsys):
+
+    entity = {
+        "id": "Q727",
+        "labels": {"nl": {"value": "Amsterdam"}},
+        "claims": {
+            "P31": [{"rank": "normal"}],
+            "P625": [
+                {
+                    "mainsnak": {
+                        "datavalue": {
+                            "value": {"latitude": 52.3727598, "longitude": 4.8936041}
+                        }
+                    }
+                }
+            ],
+        },
+    }
+    wikidata = tmp_path / "wikidata.json"
+    wikidata.write_text(f"[\n{json.dumps(entity)}\n]\n")
+    adamlink = tmp_path / "adamlink.nt"
+    adamlink.write_text(ADAMLINK_DUMP)
+
+    columns = ["index", "annotation", "diary", "tag", "source", "text", "uri"]
+    columns += ["date", "label", "description", "latitude", "longitude", "checken"]
+    rows = [
+        # Twice the same URI
+        {"text": "Amsterdam", "uri": WIKIDATA + "Q727"},
+        {"text": "A'dam", "uri": WIKIDATA + "Q727"},
+        {"text": "Kalverstraat", "uri": ADAMLINK + "street/1"},
+        # Not in the dump
+        {"text": "Ommen", "uri": WIKIDATA + "Q10018"},
+        # Already resolved
+        {
+            "text": "Damrak",
+            "uri": ADAMLINK + "street/3",
+            "label": "Damrak",
+            "latitude": 52.376,
+            "longitude": 4.895,
+        },
+        {"text": "Celina"},
+    ]
+    annotations_file = tmp_path / "annotations_linking.csv"
+    df = pd.DataFrame(rows, columns=columns)
+    df.to_csv(annotations_file, index=False)
+
+    update_external_resources.main(
+        str(annotations_file),
+        cache_file=str(tmp_path / "cache.sqlite"),
+        dumps={"wikidata": str(wikidata), "adamlink": str(adamlink)},
+    )
+
+    assert f"Not resolved: {WIKIDATA}Q10018" in capsys.readouterr().out
+
+    df = pd.read_csv(annotations_file)
+    resolved = df[["label", "latitude", "longitude"]].values.tolist()
+
+    # Rounded to six decimals, and the centroid of a street
+    assert resolved[:3] == [
+        ["Amsterdam", 52.37276, 4.893604],
+        ["Amsterdam", 52.37276, 4.893604],
+        ["Kalverstraat", 52.1, 4.1],
+    ]
+    assert df.loc[3, ["label", "latitude", "longitude"]].isna().all()
+    assert resolved[4] == ["Damrak", 52.376, 4.895]
+    assert df.loc[5, ["label", "latitude", "longitude"]].isna().all()
+    assert df["text"].tolist() == [row["text"] for row in rows]
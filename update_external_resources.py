@@ -1,64 +1,276 @@
-import pandas as pd
+import os
+import re
+import bz2
+import gzip
+import json
+import time
+import sqlite3
+import argparse
+import threading
+from abc import ABC, abstractmethod
+from contextlib import nullcontext
+from urllib.error import HTTPError, URLError
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
+import pandas as pd
 
-from SPARQLWrapper import SPARQLWrapper, JSON
-from shapely import wkt
 
+from SPARQLWrapper import SPARQLWrapper, JSON, POST
+from SPARQLWrapper.SPARQLExceptions import EndPointInternalError
+import shapely
 
 ANNOTATION_IDENTIFIERS = "data/annotations_linking.csv"
 
+# Number of URIs in the VALUES clause of one query
+CHUNK_SIZE = 200
+
+WIKIDATA_ENDPOINT = "https://query.wikidata.org/sparql"
+ADAMLINK_ENDPOINT = (
+    "https://api.lod.uba.uva.nl/datasets/ATM/ATM-KG/services/ATM-KG/sparql"
+)
+
+ENDPOINTS = {
+    "wikidata": WIKIDATA_ENDPOINT,
+    "adamlink": ADAMLINK_ENDPOINT,
+}
+
+# Concurrent requests and requests per second, per endpoint
+LIMITS = {
+    "wikidata": (2, 1.0),
+    "adamlink": (4, 5.0),
+}
+
+# Retries on 429, 5xx and network errors, with exponential backoff
+RETRIES = 5
+BACKOFF = 2.0
+
+WIKIDATA_ENTITY = "http://www.wikidata.org/entity/"
+WIKIDATA_LANGUAGES = ("nl", "en", "de")
+
+RDF_TYPE = "http://www.w3.org/1999/02/22-rdf-syntax-ns#type"
+RDFS_LABEL = "http://www.w3.org/2000/01/rdf-schema#label"
+SCHEMA_DESCRIPTION = "https://schema.org/description"
+SCHEMA_GEOCONTAINS = "https://schema.org/geoContains"
+GEO_HASGEOMETRY = "http://www.opengis.net/ont/geosparql#hasGeometry"
+GEO_ASWKT = "http://www.opengis.net/ont/geosparql#asWKT"
+
+NTRIPLE = re.compile(
+    r"^\s*(<[^>]*>|_:\S+)\s+<([^>]*)>\s+"
+    r'(<[^>]*>|_:\S+|"(?:[^"\\]|\\.)*"(?:@[\w-]+|\^\^<[^>]*>)?)\s*\.\s*$'
+)
+
+# Query results on disk, fetched again after CACHE_TTL days
+CACHE_FILE = "build/external_resources.sqlite"
+CACHE_TTL = 30
+
+# What the cache gives for a URI that its endpoint did not know
+NOT_FOUND = ()
+
+
+class LookupCache:
+    """
+    Query results by endpoint and URI, in SQLite: label, description,
+    latitude, longitude and the WKT of the geometry (Adamlink). URIs that
+    were not found are kept as well, and give NOT_FOUND. Results that are
+    older than `ttl` days count as a miss.
+    """
+
+    def __init__(self, filepath=CACHE_FILE, ttl=CACHE_TTL):
+
+        if os.path.dirname(filepath):
+            os.makedirs(os.path.dirname(filepath), exist_ok=True)
+
+        self.connection = sqlite3.connect(filepath)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS resources (
+                endpoint TEXT,
+                uri TEXT,
+                label TEXT,
+                description TEXT,
+                latitude REAL,
+                longitude REAL,
+                wkt TEXT,
+                fetched REAL,
+                PRIMARY KEY (endpoint, uri)
+            )
+            """)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS not_found (
+                endpoint TEXT,
+                uri TEXT,
+                fetched REAL,
+                PRIMARY KEY (endpoint, uri)
+            )
+            """)
+
+        self.ttl = ttl * 24 * 60 * 60 if ttl else None
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, endpoint, uri):
+
+        row = self.connection.execute(
+            """
+            SELECT label, description, latitude, longitude, wkt, fetched
+            FROM resources WHERE endpoint = ? AND uri = ?
+            """,
+            (endpoint, uri),
+        ).fetchone()
+
+        if row is None:
+            row = self.connection.execute(
+                "SELECT fetched FROM not_found WHERE endpoint = ? AND uri = ?",
+                (endpoint, uri),
+            ).fetchone()
+
+        if row is None or (self.ttl and time.time() - row[-1] > self.ttl):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return row[:-1]
+
+    def update(self, endpoint, results, not_found=()):
+
+        fetched = time.time()
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO resources VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(endpoint, uri, *values, fetched) for uri, values in results.items()],
+            )
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO not_found VALUES (?, ?, ?)",
+                [(endpoint, uri, fetched) for uri in not_found],
+            )
+
+            # Found after all, or no longer
+            self.connection.executemany(
+                "DELETE FROM not_found WHERE endpoint = ? AND uri = ?",
+                [(endpoint, uri) for uri in results],
+            )
+            self.connection.executemany(
+                "DELETE FROM resources WHERE endpoint = ? AND uri = ?",
+                [(endpoint, uri) for uri in not_found],
+            )
+
+    def close(self):
+        self.connection.close()
+
+
+class Limiter:
+    """
+    At most `concurrency` requests at the same time, and at most `rps`
+    requests started per second.
+    """
+
+    def __init__(self, concurrency=1, rps=1.0):
+
+        self.semaphore = threading.BoundedSemaphore(concurrency)
+        self.interval = 1 / rps if rps else 0
+        self.lock = threading.Lock()
+        self.next_start = 0.0
+
+    def __enter__(self):
+
+        self.semaphore.acquire()
+
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_start)
+            self.next_start = start + self.interval
+
+        time.sleep(start - now)
+        return self
+
+    def __exit__(self, *exc):
+        self.semaphore.release()
+
+
+def get_retry_delay(error, attempt):
+
+    if isinstance(error, HTTPError):
+        if error.code != 429 and error.code < 500:
+            return None
+
+        retry_after = error.headers.get("Retry-After") if error.headers else None
+        if retry_after and retry_after.isdigit():
+            return float(retry_after)
+    elif not isinstance(error, (EndPointInternalError, URLError, TimeoutError)):
+        return None
+
+    return BACKOFF * 2**attempt
+
+
+def get_values(uris):
+    return " ".join(f"<{uri}>" for uri in uris)
+
+
+def query(q, endpoint, limiter=None, retries=RETRIES):
+
+    # POST, a few hundred URIs do not fit in a GET request
+    sparql = SPARQLWrapper(endpoint)
+    sparql.setQuery(q)
+    sparql.setMethod(POST)
+    sparql.setReturnFormat(JSON)
+
+    limiter = limiter or nullcontext()
 
-def query_wikidata(uri, endpoint="https://query.wikidata.org/sparql", cache=dict()):
+    for attempt in range(retries + 1):
+        try:
+            with limiter:
+                results = sparql.query().convert()
+            return results["results"]["bindings"]
+        except Exception as e:
+            delay = get_retry_delay(e, attempt)
+            if delay is None or attempt == retries:
+                raise
 
-    if uri in cache:
-        return cache[uri]
+            print(f"Retrying in {delay:.0f}s ({str(e).splitlines()[0]}): {endpoint}")
+            time.sleep(delay)
+
+
+def query_wikidata(uris, endpoint=WIKIDATA_ENDPOINT, limiter=None):
 
     q = """
     SELECT DISTINCT ?uri ?uriLabel ?uriDescription ?latitude ?longitude WHERE {
         ?uri wdt:P31|wdt:P279 [] .
-    
+
         OPTIONAL {
             ?uri p:P625 ?coordinate.
             ?coordinate ps:P625 ?coord.
             ?coordinate psv:P625 ?coordinate_node.
             ?coordinate_node wikibase:geoLongitude ?longitude.
-            ?coordinate_node wikibase:geoLatitude ?latitude.  
+            ?coordinate_node wikibase:geoLatitude ?latitude.
             }
-        
-        VALUES ?uri { <URIHIER> }
+
+        VALUES ?uri { URIHIER }
 
         SERVICE wikibase:label { bd:serviceParam wikibase:language "nl,en,de". }
     }
-    """.replace(
-        "URIHIER", uri
-    )
+    """.replace("URIHIER", get_values(uris))
 
-    print(uri)
+    print(f"Wikidata: {len(uris)} URIs")
 
-    sparql = SPARQLWrapper(endpoint)
-    sparql.setQuery(q)
-    sparql.setReturnFormat(JSON)
-    results = sparql.query().convert()
+    results = dict()
+    for binding in query(q, endpoint, limiter):
+        uri = binding["uri"]["value"]
 
-    label = results["results"]["bindings"][0]["uriLabel"]["value"]
-    description = (
-        results["results"]["bindings"][0].get("uriDescription", {}).get("value")
-    )
-    latitude = results["results"]["bindings"][0].get("latitude", {}).get("value")
-    longitude = results["results"]["bindings"][0].get("longitude", {}).get("value")
+        # The first binding of every URI, as with one query per URI
+        if uri in results:
+            continue
 
-    cache[uri] = label, description, latitude, longitude
-    return label, description, latitude, longitude
+        label = binding["uriLabel"]["value"]
+        description = binding.get("uriDescription", {}).get("value")
+        latitude = binding.get("latitude", {}).get("value")
+        longitude = binding.get("longitude", {}).get("value")
 
+        results[uri] = label, description, latitude, longitude, None
+
+    return results
 
-def query_adamlink(
-    uri,
-    endpoint="https://api.lod.uba.uva.nl/datasets/ATM/ATM-KG/services/ATM-KG/sparql",
-    cache=dict(),
-):
 
-    if uri in cache:
-        return cache[uri]
+def query_adamlink(uris, endpoint=ADAMLINK_ENDPOINT, limiter=None):
 
     q = """
     prefix rdfs: <http://www.w3.org/2000/01/rdf-schema#>
@@ -86,74 +298,532 @@ def query_adamlink(
             # No geof function here?
         }
 
-        VALUES ?uri { <URIHIER> }
+        VALUES ?uri { URIHIER }
     }
-    """.replace(
-        "URIHIER", uri
-    )
+    """.replace("URIHIER", get_values(uris))
 
-    sparql = SPARQLWrapper(endpoint)
-    sparql.setQuery(q)
-    sparql.setReturnFormat(JSON)
-    results = sparql.query().convert()
+    print(f"Adamlink: {len(uris)} URIs")
 
-    label = results["results"]["bindings"][0]["label"]["value"]
-    description = results["results"]["bindings"][0].get("description", {}).get("value")
-    geometryWKT = results["results"]["bindings"][0].get("geometryWKT", {}).get("value")
-    latitude = results["results"]["bindings"][0].get("latitude", {}).get("value")
-    longitude = results["results"]["bindings"][0].get("longitude", {}).get("value")
+    results = dict()
+    for binding in query(q, endpoint, limiter):
+        uri = binding["uri"]["value"]
 
-    if geometryWKT:
-        geometry = wkt.loads(geometryWKT)
-        latitude = geometry.centroid.y
-        longitude = geometry.centroid.x
+        if uri in results:
+            continue
 
-    cache[uri] = label, description, latitude, longitude
-    return label, description, latitude, longitude
+        label = binding["label"]["value"]
+        description = binding.get("description", {}).get("value")
+        geometryWKT = binding.get("geometryWKT", {}).get("value")
+        latitude = binding.get("latitude", {}).get("value")
+        longitude = binding.get("longitude", {}).get("value")
 
+        results[uri] = label, description, latitude, longitude, geometryWKT
 
-def main(annotations_file):
+    return add_centroids(results)
 
-    df = pd.read_csv(annotations_file)
 
-    cache = dict()
+def get_centroids(wkts):
+
+    centroids = shapely.centroid(shapely.from_wkt(wkts, on_invalid="warn"))
+    return shapely.get_y(centroids), shapely.get_x(centroids)
+
+
+def set_coordinates(results, uri2wkt):
+
+    if not uri2wkt:
+        return results
+
+    # All geometries in one go, with the array API of shapely
+    latitudes, longitudes = get_centroids(list(uri2wkt.values()))
+    for uri, latitude, longitude in zip(uri2wkt, latitudes, longitudes):
+        label, description, _, _, geometryWKT = results[uri]
+        results[uri] = (
+            label,
+            description,
+            float(latitude),
+            float(longitude),
+            geometryWKT,
+        )
+
+    return results
+
+
+def add_centroids(results):
+
+    # Streets and buildings get the centroid of their geometry
+    uri2wkt = {uri: values[4] for uri, values in results.items() if values[4]}
+    return set_coordinates(results, uri2wkt)
+
+
+def open_dump(filepath):
+
+    if filepath.endswith(".gz"):
+        return gzip.open(filepath, "rt", encoding="utf-8")
+    elif filepath.endswith(".bz2"):
+        return bz2.open(filepath, "rt", encoding="utf-8")
+
+    return open(filepath, encoding="utf-8")
+
+
+def get_language_value(values, languages=WIKIDATA_LANGUAGES):
+
+    for language in languages:
+        if language in values:
+            return values[language]["value"]
+
+    return None
 
-    for index, row in df.iterrows():
 
-        if pd.isna(row["uri"]):
+def parse_term(term):
+
+    if term.startswith("<"):
+        return term[1:-1]
+    elif term.startswith('"'):
+        lexical = term[1 : term.rindex('"')]
+        lexical = re.sub(
+            r"\\U([0-9A-Fa-f]{8})", lambda m: chr(int(m.group(1), 16)), lexical
+        )
+        try:
+            return json.loads(f'"{lexical}"')
+        except ValueError:
+            return lexical
+
+    return term
+
+
+def parse_ntriples(infile):
+
+    for line in infile:
+        match = NTRIPLE.match(line)
+        if match:
+            subject, predicate, obj = match.groups()
+            yield parse_term(subject), predicate, parse_term(obj)
+
+
+def parse_turtle(infile, keep):
+    """
+    The triples of a Turtle file for which `keep(subject, predicate)` is
+    true. Only those are kept in memory, not the graph. Blank nodes are
+    numbered in the order of the file, the same in every parse.
+    """
+
+    # Only Turtle needs rdflib
+    import rdflib
+
+    triples = []
+    blank_nodes = dict()
+
+    def term(t):
+        if isinstance(t, rdflib.BNode):
+            return blank_nodes.setdefault(t, f"_:b{len(blank_nodes)}")
+        return str(t)
+
+    class Sink(rdflib.Graph):
+        def add(self, triple):
+            subject, predicate, obj = triple
+            subject, predicate = term(subject), str(predicate)
+            if keep(subject, predicate):
+                triples.append((subject, predicate, term(obj)))
+            return self
+
+    Sink().parse(file=infile, format="turtle")
+
+    return triples
+
+
+class LocalResolver(ABC):
+    """
+    Resolve URIs from a local dump instead of a SPARQL endpoint. The dump is
+    read once, on the first lookup, into an index of URI -> (label,
+    description, latitude, longitude, WKT). With `uris`, only those URIs
+    are kept.
+    """
+
+    def __init__(self, filepath, uris=None):
+
+        self.filepath = filepath
+        self.uris = set(uris) if uris is not None else None
+        self.index = None
+        self.lock = threading.Lock()
+
+        # Another version of the dump is another "endpoint" in the cache
+        stat = os.stat(filepath)
+        self.endpoint = (
+            f"file://{os.path.abspath(filepath)}#{stat.st_size}-{stat.st_mtime_ns}"
+        )
+
+    def __call__(self, uris, endpoint=None, limiter=None):
+
+        with self.lock:
+            if self.index is None:
+                start = time.perf_counter()
+                self.index = dict(self.load())
+                seconds = time.perf_counter() - start
+                print(f"{self.filepath}: {len(self.index)} resources ({seconds:.1f}s)")
+
+        return {uri: self.index[uri] for uri in uris if uri in self.index}
+
+    def wanted(self, uri):
+        return self.uris is None or uri in self.uris
+
+    @abstractmethod
+    def load(self):
+        """
+        (URI, (label, description, latitude, longitude, WKT)) pairs of the
+        wanted URIs in the dump.
+        """
+
+
+class WikidataDump(LocalResolver):
+    """
+    A Wikidata JSON dump, or a subset of one: a JSON array with an entity on
+    every line. Gives the same values as `query_wikidata()`.
+    """
+
+    def load(self):
+
+        with open_dump(self.filepath) as infile:
+            for line in infile:
+                line = line.strip().rstrip(",")
+                if line in ("", "[", "]"):
+                    continue
+
+                # Skip the entities that are not needed before parsing them
+                match = re.search(r'"id"\s*:\s*"([^"]+)"', line)
+                if match and not self.wanted(WIKIDATA_ENTITY + match.group(1)):
+                    continue
+
+                entity = json.loads(line)
+                uri = WIKIDATA_ENTITY + entity["id"]
+                if not self.wanted(uri):
+                    continue
+
+                claims = {
+                    prop: [c for c in statements if c.get("rank") != "deprecated"]
+                    for prop, statements in entity.get("claims", {}).items()
+                }
+
+                # ?uri wdt:P31|wdt:P279 []
+                if not claims.get("P31") and not claims.get("P279"):
+                    continue
+
+                # The label service falls back to the identifier
+                label = get_language_value(entity.get("labels", {})) or entity["id"]
+                description = get_language_value(entity.get("descriptions", {}))
+
+                latitude, longitude = None, None
+                for claim in claims.get("P625", []):
+                    value = claim["mainsnak"].get("datavalue", {}).get("value")
+                    if value:
+                        latitude, longitude = value["latitude"], value["longitude"]
+                        break
+
+                yield uri, (label, description, latitude, longitude, None)
+
+
+class AdamlinkDump(LocalResolver):
+    """
+    An Adamlink N-Triples file, or Turtle (.ttl, with rdflib). Gives the same
+    values as `query_adamlink()`. The dump is read twice: for the wanted URIs
+    and their geometries, and then for the WKT of those geometries.
+    """
+
+    def triples(self, keep):
+
+        with open_dump(self.filepath) as infile:
+            if re.search(r"\.ttl(\.gz|\.bz2)?$", self.filepath):
+                yield from parse_turtle(infile, keep)
+            else:
+                for subject, predicate, obj in parse_ntriples(infile):
+                    if keep(subject, predicate):
+                        yield subject, predicate, obj
+
+    def load(self):
+
+        typed = set()
+        labels = dict()
+        descriptions = dict()
+        geometries = defaultdict(list)
+
+        predicates = {
+            RDF_TYPE,
+            RDFS_LABEL,
+            SCHEMA_DESCRIPTION,
+            SCHEMA_GEOCONTAINS,
+            GEO_HASGEOMETRY,
+        }
+
+        def wanted(subject, predicate):
+            return predicate in predicates and self.wanted(subject)
+
+        for subject, predicate, obj in self.triples(wanted):
+            if predicate == RDF_TYPE:
+                typed.add(subject)
+            elif predicate == RDFS_LABEL:
+                labels.setdefault(subject, obj)
+            elif predicate == SCHEMA_DESCRIPTION:
+                descriptions.setdefault(subject, obj)
+            else:
+                geometries[subject].append((predicate, obj))
+
+        # Read again for the WKT of only these geometries
+        nodes = {node for pairs in geometries.values() for _, node in pairs}
+        node2wkt = dict()
+        for node, _, wkt in self.triples(
+            lambda subject, predicate: predicate == GEO_ASWKT and subject in nodes
+        ):
+            node2wkt.setdefault(node, wkt)
+
+        results = dict()
+        addresses = dict()
+        for uri, label in labels.items():
+            if uri not in typed:
+                continue
+
+            geometryWKT = None
+            for predicate, node in geometries[uri]:
+                if node not in node2wkt:
+                    continue
+                elif predicate == SCHEMA_GEOCONTAINS:
+                    # Address
+                    addresses.setdefault(uri, node2wkt[node])
+                elif predicate == GEO_HASGEOMETRY and geometryWKT is None:
+                    # Street / Building
+                    geometryWKT = node2wkt[node]
+
+            results[uri] = label, descriptions.get(uri), None, None, geometryWKT
+
+        results = set_coordinates(results, addresses)
+        return add_centroids(results).items()
+
+
+RESOLVERS = {
+    "wikidata": query_wikidata,
+    "adamlink": query_adamlink,
+}
+
+DUMPS = {
+    "wikidata": WikidataDump,
+    "adamlink": AdamlinkDump,
+}
+
+
+def get_source(uri):
+
+    if "wikidata" in uri:
+        return "wikidata"
+    elif "adamlink" in uri:
+        return "adamlink"
+
+    return None
+
+
+def resolve(
+    uris,
+    chunk_size=CHUNK_SIZE,
+    cache=None,
+    workers=4,
+    endpoints=ENDPOINTS,
+    refresh=False,
+    resolvers=RESOLVERS,
+):
+    """
+    Label, description, latitude, longitude and WKT of every URI, from the
+    cache or with one query per endpoint for every `chunk_size` URIs. The
+    queries run in `workers` threads, within the LIMITS of every endpoint.
+    URIs that are not found, or whose query failed, are left out. URIs of
+    another source get empty values. URIs that are not found are cached too,
+    and not queried again until they expire.
+    """
+
+    results = dict()
+
+    source2uris = dict()
+    for uri in uris:
+        source = get_source(uri)
+        if source is None:
+            results[uri] = "", "", "", "", None
             continue
-        elif pd.notna(row["label"]):
+
+        cached = None
+        if cache is not None and not refresh:
+            cached = cache.get(endpoints[source], uri)
+
+        if cached == NOT_FOUND:
             continue
-        # Diary writers have their own biography in the project
-        # elif row["uri"] in (
-        #     "http://www.wikidata.org/entity/Q113810404",
-        #     "http://www.wikidata.org/entity/Q123396315",
-        #     "http://www.wikidata.org/entity/Q124972258",
-        #     "http://www.wikidata.org/entity/Q124987744",
-        #     "http://www.wikidata.org/entity/Q108534152",
-        #     "http://www.wikidata.org/entity/Q125020291",
-        #     "http://www.wikidata.org/entity/Q65965451",
-        # ):
-        #     continue
-
-        uri = row["uri"]
-        if "wikidata" in uri:
-            label, description, latitude, longitude = query_wikidata(uri, cache=cache)
-        elif "adamlink" in uri:
-            label, description, latitude, longitude = query_adamlink(uri, cache=cache)
+        elif cached is not None:
+            results[uri] = cached
         else:
-            label, description, latitude, longitude = "", "", "", ""
+            source2uris.setdefault(source, []).append(uri)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = dict()
+        for source, source_uris in source2uris.items():
+            limiter = Limiter(*LIMITS[source])
+            for i in range(0, len(source_uris), chunk_size):
+                chunk = source_uris[i : i + chunk_size]
+                future = executor.submit(
+                    resolvers[source], chunk, endpoints[source], limiter
+                )
+                futures[future] = source, chunk
+
+        # One failed query does not stop the others
+        for future in as_completed(futures):
+            source, chunk = futures[future]
+            endpoint = endpoints[source]
+            try:
+                found = future.result()
+            except Exception as e:
+                error = str(e).splitlines()[0]
+                print(f"Query failed ({error}): {endpoint}")
+                continue
+
+            results.update(found)
+            if cache is not None:
+                not_found = [uri for uri in chunk if uri not in found]
+                cache.update(endpoint, found, not_found)
+
+    return results
+
+
+def main(
+    annotations_file,
+    chunk_size=CHUNK_SIZE,
+    workers=4,
+    endpoints=ENDPOINTS,
+    cache_file=CACHE_FILE,
+    ttl=CACHE_TTL,
+    refresh=False,
+    dumps=None,
+):
 
-        df.at[index, "label"] = label
-        df.at[index, "description"] = description
-        df.at[index, "latitude"] = round(float(latitude), 6) if latitude else latitude
-        df.at[index, "longitude"] = (
-            round(float(longitude), 6) if longitude else longitude
-        )
+    df = pd.read_csv(annotations_file)
+
+    # Empty columns are read as floats
+    df = df.astype({"label": object, "description": object})
+
+    cache = LookupCache(cache_file, ttl)
+
+    # Diary writers have their own biography in the project
+    # df = df[~df["uri"].isin([
+    #     "http://www.wikidata.org/entity/Q113810404",
+    #     "http://www.wikidata.org/entity/Q123396315",
+    #     "http://www.wikidata.org/entity/Q124972258",
+    #     "http://www.wikidata.org/entity/Q124987744",
+    #     "http://www.wikidata.org/entity/Q108534152",
+    #     "http://www.wikidata.org/entity/Q125020291",
+    #     "http://www.wikidata.org/entity/Q65965451",
+    # ])]
+
+    # With refresh, every linked resource is fetched again
+    unresolved = df[df["uri"].notna() & (refresh | df["label"].isna())]
+    uris = list(dict.fromkeys(unresolved["uri"]))
+
+    # Local dumps instead of the endpoints, per source
+    resolvers = dict(RESOLVERS)
+    endpoints = dict(endpoints)
+    for source, filepath in (dumps or dict()).items():
+        resolvers[source] = DUMPS[source](filepath, uris)
+        endpoints[source] = resolvers[source].endpoint
+
+    results = resolve(uris, chunk_size, cache, workers, endpoints, refresh, resolvers)
+
+    print(f"Cache: {cache.hits} hits, {cache.misses} misses")
+    cache.close()
+
+    for uri in uris:
+        if uri not in results:
+            print(f"Not resolved: {uri}")
+
+    # Join the results on the URI, and write back the rows that are resolved
+    columns = ["label", "description", "latitude", "longitude"]
+    resolved = pd.DataFrame.from_dict(
+        results, orient="index", columns=columns + ["wkt"]
+    )
+    resolved[["latitude", "longitude"]] = (
+        resolved[["latitude", "longitude"]]
+        .apply(pd.to_numeric, errors="coerce")
+        .round(6)
+    )
+
+    rows = unresolved[["uri"]].join(resolved[columns], on="uri", how="inner")
+    df.loc[rows.index, columns] = rows[columns]
 
     # Save!
     df.to_csv(annotations_file, index=False)
 
 
 if __name__ == "__main__":
-    main(ANNOTATION_IDENTIFIERS)
+    parser = argparse.ArgumentParser(
+        description="Add labels, descriptions and coordinates of the linked resources to the annotation table."
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=CHUNK_SIZE,
+        help=f"Number of URIs per query (default: {CHUNK_SIZE})",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=4,
+        help="Number of queries that run at the same time, over all endpoints (default: 4)",
+    )
+    parser.add_argument(
+        "--wikidata-endpoint",
+        default=WIKIDATA_ENDPOINT,
+        help=f"SPARQL endpoint for Wikidata URIs (default: {WIKIDATA_ENDPOINT})",
+    )
+    parser.add_argument(
+        "--adamlink-endpoint",
+        default=ADAMLINK_ENDPOINT,
+        help=f"SPARQL endpoint for Adamlink URIs (default: {ADAMLINK_ENDPOINT})",
+    )
+    parser.add_argument(
+        "--cache",
+        default=CACHE_FILE,
+        help=f"SQLite file with the query results (default: {CACHE_FILE})",
+    )
+    parser.add_argument(
+        "--ttl",
+        type=float,
+        default=CACHE_TTL,
+        help=f"Days before a cached result is fetched again, 0 to keep them (default: {CACHE_TTL})",
+    )
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="Fetch every linked resource again, also when it has a label, and update the cache",
+    )
+    parser.add_argument(
+        "--wikidata-dump",
+        help="Resolve Wikidata URIs from a local JSON dump (.json, .gz or .bz2) instead of the endpoint",
+    )
+    parser.add_argument(
+        "--adamlink-dump",
+        help="Resolve Adamlink URIs from a local N-Triples or Turtle (.ttl, needs rdflib) file instead of the endpoint",
+    )
+    args = parser.parse_args()
+
+    dumps = {
+        source: filepath
+        for source, filepath in (
+            ("wikidata", args.wikidata_dump),
+            ("adamlink", args.adamlink_dump),
+        )
+        if filepath
+    }
+
+    main(
+        ANNOTATION_IDENTIFIERS,
+        chunk_size=args.chunk_size,
+        workers=args.workers,
+        endpoints={
+            "wikidata": args.wikidata_endpoint,
+            "adamlink": args.adamlink_endpoint,
+        },
+        cache_file=args.cache,
+        ttl=args.ttl,
+        refresh=args.refresh,
+        dumps=dumps,
+    )